@@ -0,0 +1,135 @@
+import threading
+import time
+import logging
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Hashable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class _PendingBatch:
+    def __init__(self):
+        self.items: List[Dict[str, Any]] = []
+        self.futures: List[Future] = []
+        self.enqueued_at: List[float] = []
+        self.full = threading.Event()
+
+
+class MicroBatcher:
+    """
+    Groups compatible generation requests that arrive within a short window
+    and runs them as a single batched pipeline call.
+
+    The first caller for a batch key becomes the batch leader: it waits for
+    the window to elapse (or the batch to fill up), runs the whole batch and
+    hands every other caller its own result. Callers never need a separate
+    dispatcher thread, so this works from any pool of worker threads.
+    """
+
+    def __init__(
+        self,
+        run_batch: Callable[[Hashable, List[Dict[str, Any]]], List[Any]],
+        window_ms: float = 25.0,
+        max_batch_size: int = 4
+    ):
+        """
+        Initialize the batcher.
+
+        Args:
+            run_batch: Callable taking a batch key and a list of items and
+                returning one result per item, in order. An exception
+                instance as a result is raised to that item's caller only.
+            window_ms: How long the leader waits for more requests to join
+            max_batch_size: Largest batch run in one pipeline call
+        """
+        self.run_batch = run_batch
+        self.window_ms = window_ms
+        self.max_batch_size = max_batch_size
+
+        self._pending: Dict[Hashable, _PendingBatch] = {}
+        self._lock = threading.Lock()
+
+        # Statistics
+        self._batches = 0
+        self._items = 0
+        self._max_batch_size_seen = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+        self._size_counts: Dict[int, int] = {}
+
+    def submit(self, key: Hashable, item: Dict[str, Any]) -> Any:
+        """
+        Submit one request and block until its result is available.
+
+        Args:
+            key: Batch compatibility key; only items with equal keys are batched
+            item: Per-request arguments passed through to run_batch
+
+        Returns:
+            The result for this item
+        """
+        future: Future = Future()
+
+        with self._lock:
+            batch = self._pending.get(key)
+            is_leader = batch is None
+            if is_leader:
+                batch = _PendingBatch()
+                self._pending[key] = batch
+            batch.items.append(item)
+            batch.futures.append(future)
+            batch.enqueued_at.append(time.monotonic())
+            if len(batch.items) >= self.max_batch_size:
+                # Close the batch so later requests start a new one
+                self._pending.pop(key, None)
+                batch.full.set()
+
+        if is_leader:
+            batch.full.wait(self.window_ms / 1000.0)
+            with self._lock:
+                if self._pending.get(key) is batch:
+                    del self._pending[key]
+            self._run(key, batch)
+
+        return future.result()
+
+    def _run(self, key: Hashable, batch: _PendingBatch):
+        started = time.monotonic()
+        waits = [started - enqueued for enqueued in batch.enqueued_at]
+        self._record(len(batch.items), waits)
+        logger.info(f"Running batch of {len(batch.items)} (max wait {max(waits) * 1000:.1f} ms)")
+
+        try:
+            results = self.run_batch(key, batch.items)
+        except Exception as e:
+            for future in batch.futures:
+                future.set_exception(e)
+            return
+
+        for future, result in zip(batch.futures, results):
+            if isinstance(result, BaseException):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    def _record(self, size: int, waits: List[float]):
+        with self._lock:
+            self._batches += 1
+            self._items += size
+            self._max_batch_size_seen = max(self._max_batch_size_seen, size)
+            self._size_counts[size] = self._size_counts.get(size, 0) + 1
+            self._total_wait += sum(waits)
+            self._max_wait = max(self._max_wait, max(waits))
+
+    def stats(self) -> Dict[str, Any]:
+        """Return batch-size and wait-time statistics."""
+        with self._lock:
+            return {
+                "batches": self._batches,
+                "items": self._items,
+                "mean_batch_size": self._items / self._batches if self._batches else 0.0,
+                "max_batch_size": self._max_batch_size_seen,
+                "batch_size_counts": dict(self._size_counts),
+                "mean_wait_ms": self._total_wait / self._items * 1000 if self._items else 0.0,
+                "max_wait_ms": self._max_wait * 1000,
+            }
@@ -0,0 +1,29 @@
+from typing import List, Optional, Tuple
+
+import torch
+
+
+def blend_embeddings(weighted: List[Tuple[torch.Tensor, float]]) -> Optional[torch.Tensor]:
+    """
+    Blend prompt embeddings into a single conditioning tensor.
+
+    Each embedding is weighted by its strength and the result is normalized
+    by the total weight, so the blend stays in the range of the text
+    encoder's outputs however many layers are stacked. A layer with strength
+    0 has no effect; raising one layer's strength shifts the blend towards it.
+
+    Args:
+        weighted: (embedding, weight) pairs, all embeddings of the same shape
+
+    Returns:
+        The blended embedding, or None if no entry has a positive weight
+    """
+    weighted = [(embeds, weight) for embeds, weight in weighted if weight > 0]
+    if not weighted:
+        return None
+
+    total = sum(weight for _, weight in weighted)
+    blended = torch.zeros_like(weighted[0][0])
+    for embeds, weight in weighted:
+        blended = blended + embeds * (weight / total)
+    return blended
@@ -0,0 +1,129 @@
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Iterable, Optional, Set, Tuple
+
+import torch
+
+
+def normalize_prompt(text: Optional[str]) -> str:
+    """
+    Normalize a prompt so trivially different spellings share a cache entry.
+
+    Collapses whitespace, drops empty comma-separated parts (left behind when
+    an optional layer prompt is missing) and lowercases, which matches what
+    the CLIP tokenizer does anyway.
+    """
+    if not text:
+        return ""
+    parts = [" ".join(part.split()) for part in text.split(",")]
+    return ", ".join(part for part in parts if part).lower()
+
+
+def tensor_nbytes(value: Any) -> int:
+    """Size in bytes of a tensor or a tuple/list of tensors."""
+    if isinstance(value, torch.Tensor):
+        return value.element_size() * value.nelement()
+    if isinstance(value, (tuple, list)):
+        return sum(tensor_nbytes(v) for v in value)
+    return 0
+
+
+class PromptEmbeddingCache:
+    """
+    Bounded LRU cache of text-encoder outputs.
+
+    Entries are keyed by (model path, normalized prompt), or by any other
+    hashable key such as a per-layer key, and are evicted least recently
+    used first once their combined size exceeds the memory budget.
+    Entries can carry tags (e.g. a layer ID) so everything derived from a
+    deleted layer can be dropped at once.
+    """
+
+    def __init__(self, max_bytes: int = 128 * 1024 * 1024):
+        """
+        Initialize the cache.
+
+        Args:
+            max_bytes: Memory budget for all cached embeddings
+        """
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[Hashable, Tuple[Any, int, Set[Hashable]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(model_path: str, text: Optional[str]) -> Tuple[str, str]:
+        return (model_path, normalize_prompt(text))
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key: Hashable, value: Any, tags: Iterable[Hashable] = ()):
+        size = tensor_nbytes(value)
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            if key in self._entries:
+                _, old_size, old_tags = self._entries.pop(key)
+                self.current_bytes -= old_size
+                tags = set(tags) | old_tags
+            self._entries[key] = (value, size, set(tags))
+            self.current_bytes += size
+
+            while self.current_bytes > self.max_bytes:
+                _, (_, evicted_size, _) = self._entries.popitem(last=False)
+                self.current_bytes -= evicted_size
+                self.evictions += 1
+
+    def add_tags(self, key: Hashable, tags: Iterable[Hashable]):
+        """Attach tags to an existing entry."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry[2].update(tags)
+
+    def invalidate_tag(self, tag: Hashable) -> int:
+        """
+        Drop every entry carrying the given tag.
+
+        Returns:
+            Number of entries removed
+        """
+        with self._lock:
+            keys = [key for key, (_, _, tags) in self._entries.items() if tag in tags]
+            for key in keys:
+                _, size, _ = self._entries.pop(key)
+                self.current_bytes -= size
+            return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self.current_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+            }
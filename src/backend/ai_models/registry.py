@@ -0,0 +1,142 @@
+import threading
+import logging
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, Iterator, Optional
+
+from .stable_diffusion import StableDiffusionModel
+
+logger = logging.getLogger(__name__)
+
+
+class ModelRegistry:
+    """
+    Keeps several StableDiffusionModel instances, one per checkpoint, inside
+    a total memory budget.
+
+    Models are handed out through lease(), which marks them in use and most
+    recently used. When a checkpoint that is not loaded is requested and the
+    budget would be exceeded, the least recently used idle models are
+    unloaded with StableDiffusionModel.unload().
+    """
+
+    def __init__(
+        self,
+        factory: Callable[[str], StableDiffusionModel],
+        default_checkpoint: str,
+        allowed_checkpoints: Iterable[str] = (),
+        memory_budget_bytes: int = 0
+    ):
+        """
+        Initialize the registry.
+
+        Args:
+            factory: Creates a model for a checkpoint path
+            default_checkpoint: Checkpoint used when none is selected
+            allowed_checkpoints: Additional checkpoints that may be selected
+            memory_budget_bytes: Total memory for loaded models. 0 means unlimited.
+        """
+        self.factory = factory
+        self.default_checkpoint = default_checkpoint
+        self.allowed_checkpoints = {default_checkpoint, *allowed_checkpoints}
+        self.memory_budget_bytes = memory_budget_bytes
+
+        self._models: "OrderedDict[str, StableDiffusionModel]" = OrderedDict()
+        self._in_use: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.loads = 0
+        self.evictions = 0
+
+    def is_allowed(self, checkpoint: Optional[str]) -> bool:
+        return checkpoint is None or checkpoint in self.allowed_checkpoints
+
+    def get(self, checkpoint: Optional[str] = None) -> StableDiffusionModel:
+        """
+        Return the model for a checkpoint without leasing it.
+
+        Use this for work that does not touch the pipelines; inference must
+        go through lease() so the model is not evicted mid-run.
+        """
+        checkpoint = checkpoint or self.default_checkpoint
+        if not self.is_allowed(checkpoint):
+            raise ValueError(f"Unknown checkpoint: {checkpoint}")
+        with self._lock:
+            model = self._models.get(checkpoint)
+            if model is None:
+                model = self.factory(checkpoint)
+                self._models[checkpoint] = model
+            return model
+
+    @contextmanager
+    def lease(self, checkpoint: Optional[str] = None) -> Iterator[StableDiffusionModel]:
+        """
+        Use the model for a checkpoint, evicting idle models if needed.
+
+        Args:
+            checkpoint: Checkpoint path. None selects the default checkpoint.
+
+        Yields:
+            The model; it is not evicted until the lease ends
+        """
+        checkpoint = checkpoint or self.default_checkpoint
+        model = self.get(checkpoint)
+
+        with self._lock:
+            self._models.move_to_end(checkpoint)
+            self._in_use[checkpoint] = self._in_use.get(checkpoint, 0) + 1
+            if model.is_loaded:
+                self.hits += 1
+            else:
+                self.loads += 1
+                # Make room for the incoming weights, assuming they are about
+                # as large as the largest model loaded so far
+                estimate = max((self._model_bytes(m) for m in self._models.values()), default=0)
+                self._enforce_budget(incoming_bytes=estimate)
+
+        try:
+            yield model
+        finally:
+            with self._lock:
+                self._in_use[checkpoint] -= 1
+                if not self._in_use[checkpoint]:
+                    del self._in_use[checkpoint]
+                self._enforce_budget()
+
+    def _enforce_budget(self, incoming_bytes: int = 0):
+        """Unload least recently used idle models until the budget is met."""
+        if not self.memory_budget_bytes:
+            return
+
+        for checkpoint, model in list(self._models.items()):
+            loaded_bytes = sum(self._model_bytes(m) for m in self._models.values())
+            if loaded_bytes + incoming_bytes <= self.memory_budget_bytes:
+                return
+            if checkpoint in self._in_use or not model.is_loaded:
+                continue
+            logger.info(f"Evicting checkpoint {checkpoint} to stay within the memory budget")
+            model.unload()
+            self.evictions += 1
+
+    @staticmethod
+    def _model_bytes(model: StableDiffusionModel) -> int:
+        return model.memory_report()["total"] if model.is_loaded else 0
+
+    def models(self) -> Dict[str, StableDiffusionModel]:
+        with self._lock:
+            return dict(self._models)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "loads": self.loads,
+                "evictions": self.evictions,
+                "memory_budget_bytes": self.memory_budget_bytes,
+                "loaded": {
+                    checkpoint: self._model_bytes(model)
+                    for checkpoint, model in self._models.items()
+                    if model.is_loaded
+                },
+            }
@@ -4,26 +4,117 @@ from diffusers import StableDiffusionPipeline, StableDiffusionInpaintPipeline
 from diffusers import DDIMScheduler, EulerDiscreteScheduler, DPMSolverMultistepScheduler
 from PIL import Image
 import uuid
-from typing import Dict, Any, Optional, Tuple, List
+import copy
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Any, Callable, Optional, Tuple, List
 import logging
 
+from .batching import MicroBatcher
+from .prompt_cache import PromptEmbeddingCache, normalize_prompt
+from .composition import blend_embeddings
+
 logger = logging.getLogger(__name__)
 
+# Samplers selectable per request, built from the loaded scheduler config
+# with these extra options
+SCHEDULERS = {
+    "ddim": (DDIMScheduler, {}),
+    "euler": (EulerDiscreteScheduler, {}),
+    "dpm++": (DPMSolverMultistepScheduler, {"algorithm_type": "dpmsolver++", "use_karras_sigmas": True}),
+}
+
+# Named sampler settings; explicit request settings override them
+SAMPLER_PRESETS = {
+    # DPM++ converges in far fewer steps than DDIM; for quick previews
+    "fast": {"scheduler": "dpm++", "num_inference_steps": 14},
+}
+
+def resolve_sampler_settings(settings: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """
+    Expand a "preset" entry in generation settings and validate the scheduler.
+    
+    Args:
+        settings: Generation settings, optionally with "preset" and "scheduler"
+        
+    Returns:
+        Settings with the preset's values filled in where not set explicitly
+        
+    Raises:
+        ValueError: If the preset or scheduler is unknown
+    """
+    if not settings:
+        return settings
+    settings = dict(settings)
+    preset = settings.pop("preset", None)
+    if preset is not None:
+        if preset not in SAMPLER_PRESETS:
+            raise ValueError(f"Unknown preset: {preset}")
+        settings = {**SAMPLER_PRESETS[preset], **settings}
+    scheduler = settings.get("scheduler")
+    if scheduler is not None and scheduler not in SCHEDULERS:
+        raise ValueError(f"Unknown scheduler: {scheduler}")
+    return settings
+
+class GenerationCancelled(Exception):
+    """
+    Raised from a step callback to stop a generation at the current step.
+    
+    The pipeline call is aborted, so no image is decoded or saved.
+    """
+
+def set_inference_threads(num_threads: int):
+    """
+    Set the intra-op thread budget for inference run on the calling thread.
+    
+    Used as a worker-thread initializer so several CPU inferences can run
+    side by side, each on its own share of the cores.
+    """
+    torch.set_num_threads(num_threads)
+
 class StableDiffusionModel:
     """
     Abstraction layer for Stable Diffusion models.
     Handles text-to-image and image-to-image generation with various models.
     """
     
-    def __init__(self, model_path: str = "runwayml/stable-diffusion-v1-5", device: str = None):
+    def __init__(
+        self,
+        model_path: str = "runwayml/stable-diffusion-v1-5",
+        device: str = None,
+        batch_window_ms: float = 0,
+        max_batch_size: int = 4,
+        prompt_cache: PromptEmbeddingCache = None,
+        concurrent: bool = False,
+        stage_observer: Callable[[str, float], None] = None,
+        output_dir: str = "generated"
+    ):
         """
         Initialize the Stable Diffusion model.
         
         Args:
             model_path: Path to the model or model identifier from huggingface.co/models
             device: Device to use (cuda, cpu, mps). If None, will use CUDA if available.
+            batch_window_ms: How long to gather concurrent text-to-image requests
+                into one batch. 0 disables micro-batching.
+            max_batch_size: Largest number of requests run in one batched call
+            prompt_cache: Cache of text-encoder outputs. If given, prompts are
+                encoded once and passed to the pipeline as embeddings.
+            concurrent: Whether several threads may run inference at once. Each
+                call then gets its own scheduler, since schedulers keep
+                per-run state.
+            stage_observer: Called with (stage, seconds) for each inference
+                stage: "encode", "denoise", "decode" and "save"
+            output_dir: Where images and embeddings saved without an explicit
+                output_path are written
         """
         self.model_path = model_path
+        self.prompt_cache = prompt_cache
+        self.max_batch_size = max_batch_size
+        self.concurrent = concurrent
+        self.stage_observer = stage_observer
+        self.output_dir = output_dir
         
         # Determine device
         if device is None:
@@ -38,55 +129,215 @@ class StableDiffusionModel:
         # Initialize pipelines to None (will be loaded on demand)
         self.txt2img_pipeline = None
         self.inpaint_pipeline = None
+        self._load_lock = threading.RLock()
+        
+        # Scheduler prototypes per (pipeline, scheduler name); every call
+        # runs on a copy because schedulers keep per-run state
+        self._schedulers: Dict[Tuple[int, str], Any] = {}
         
-        # Create output directories if they don't exist
-        os.makedirs("uploads", exist_ok=True)
-        os.makedirs("generated", exist_ok=True)
+        # Seconds spent in each loading and warm-up stage
+        self.load_timings: Dict[str, float] = {}
+        
+        # Group concurrent text-to-image requests into batched pipeline calls
+        self.batcher = None
+        if batch_window_ms > 0:
+            self.batcher = MicroBatcher(
+                self._run_txt2img_batch,
+                window_ms=batch_window_ms,
+                max_batch_size=max_batch_size
+            )
         
     def _load_txt2img_pipeline(self):
         """Load the text-to-image pipeline if not already loaded."""
-        if self.txt2img_pipeline is None:
+        if self.txt2img_pipeline is not None:
+            return
+        
+        with self._load_lock:
+            if self.txt2img_pipeline is not None:
+                return
+            
+            if self.inpaint_pipeline is not None:
+                # Reuse the weights already loaded for inpainting
+                logger.info("Building text-to-image pipeline from shared components")
+                with self._timed("txt2img.build"):
+                    scheduler = DDIMScheduler.from_config(self.inpaint_pipeline.scheduler.config)
+                    self.txt2img_pipeline = StableDiffusionPipeline(
+                        **self._shared_components(self.inpaint_pipeline),
+                        scheduler=scheduler,
+                        requires_safety_checker=False
+                    )
+                return
+            
             logger.info(f"Loading text-to-image pipeline from {self.model_path}")
             
             # Load the pipeline with a scheduler that supports img2img
-            scheduler = DDIMScheduler.from_pretrained(
-                self.model_path, subfolder="scheduler"
-            )
+            with self._timed("txt2img.scheduler"):
+                scheduler = DDIMScheduler.from_pretrained(
+                    self.model_path, subfolder="scheduler"
+                )
             
-            self.txt2img_pipeline = StableDiffusionPipeline.from_pretrained(
-                self.model_path,
-                scheduler=scheduler,
-                safety_checker=None,  # Disable safety checker for performance
-                torch_dtype=torch.float16 if self.device == "cuda" else torch.float32
-            )
+            with self._timed("txt2img.weights"):
+                pipeline = StableDiffusionPipeline.from_pretrained(
+                    self.model_path,
+                    scheduler=scheduler,
+                    safety_checker=None,  # Disable safety checker for performance
+                    torch_dtype=torch.float16 if self.device == "cuda" else torch.float32
+                )
             
-            self.txt2img_pipeline.to(self.device)
+            with self._timed("txt2img.to_device"):
+                pipeline.to(self.device)
             
             # Enable memory efficient attention if using CUDA
             if self.device == "cuda":
-                self.txt2img_pipeline.enable_xformers_memory_efficient_attention()
-                
+                with self._timed("txt2img.attention"):
+                    pipeline.enable_xformers_memory_efficient_attention()
+            
+            self.txt2img_pipeline = pipeline
             logger.info("Text-to-image pipeline loaded successfully")
     
     def _load_inpaint_pipeline(self):
         """Load the inpainting pipeline if not already loaded."""
-        if self.inpaint_pipeline is None:
+        if self.inpaint_pipeline is not None:
+            return
+        
+        with self._load_lock:
+            if self.inpaint_pipeline is not None:
+                return
+            
+            if self.txt2img_pipeline is not None:
+                # Reuse the weights already loaded for text-to-image, with a
+                # scheduler of its own so the pipelines can run side by side
+                logger.info("Building inpainting pipeline from shared components")
+                with self._timed("inpaint.build"):
+                    scheduler = DDIMScheduler.from_config(self.txt2img_pipeline.scheduler.config)
+                    self.inpaint_pipeline = StableDiffusionInpaintPipeline(
+                        **self._shared_components(self.txt2img_pipeline),
+                        scheduler=scheduler,
+                        requires_safety_checker=False
+                    )
+                return
+            
             logger.info(f"Loading inpainting pipeline from {self.model_path}")
             
-            self.inpaint_pipeline = StableDiffusionInpaintPipeline.from_pretrained(
-                self.model_path,
-                safety_checker=None,  # Disable safety checker for performance
-                torch_dtype=torch.float16 if self.device == "cuda" else torch.float32
-            )
+            with self._timed("inpaint.weights"):
+                pipeline = StableDiffusionInpaintPipeline.from_pretrained(
+                    self.model_path,
+                    safety_checker=None,  # Disable safety checker for performance
+                    torch_dtype=torch.float16 if self.device == "cuda" else torch.float32
+                )
             
-            self.inpaint_pipeline.to(self.device)
+            with self._timed("inpaint.to_device"):
+                pipeline.to(self.device)
             
             # Enable memory efficient attention if using CUDA
             if self.device == "cuda":
-                self.inpaint_pipeline.enable_xformers_memory_efficient_attention()
-                
+                with self._timed("inpaint.attention"):
+                    pipeline.enable_xformers_memory_efficient_attention()
+            
+            self.inpaint_pipeline = pipeline
             logger.info("Inpainting pipeline loaded successfully")
     
+    @property
+    def is_loaded(self) -> bool:
+        """Whether any pipeline is currently loaded."""
+        return self.txt2img_pipeline is not None or self.inpaint_pipeline is not None
+    
+    @contextmanager
+    def _stage(self, stage: str):
+        """Report how long an inference stage takes to the stage observer."""
+        if self.stage_observer is None:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stage_observer(stage, time.perf_counter() - start)
+    
+    def _default_output_path(self, filename: str) -> str:
+        """Return a path in output_dir for a file saved without an explicit path."""
+        os.makedirs(self.output_dir, exist_ok=True)
+        return os.path.join(self.output_dir, filename)
+    
+    @contextmanager
+    def _timed(self, stage: str):
+        """Record how long a loading or warm-up stage takes."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.load_timings[stage] = time.perf_counter() - start
+            logger.info(f"{stage} took {self.load_timings[stage]:.2f}s")
+    
+    def warm_up(self, pipelines: List[str] = ("txt2img", "inpaint"), size: int = 64):
+        """
+        Load pipelines and run a tiny one-step inference through each.
+        
+        The dummy run primes memory allocators and compute kernels so the
+        first real request does not pay for them.
+        
+        Args:
+            pipelines: Pipelines to warm up ("txt2img" and/or "inpaint")
+            size: Width and height of the dummy image
+        """
+        for name in pipelines:
+            if name == "txt2img":
+                self._load_txt2img_pipeline()
+                with self._timed("txt2img.warmup"):
+                    self.txt2img_pipeline(
+                        prompt="warm-up",
+                        width=size,
+                        height=size,
+                        num_inference_steps=1
+                    )
+            elif name == "inpaint":
+                self._load_inpaint_pipeline()
+                with self._timed("inpaint.warmup"):
+                    self.inpaint_pipeline(
+                        prompt="warm-up",
+                        image=Image.new("RGB", (size, size)),
+                        mask_image=Image.new("RGB", (size, size), "white"),
+                        width=size,
+                        height=size,
+                        num_inference_steps=1
+                    )
+            else:
+                raise ValueError(f"Unknown pipeline: {name}")
+    
+    @staticmethod
+    def _shared_components(pipeline) -> Dict[str, Any]:
+        """Components of a loaded pipeline that another pipeline can reuse."""
+        return {
+            name: component
+            for name, component in pipeline.components.items()
+            if name != "scheduler"
+        }
+    
+    def memory_report(self) -> Dict[str, int]:
+        """
+        Report resident memory of the loaded model components.
+        
+        Components shared between the text-to-image and inpainting pipelines
+        are counted once.
+        
+        Returns:
+            Bytes used by each component's parameters and buffers, plus a "total"
+        """
+        report = {}
+        seen = set()
+        for pipeline in (self.txt2img_pipeline, self.inpaint_pipeline):
+            if pipeline is None:
+                continue
+            for name, component in pipeline.components.items():
+                if not isinstance(component, torch.nn.Module) or id(component) in seen:
+                    continue
+                seen.add(id(component))
+                tensors = list(component.parameters()) + list(component.buffers())
+                report[name] = report.get(name, 0) + sum(t.element_size() * t.nelement() for t in tensors)
+        
+        report["total"] = sum(report.values())
+        return report
+    
     def generate_image(
         self,
         prompt: str,
@@ -97,8 +348,13 @@ class StableDiffusionModel:
         guidance_scale: float = 7.5,
         seed: int = None,
         output_path: str = None,
+        prompt_embeds: torch.Tensor = None,
+        negative_prompt_embeds: torch.Tensor = None,
+        step_callback: Callable[[int, int, torch.Tensor], None] = None,
+        scheduler: str = None,
+        save: bool = True,
         **kwargs
-    ) -> Tuple[Image.Image, str]:
+    ) -> Tuple[Image.Image, Optional[str]]:
         """
         Generate an image from a text prompt.
         
@@ -111,40 +367,431 @@ class StableDiffusionModel:
             guidance_scale: Guidance scale for classifier-free guidance
             seed: Random seed for reproducibility
             output_path: Path to save the generated image
+            prompt_embeds: Precomputed conditioning; replaces encoding the prompt
+            negative_prompt_embeds: Precomputed negative conditioning
+            step_callback: Called after every denoising step with
+                (step, total steps, latents). Raising GenerationCancelled
+                stops the generation.
+            scheduler: Sampler to use, one of SCHEDULERS. None keeps the
+                pipeline's default.
+            save: Whether to save the image. Callers storing the image
+                themselves pass False.
             **kwargs: Additional arguments to pass to the pipeline
             
         Returns:
-            Tuple of (PIL Image, output path)
+            Tuple of (PIL Image, output path); the path is None if not saved
+            
+        Raises:
+            GenerationCancelled: If the step callback cancelled the run
         """
         self._load_txt2img_pipeline()
         
-        # Set the seed for reproducibility
-        if seed is not None:
-            torch.manual_seed(seed)
-            torch.cuda.manual_seed(seed) if self.device == "cuda" else None
+        if self.batcher is not None and not kwargs:
+            # Share a batched UNet pass with compatible concurrent requests
+            logger.info(f"Queueing prompt for batched generation: {prompt}")
+            image = self.batcher.submit(
+                (width, height, num_inference_steps, guidance_scale, scheduler),
+                {
+                    "prompt": prompt,
+                    "negative_prompt": negative_prompt,
+                    "prompt_embeds": prompt_embeds,
+                    "negative_prompt_embeds": negative_prompt_embeds,
+                    "step_callback": step_callback,
+                    "seed": seed
+                }
+            )
+        else:
+            # Seed a generator of our own so concurrent requests stay reproducible
+            kwargs.setdefault("generator", self._make_generator(seed))
+            if step_callback is not None:
+                kwargs.update(self._step_callbacks([step_callback], num_inference_steps))
+            
+            # Generate the image
+            logger.info(f"Generating image with prompt: {prompt}")
+            output = self._run_pipeline(
+                self._pipeline_for_call(self.txt2img_pipeline, scheduler),
+                **self._prompt_inputs(prompt, negative_prompt, prompt_embeds, negative_prompt_embeds),
+                width=width,
+                height=height,
+                num_inference_steps=num_inference_steps,
+                guidance_scale=guidance_scale,
+                **kwargs
+            )
+            
+            image = output.images[0]
         
-        # Generate the image
-        logger.info(f"Generating image with prompt: {prompt}")
-        output = self.txt2img_pipeline(
-            prompt=prompt,
-            negative_prompt=negative_prompt,
+        if not save:
+            return image, None
+        
+        # Save the image if output_path is provided
+        if output_path is None:
+            output_path = self._default_output_path(f"{uuid.uuid4()}.png")
+        
+        with self._stage("save"):
+            image.save(output_path)
+        logger.info(f"Image saved to {output_path}")
+        
+        return image, output_path
+    
+    def generate_batch(
+        self,
+        prompts: List[str],
+        negative_prompts: List[Optional[str]] = None,
+        seeds: List[Optional[int]] = None,
+        width: int = 512,
+        height: int = 512,
+        num_inference_steps: int = 30,
+        guidance_scale: float = 7.5,
+        prompt_embeds: List[Optional[torch.Tensor]] = None,
+        negative_prompt_embeds: List[Optional[torch.Tensor]] = None,
+        step_callbacks: List[Optional[Callable[[int, int, torch.Tensor], None]]] = None,
+        scheduler: str = None,
+        **kwargs
+    ) -> List[Image.Image]:
+        """
+        Generate one image per prompt in a single batched pipeline call.
+        
+        Args:
+            prompts: Text prompts, one per image
+            negative_prompts: Negative prompts, one per image
+            seeds: Random seeds, one per image. None picks a random seed.
+            prompt_embeds: Precomputed conditioning per image; None entries
+                are encoded from the matching prompt
+            negative_prompt_embeds: Precomputed negative conditioning per image
+            step_callbacks: Per-image step callbacks, each called with
+                (step, total steps, that image's latents). A callback raising
+                GenerationCancelled drops its image; the call is only aborted
+                once every image is cancelled.
+            width: Output image width
+            height: Output image height
+            num_inference_steps: Number of denoising steps
+            guidance_scale: Guidance scale for classifier-free guidance
+            scheduler: Sampler to use, one of SCHEDULERS. None keeps the
+                pipeline's default.
+            **kwargs: Additional arguments to pass to the pipeline
+            
+        Returns:
+            List of PIL Images in the same order as the prompts, with a
+            GenerationCancelled instance in place of each cancelled image
+            
+        Raises:
+            GenerationCancelled: If every image was cancelled
+        """
+        self._load_txt2img_pipeline()
+        
+        if seeds is None:
+            seeds = [None] * len(prompts)
+        if negative_prompts is not None and all(p is None for p in negative_prompts):
+            negative_prompts = None
+        elif negative_prompts is not None:
+            negative_prompts = [p or "" for p in negative_prompts]
+        if prompt_embeds is not None and all(e is None for e in prompt_embeds):
+            prompt_embeds = None
+        if negative_prompt_embeds is not None and all(e is None for e in negative_prompt_embeds):
+            negative_prompt_embeds = None
+        
+        # One generator per item keeps every image reproducible from its own seed
+        generators = [self._make_generator(seed) for seed in seeds]
+        cancelled: Dict[int, GenerationCancelled] = {}
+        if step_callbacks is not None and any(step_callbacks):
+            kwargs.update(self._step_callbacks(step_callbacks, num_inference_steps, cancelled))
+        
+        logger.info(f"Generating batch of {len(prompts)} images")
+        output = self._run_pipeline(
+            self._pipeline_for_call(self.txt2img_pipeline, scheduler),
+            **self._prompt_inputs(prompts, negative_prompts, prompt_embeds, negative_prompt_embeds),
             width=width,
             height=height,
             num_inference_steps=num_inference_steps,
             guidance_scale=guidance_scale,
+            generator=generators,
             **kwargs
         )
         
-        image = output.images[0]
+        return [cancelled.get(index, image) for index, image in enumerate(output.images)]
+    
+    def _run_txt2img_batch(self, key: Tuple, items: List[Dict[str, Any]]) -> List[Image.Image]:
+        """Run a batch gathered by the micro-batcher."""
+        width, height, num_inference_steps, guidance_scale, scheduler = key
+        return self.generate_batch(
+            prompts=[item["prompt"] for item in items],
+            negative_prompts=[item["negative_prompt"] for item in items],
+            seeds=[item["seed"] for item in items],
+            prompt_embeds=[item.get("prompt_embeds") for item in items],
+            negative_prompt_embeds=[item.get("negative_prompt_embeds") for item in items],
+            step_callbacks=[item.get("step_callback") for item in items],
+            width=width,
+            height=height,
+            num_inference_steps=num_inference_steps,
+            guidance_scale=guidance_scale,
+            scheduler=scheduler
+        )
+    
+    def encode_prompt(self, text: Optional[str], tags: Tuple = ()) -> torch.Tensor:
+        """
+        Encode a prompt with the text encoder, using the prompt cache if enabled.
         
-        # Save the image if output_path is provided
-        if output_path is None:
-            output_path = f"generated/{uuid.uuid4()}.png"
+        Args:
+            text: Prompt to encode. None encodes the empty prompt.
+            tags: Cache tags for the entry, e.g. the layers the prompt came from
+            
+        Returns:
+            Prompt embeddings of shape (1, max_length, hidden_size)
+        """
+        self._load_txt2img_pipeline()
         
-        image.save(output_path)
-        logger.info(f"Image saved to {output_path}")
+        key = None
+        if self.prompt_cache is not None:
+            key = self.prompt_cache.make_key(self.model_path, text)
+            embeds = self.prompt_cache.get(key)
+            if embeds is not None:
+                if tags:
+                    self.prompt_cache.add_tags(key, tags)
+                return embeds
         
-        return image, output_path
+        embeds = self._encode_text(text)
+        if key is not None:
+            self.prompt_cache.put(key, embeds, tags=tags)
+        return embeds
+    
+    def _encode_text(self, text: Optional[str]) -> torch.Tensor:
+        """Run the text encoder on a normalized prompt, bypassing the cache."""
+        tokenizer = self.txt2img_pipeline.tokenizer
+        text_inputs = tokenizer(
+            normalize_prompt(text),
+            padding="max_length",
+            max_length=tokenizer.model_max_length,
+            truncation=True,
+            return_tensors="pt"
+        )
+        with self._stage("encode"), torch.no_grad():
+            return self.txt2img_pipeline.text_encoder(text_inputs.input_ids.to(self.device))[0]
+    
+    def _prompt_inputs(
+        self,
+        prompt,
+        negative_prompt,
+        prompt_embeds=None,
+        negative_prompt_embeds=None
+    ) -> Dict[str, Any]:
+        """
+        Build the prompt arguments for a pipeline call.
+        
+        Without a prompt cache or precomputed embeddings the raw strings are
+        passed through and the pipeline encodes them. Otherwise embeddings are
+        passed instead, encoding (through the cache) whatever is missing, so
+        repeated prompts skip the text encoder.
+        
+        Each argument is either a single value or a list with one entry per image.
+        """
+        if self.prompt_cache is None and prompt_embeds is None and negative_prompt_embeds is None:
+            return {"prompt": prompt, "negative_prompt": negative_prompt}
+        
+        batch_size = 1
+        for value in (prompt, negative_prompt, prompt_embeds, negative_prompt_embeds):
+            if isinstance(value, list):
+                batch_size = len(value)
+        
+        def per_item(value):
+            return value if isinstance(value, list) else [value] * batch_size
+        
+        def embeddings(texts, embeds):
+            return torch.cat([
+                e if e is not None else self.encode_prompt(t)
+                for t, e in zip(per_item(texts), per_item(embeds))
+            ])
+        
+        return {
+            "prompt_embeds": embeddings(prompt, prompt_embeds),
+            "negative_prompt_embeds": embeddings(negative_prompt, negative_prompt_embeds),
+        }
+    
+    def encode_layer(self, layer: Dict[str, Any], negative: bool = False) -> Optional[torch.Tensor]:
+        """
+        Encode a single styling layer's prompt, cached per layer ID.
+        
+        The cache key holds the layer ID and its prompt text but not its
+        strength, so re-weighting a layer never re-runs the text encoder.
+        
+        Args:
+            layer: Layer configuration with "prompt", "negative_prompt" and optional "id"
+            negative: Encode the layer's negative prompt instead of its prompt
+            
+        Returns:
+            Prompt embeddings, or None if the layer has no such prompt
+        """
+        text = layer.get("negative_prompt" if negative else "prompt")
+        if not text:
+            return None
+        
+        layer_id = layer.get("id")
+        if layer_id is None or self.prompt_cache is None:
+            return self.encode_prompt(text)
+        
+        key = (self.model_path, f"layer:{layer_id}:{'negative' if negative else 'prompt'}", normalize_prompt(text))
+        embeds = self.prompt_cache.get(key)
+        if embeds is None:
+            self._load_txt2img_pipeline()
+            embeds = self._encode_text(text)
+            self.prompt_cache.put(key, embeds, tags=[("layer", layer_id)])
+        return embeds
+    
+    def compose_conditioning(
+        self,
+        prompt: str,
+        negative_prompt: str,
+        layers: List[Dict[str, Any]],
+        encodings: Optional[Dict[Any, Optional[torch.Tensor]]] = None
+    ) -> Tuple[torch.Tensor, torch.Tensor]:
+        """
+        Compose the conditioning for a request from per-layer embeddings.
+        
+        The request prompt and every layer are encoded separately and blended,
+        with each layer weighted by its strength and the request prompt by 1.
+        Negative prompts are blended the same way.
+        
+        Args:
+            prompt: Request prompt
+            negative_prompt: Request negative prompt
+            layers: Layer configurations with "prompt", "negative_prompt" and "strength"
+            encodings: Encodings shared across calls that combine the same
+                prompts and layers, filled in as they are encoded. Used even
+                when there is no prompt cache.
+            
+        Returns:
+            Tuple of (prompt embeddings, negative prompt embeddings)
+        """
+        if encodings is None:
+            encodings = {}
+        
+        def encoded(key, encode):
+            if key not in encodings:
+                encodings[key] = encode()
+            return encodings[key]
+        
+        positive = []
+        negative = []
+        if prompt:
+            positive.append((encoded(("prompt", prompt), lambda: self.encode_prompt(prompt)), 1.0))
+        if negative_prompt:
+            negative.append((encoded(("prompt", negative_prompt), lambda: self.encode_prompt(negative_prompt)), 1.0))
+        
+        for layer in layers:
+            strength = layer.get("strength")
+            strength = 1.0 if strength is None else strength
+            layer_key = layer.get("id", id(layer))
+            layer_embeds = encoded(("layer", layer_key), lambda: self.encode_layer(layer))
+            if layer_embeds is not None:
+                positive.append((layer_embeds, strength))
+            layer_negative_embeds = encoded(("negative_layer", layer_key), lambda: self.encode_layer(layer, negative=True))
+            if layer_negative_embeds is not None:
+                negative.append((layer_negative_embeds, strength))
+        
+        prompt_embeds = blend_embeddings(positive)
+        if prompt_embeds is None:
+            prompt_embeds = encoded(("prompt", ""), lambda: self.encode_prompt(""))
+        negative_prompt_embeds = blend_embeddings(negative)
+        if negative_prompt_embeds is None:
+            negative_prompt_embeds = encoded(("prompt", ""), lambda: self.encode_prompt(""))
+        
+        return prompt_embeds, negative_prompt_embeds
+    
+    def _pipeline_for_call(self, pipeline, scheduler: Optional[str] = None):
+        """
+        Return the pipeline to run one inference call on.
+        
+        Schedulers hold per-run state (timesteps, solver history), so
+        concurrent calls, and calls selecting a scheduler, each get a shallow
+        copy of the pipeline that shares all weights but has a scheduler of
+        its own. Nothing is reloaded to switch schedulers.
+        """
+        if scheduler is None and not self.concurrent:
+            return pipeline
+        prototype = pipeline.scheduler if scheduler is None else self._scheduler_prototype(pipeline, scheduler)
+        view = copy.copy(pipeline)
+        view.scheduler = copy.deepcopy(prototype)
+        return view
+    
+    def _run_pipeline(self, pipeline, **kwargs):
+        """
+        Call a pipeline, reporting denoising and decoding time separately.
+        
+        Denoising ends at the last step callback; everything after it (VAE
+        decode, safety checker, conversion to PIL) counts as decoding.
+        """
+        if self.stage_observer is None:
+            return pipeline(**kwargs)
+        
+        step_callback = kwargs.get("callback")
+        callback_steps = kwargs.get("callback_steps") or 1
+        started = time.perf_counter()
+        last_step = started
+        
+        def callback(step, timestep, latents):
+            nonlocal last_step
+            if step_callback is not None and step % callback_steps == 0:
+                step_callback(step, timestep, latents)
+            last_step = time.perf_counter()
+        
+        kwargs.update(callback=callback, callback_steps=1)
+        output = pipeline(**kwargs)
+        finished = time.perf_counter()
+        self.stage_observer("denoise", last_step - started)
+        self.stage_observer("decode", finished - last_step)
+        return output
+    
+    def _scheduler_prototype(self, pipeline, name: str):
+        """Build, or return the cached, scheduler of the given kind for a pipeline."""
+        if name not in SCHEDULERS:
+            raise ValueError(f"Unknown scheduler: {name}")
+        key = (id(pipeline), name)
+        with self._load_lock:
+            prototype = self._schedulers.get(key)
+            if prototype is None:
+                scheduler_class, options = SCHEDULERS[name]
+                prototype = scheduler_class.from_config(pipeline.scheduler.config, **options)
+                self._schedulers[key] = prototype
+            return prototype
+    
+    @staticmethod
+    def _step_callbacks(
+        callbacks: List[Optional[Callable]],
+        num_inference_steps: int,
+        cancelled: Optional[Dict[int, GenerationCancelled]] = None
+    ) -> Dict[str, Any]:
+        """
+        Build the pipeline's per-step callback arguments.
+        
+        The pipeline reports latents for the whole batch; each callback only
+        receives the slice for its own image. Images whose callback raises
+        GenerationCancelled are recorded in cancelled and get no further
+        callbacks; the pipeline call is aborted once all of them are.
+        """
+        if cancelled is None:
+            cancelled = {}
+        
+        def callback(step, timestep, latents):
+            for index, step_callback in enumerate(callbacks):
+                if step_callback is None or index in cancelled:
+                    continue
+                try:
+                    step_callback(step + 1, num_inference_steps, latents[index:index + 1])
+                except GenerationCancelled as e:
+                    cancelled[index] = e
+            if len(cancelled) == len(callbacks):
+                raise next(iter(cancelled.values()))
+        
+        return {"callback": callback, "callback_steps": 1}
+    
+    def _make_generator(self, seed: Optional[int] = None) -> torch.Generator:
+        """Create a random generator, seeded if a seed is given."""
+        # MPS does not support device generators, so sample on the CPU there
+        generator = torch.Generator(device="cpu" if self.device == "mps" else self.device)
+        if seed is None:
+            generator.seed()
+        else:
+            generator.manual_seed(seed)
+        return generator
     
     def inpaint_image(
         self,
@@ -156,8 +803,11 @@ class StableDiffusionModel:
         guidance_scale: float = 7.5,
         seed: int = None,
         output_path: str = None,
+        step_callback: Callable[[int, int, torch.Tensor], None] = None,
+        scheduler: str = None,
+        save: bool = True,
         **kwargs
-    ) -> Tuple[Image.Image, str]:
+    ) -> Tuple[Image.Image, Optional[str]]:
         """
         Inpaint an image based on a mask and prompt.
         
@@ -170,17 +820,27 @@ class StableDiffusionModel:
             guidance_scale: Guidance scale for classifier-free guidance
             seed: Random seed for reproducibility
             output_path: Path to save the inpainted image
+            step_callback: Called after every denoising step with
+                (step, total steps, latents). Raising GenerationCancelled
+                stops the inpainting.
+            scheduler: Sampler to use, one of SCHEDULERS. None keeps the
+                pipeline's default.
+            save: Whether to save the image. Callers storing the image
+                themselves pass False.
             **kwargs: Additional arguments to pass to the pipeline
             
         Returns:
-            Tuple of (PIL Image, output path)
+            Tuple of (PIL Image, output path); the path is None if not saved
+            
+        Raises:
+            GenerationCancelled: If the step callback cancelled the run
         """
         self._load_inpaint_pipeline()
         
-        # Set the seed for reproducibility
-        if seed is not None:
-            torch.manual_seed(seed)
-            torch.cuda.manual_seed(seed) if self.device == "cuda" else None
+        # Seed a generator of our own so concurrent requests stay reproducible
+        kwargs.setdefault("generator", self._make_generator(seed))
+        if step_callback is not None:
+            kwargs.update(self._step_callbacks([step_callback], num_inference_steps))
         
         # Ensure images are in RGB mode
         image = image.convert("RGB")
@@ -188,7 +848,8 @@ class StableDiffusionModel:
         
         # Generate the inpainted image
         logger.info(f"Inpainting image with prompt: {prompt}")
-        output = self.inpaint_pipeline(
+        output = self._run_pipeline(
+            self._pipeline_for_call(self.inpaint_pipeline, scheduler),
             prompt=prompt,
             image=image,
             mask_image=mask_image,
@@ -200,11 +861,15 @@ class StableDiffusionModel:
         
         inpainted_image = output.images[0]
         
+        if not save:
+            return inpainted_image, None
+        
         # Save the image if output_path is provided
         if output_path is None:
-            output_path = f"generated/{uuid.uuid4()}.png"
+            output_path = self._default_output_path(f"{uuid.uuid4()}.png")
         
-        inpainted_image.save(output_path)
+        with self._stage("save"):
+            inpainted_image.save(output_path)
         logger.info(f"Inpainted image saved to {output_path}")
         
         return inpainted_image, output_path
@@ -238,7 +903,7 @@ class StableDiffusionModel:
         
         # Simulate embedding creation
         if output_path is None:
-            output_path = f"generated/embedding_{uuid.uuid4()}.pt"
+            output_path = self._default_output_path(f"embedding_{uuid.uuid4()}.pt")
         
         # Create a dummy embedding file
         with open(output_path, "w") as f:
@@ -277,43 +942,191 @@ class StableDiffusionModel:
         """
         self._load_txt2img_pipeline()
         
-        # Combine prompts from all layers
-        combined_prompt = prompt
-        combined_negative_prompt = negative_prompt
+        # The layers are not joined into the prompt; their encodings are
+        # blended with the prompt's, weighted by layer strength
+        layers = [layer for layer in (hair_layer, outfit_layer, scene_layer) if layer]
+        prompt_embeds, negative_prompt_embeds = self.compose_conditioning(prompt, negative_prompt, layers)
         
-        if hair_layer:
-            combined_prompt += f", {hair_layer.get('prompt', '')}"
-            if hair_layer.get('negative_prompt'):
-                combined_negative_prompt += f", {hair_layer.get('negative_prompt')}"
+        layer_summary = ", ".join(f"{layer.get('id')} x{layer.get('strength', 1.0)}" for layer in layers)
+        logger.info(f"Applying styling layers [{layer_summary}] to prompt: {prompt}")
+        return self.generate_image(
+            prompt=prompt,
+            negative_prompt=negative_prompt,
+            output_path=output_path,
+            prompt_embeds=prompt_embeds,
+            negative_prompt_embeds=negative_prompt_embeds,
+            **kwargs
+        )
+    
+    def apply_styling_layer_combinations(
+        self,
+        base_model_path: str,
+        combinations: List[Tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]], Optional[Dict[str, Any]]]],
+        prompt: str = "",
+        negative_prompt: str = "",
+        seeds: List[Optional[int]] = None,
+        batch_size: int = None,
+        step_callback: Callable[[int, int, torch.Tensor], None] = None,
+        num_inference_steps: int = 30,
+        **kwargs
+    ) -> List[Image.Image]:
+        """
+        Generate one image per combination of styling layers, in batches.
+        
+        Each layer and prompt is encoded once for all combinations, and the
+        combinations run through the pipeline batch_size at a time.
+        
+        Args:
+            base_model_path: Path to the base model embedding
+            combinations: (hair, outfit, scene) layer configurations, any of
+                which may be None
+            prompt: Additional text prompt
+            negative_prompt: Negative text prompt
+            seeds: Random seeds, one per combination. None picks random seeds.
+            batch_size: Images per pipeline call; defaults to max_batch_size
+            step_callback: Called after every denoising step with (step, total
+                steps, latents of the batch's first image), counting steps
+                across all batches. Raising GenerationCancelled stops the
+                remaining batches.
+            num_inference_steps: Number of denoising steps per image
+            **kwargs: Additional arguments to pass to generate_batch
+            
+        Returns:
+            List of PIL Images in the same order as the combinations
+            
+        Raises:
+            GenerationCancelled: If the step callback cancelled the run
+        """
+        self._load_txt2img_pipeline()
         
-        if outfit_layer:
-            combined_prompt += f", {outfit_layer.get('prompt', '')}"
-            if outfit_layer.get('negative_prompt'):
-                combined_negative_prompt += f", {outfit_layer.get('negative_prompt')}"
+        if seeds is None:
+            seeds = [None] * len(combinations)
+        batch_size = batch_size or self.max_batch_size
+        batches = [range(start, min(start + batch_size, len(combinations))) for start in range(0, len(combinations), batch_size)]
+        total_steps = len(batches) * num_inference_steps
         
-        if scene_layer:
-            combined_prompt += f", {scene_layer.get('prompt', '')}"
-            if scene_layer.get('negative_prompt'):
-                combined_negative_prompt += f", {scene_layer.get('negative_prompt')}"
+        encodings: Dict[Any, Optional[torch.Tensor]] = {}
+        conditioning = [
+            self.compose_conditioning(prompt, negative_prompt, [layer for layer in layers if layer], encodings)
+            for layers in combinations
+        ]
         
-        # Generate the image with combined styling
-        logger.info(f"Applying styling layers with combined prompt: {combined_prompt}")
-        return self.generate_image(
-            prompt=combined_prompt,
-            negative_prompt=combined_negative_prompt,
-            output_path=output_path,
+        images: List[Image.Image] = []
+        for number, batch in enumerate(batches):
+            step_callbacks = None
+            if step_callback is not None:
+                step_callbacks = self._batch_step_callbacks(step_callback, len(batch), number * num_inference_steps, total_steps)
+            logger.info(f"Generating layer combinations {batch.start + 1}-{batch.stop} of {len(combinations)}")
+            images.extend(self.generate_batch(
+                prompts=[prompt] * len(batch),
+                seeds=[seeds[index] for index in batch],
+                prompt_embeds=[conditioning[index][0] for index in batch],
+                negative_prompt_embeds=[conditioning[index][1] for index in batch],
+                step_callbacks=step_callbacks,
+                num_inference_steps=num_inference_steps,
+                **kwargs
+            ))
+        return images
+    
+    def apply_styling_layer_variations(
+        self,
+        base_model_path: str,
+        seeds: List[Optional[int]],
+        hair_layer: Dict[str, Any] = None,
+        outfit_layer: Dict[str, Any] = None,
+        scene_layer: Dict[str, Any] = None,
+        prompt: str = "",
+        negative_prompt: str = "",
+        step_callback: Callable[[int, int, torch.Tensor], None] = None,
+        num_inference_steps: int = 30,
+        **kwargs
+    ) -> List[Image.Image]:
+        """
+        Generate variations of one styled prompt, one per seed, in a single batch.
+        
+        The conditioning is composed once and shared by every image, so only
+        the seeds differ.
+        
+        Args:
+            base_model_path: Path to the base model embedding
+            seeds: Random seed of each image. None entries pick a random seed.
+            hair_layer: Hair styling layer configuration
+            outfit_layer: Outfit styling layer configuration
+            scene_layer: Scene styling layer configuration
+            prompt: Additional text prompt
+            negative_prompt: Negative text prompt
+            step_callback: Called after every denoising step with (step, total
+                steps, latents of the first image). Raising
+                GenerationCancelled stops the whole batch.
+            num_inference_steps: Number of denoising steps
+            **kwargs: Additional arguments to pass to generate_batch
+            
+        Returns:
+            List of PIL Images in the same order as the seeds
+            
+        Raises:
+            GenerationCancelled: If the step callback cancelled the run
+        """
+        self._load_txt2img_pipeline()
+        
+        layers = [layer for layer in (hair_layer, outfit_layer, scene_layer) if layer]
+        prompt_embeds, negative_prompt_embeds = self.compose_conditioning(prompt, negative_prompt, layers)
+        
+        step_callbacks = None
+        if step_callback is not None:
+            step_callbacks = self._batch_step_callbacks(step_callback, len(seeds), 0, num_inference_steps)
+        logger.info(f"Generating {len(seeds)} variations of prompt: {prompt}")
+        return self.generate_batch(
+            prompts=[prompt] * len(seeds),
+            seeds=seeds,
+            prompt_embeds=[prompt_embeds] * len(seeds),
+            negative_prompt_embeds=[negative_prompt_embeds] * len(seeds),
+            step_callbacks=step_callbacks,
+            num_inference_steps=num_inference_steps,
             **kwargs
         )
     
+    @staticmethod
+    def _batch_step_callbacks(
+        step_callback: Callable[[int, int, torch.Tensor], None],
+        batch_size: int,
+        offset: int,
+        total_steps: int
+    ) -> List[Callable[[int, int, torch.Tensor], None]]:
+        """
+        Report a whole batch's progress through one callback.
+        
+        Only the first image reports; once it is cancelled the others are
+        too, so the batch call is aborted rather than finishing without it.
+        """
+        cancelled: List[GenerationCancelled] = []
+        
+        def first(step, _, latents):
+            try:
+                step_callback(offset + step, total_steps, latents)
+            except GenerationCancelled as e:
+                cancelled.append(e)
+                raise
+        
+        def rest(step, _, latents):
+            if cancelled:
+                raise cancelled[0]
+        
+        return [first] + [rest] * (batch_size - 1)
+    
     def unload(self):
         """Unload models from GPU memory."""
-        if self.txt2img_pipeline is not None:
-            del self.txt2img_pipeline
-            self.txt2img_pipeline = None
+        with self._load_lock:
+            # Both pipelines must go for the shared components to be freed
+            if self.txt2img_pipeline is not None:
+                del self.txt2img_pipeline
+                self.txt2img_pipeline = None
+                
+            if self.inpaint_pipeline is not None:
+                del self.inpaint_pipeline
+                self.inpaint_pipeline = None
             
-        if self.inpaint_pipeline is not None:
-            del self.inpaint_pipeline
-            self.inpaint_pipeline = None
+            self._schedulers.clear()
             
         if self.device == "cuda":
             torch.cuda.empty_cache()
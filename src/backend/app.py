@@ -1,22 +1,46 @@
-from fastapi import FastAPI, Depends, HTTPException, status, UploadFile, File, Form
+from fastapi import FastAPI, Depends, HTTPException, status, UploadFile, File, Form, Request, Response
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy.orm import Session
-from typing import List, Optional, Dict, Any
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
+from typing import List, Optional, Dict, Any, Union
 import os
-import shutil
 from datetime import datetime, timedelta
 from jose import JWTError, jwt
-from passlib.context import CryptContext
 from PIL import Image
 import logging
+import threading
+import asyncio
+import json
+import contextvars
+import itertools
+import random
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
 
-from . import models, schemas
-from .database import SessionLocal, engine, get_db
-from .ai_models.stable_diffusion import StableDiffusionModel
+from . import metrics, migrations, models, schemas
+from .database import SessionLocal, engine, get_async_db
+from .ai_models.stable_diffusion import StableDiffusionModel, GenerationCancelled, resolve_sampler_settings, set_inference_threads
+from .ai_models.prompt_cache import PromptEmbeddingCache
+from .ai_models.registry import ModelRegistry
+from .ai_models.previews import latents_to_preview, preview_data_url
+from .jobs import JobQueue, JobStatus, current_job
+from .pagination import keyset, split_page
+from .result_cache import ResultCache, canonical_request_key
+from .file_serving import file_digests, file_response
+from .lookbook_entries import LookbookAppender
+from .passwords import PasswordHasher, PasswordHasherBusy, hash_password, verify_password as check_password
+from .storage import ContentStore
+from .thumbnails import ThumbnailStore
+from .user_cache import UserCache
+from .uploads import ImageHeader, RequestSizeLimitMiddleware, UploadRejected, UploadTooLarge, read_upload
 
-# Create database tables
+# Create database tables and bring existing ones up to date
 models.Base.metadata.create_all(bind=engine)
+migrations.upgrade(engine)
 
 # Setup logging
 logging.basicConfig(level=logging.INFO)
@@ -29,6 +53,11 @@ app = FastAPI(
     version="1.0.0",
 )
 
+# Bound request bodies before FastAPI spools uploads to disk. Middleware
+# added later wraps this one, so CORS headers still reach its 413s
+MAX_REQUEST_MB = int(os.getenv("MAX_REQUEST_MB", "100"))
+app.add_middleware(RequestSizeLimitMiddleware, max_bytes=MAX_REQUEST_MB * 1024 * 1024)
+
 # Configure CORS
 app.add_middleware(
     CORSMiddleware,
@@ -36,6 +65,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 
 # Security configuration
@@ -43,27 +73,237 @@ SECRET_KEY = os.getenv("SECRET_KEY", "development_secret_key")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
-# Password hashing
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Password hashing runs on its own processes. Logins beyond LOGIN_MAX_PENDING
+# get a 503 with Retry-After rather than queueing ahead of other requests
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", "2"))
+LOGIN_MAX_PENDING = int(os.getenv("LOGIN_MAX_PENDING", str(max(1, PASSWORD_HASH_WORKERS) * 4)))
+LOGIN_RETRY_AFTER_SECONDS = float(os.getenv("LOGIN_RETRY_AFTER_SECONDS", "1"))
+password_hasher = PasswordHasher(
+    max_workers=PASSWORD_HASH_WORKERS,
+    max_pending=LOGIN_MAX_PENDING,
+    retry_after=LOGIN_RETRY_AFTER_SECONDS
+)
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
+# Authenticated users by token subject, so requests skip the user lookup.
+# Updates through the API invalidate entries at once; the TTL bounds how long
+# changes made elsewhere (another process, the database directly) take to apply
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "1024"))
+USER_CACHE_TTL_SECONDS = float(os.getenv("USER_CACHE_TTL_SECONDS", "60"))
+user_cache = UserCache(max_entries=USER_CACHE_SIZE, ttl_seconds=USER_CACHE_TTL_SECONDS)
+
 # Initialize AI model
-sd_model = StableDiffusionModel()
+INFERENCE_WORKERS = int(os.getenv("INFERENCE_WORKERS", "1"))
+BATCH_WINDOW_MS = float(os.getenv("BATCH_WINDOW_MS", "0"))
+if BATCH_WINDOW_MS > 0 and INFERENCE_WORKERS <= 1:
+    # A single worker submits one request at a time, so the batcher would
+    # never see a second one and the window would only add latency
+    logger.warning(
+        f"BATCH_WINDOW_MS={BATCH_WINDOW_MS:g} has no effect with INFERENCE_WORKERS={INFERENCE_WORKERS}; "
+        "batching is disabled"
+    )
+    BATCH_WINDOW_MS = 0
+MAX_BATCH_SIZE = int(os.getenv("MAX_BATCH_SIZE", "4"))
+# Most images one /generate/matrix/ request may ask for
+MAX_MATRIX_SIZE = int(os.getenv("MAX_MATRIX_SIZE", "64"))
+# Most seed variations one /generate/ request may render in its pipeline call
+MAX_VARIATIONS = int(os.getenv("MAX_VARIATIONS", "8"))
+PROMPT_CACHE_MB = int(os.getenv("PROMPT_CACHE_MB", "128"))
+prompt_cache = PromptEmbeddingCache(max_bytes=PROMPT_CACHE_MB * 1024 * 1024)
+
+# Checkpoints clients and models can select, loaded on demand within a memory budget
+SD_MODEL_PATH = os.getenv("SD_MODEL_PATH", "runwayml/stable-diffusion-v1-5")
+SD_CHECKPOINTS = [path.strip() for path in os.getenv("SD_CHECKPOINTS", "").split(",") if path.strip()]
+MODEL_MEMORY_BUDGET_MB = int(os.getenv("MODEL_MEMORY_BUDGET_MB", "0"))
+
+def _create_sd_model(checkpoint: str) -> StableDiffusionModel:
+    return StableDiffusionModel(
+        model_path=checkpoint,
+        batch_window_ms=BATCH_WINDOW_MS,
+        max_batch_size=MAX_BATCH_SIZE,
+        prompt_cache=prompt_cache,
+        concurrent=INFERENCE_WORKERS > 1,
+        stage_observer=metrics.observe_stage,
+        output_dir=GENERATED_FOLDER
+    )
+
+model_registry = ModelRegistry(
+    _create_sd_model,
+    default_checkpoint=SD_MODEL_PATH,
+    allowed_checkpoints=SD_CHECKPOINTS,
+    memory_budget_bytes=MODEL_MEMORY_BUDGET_MB * 1024 * 1024
+)
+
+# Results of seeded generations, reused for identical requests
+RESULT_CACHE_SIZE = int(os.getenv("RESULT_CACHE_SIZE", "1024"))
+result_cache = ResultCache(max_entries=RESULT_CACHE_SIZE)
+
+# Progress streaming: render a latent preview every N denoising steps (0 disables)
+PREVIEW_EVERY_STEPS = int(os.getenv("PREVIEW_EVERY_STEPS", "5"))
+JOB_EVENT_INTERVAL_SECONDS = 0.25
+
+# Pipelines to load and prime at startup, e.g. "txt2img,inpaint"
+WARMUP_PIPELINES = [name.strip() for name in os.getenv("WARMUP_PIPELINES", "").split(",") if name.strip()]
+warmup_state = {"status": "pending", "error": None}
+
+# Prometheus metrics, served on /metrics
+HTTP_REQUESTS = metrics.REGISTRY.counter(
+    "stunning_http_requests_total",
+    "HTTP requests by endpoint and status code",
+    ["method", "endpoint", "status"]
+)
+HTTP_REQUEST_SECONDS = metrics.REGISTRY.histogram(
+    "stunning_http_request_duration_seconds",
+    "HTTP request handling time by endpoint",
+    ["method", "endpoint"]
+)
+# Count every request and report where its time went in a Server-Timing header
+app.add_middleware(metrics.RequestMetricsMiddleware, requests=HTTP_REQUESTS, durations=HTTP_REQUEST_SECONDS)
+USER_CACHE_LOOKUPS = metrics.REGISTRY.counter(
+    "stunning_user_cache_lookups_total",
+    "Authenticated user lookups by cache result",
+    ["result"]
+)
+LOGINS_REJECTED = metrics.REGISTRY.counter(
+    "stunning_logins_rejected_total",
+    "Logins turned away because too many were already being verified"
+)
+JOBS = metrics.REGISTRY.counter(
+    "stunning_jobs_total",
+    "Finished background jobs by kind and outcome",
+    ["kind", "status"]
+)
+metrics.REGISTRY.gauge(
+    "stunning_queue_depth",
+    "Jobs waiting for a free inference worker",
+    function=lambda: job_queue.queue_depth
+)
+metrics.REGISTRY.gauge(
+    "stunning_jobs_running",
+    "Jobs currently running on inference workers",
+    function=lambda: job_queue.stats()["running"]
+)
+metrics.REGISTRY.gauge(
+    "stunning_loaded_pipelines",
+    "Pipelines loaded per checkpoint",
+    ["checkpoint", "pipeline"],
+    function=lambda: {
+        (checkpoint, pipeline): 1
+        for checkpoint, sd_model in model_registry.models().items()
+        for pipeline, loaded in (("txt2img", sd_model.txt2img_pipeline), ("inpaint", sd_model.inpaint_pipeline))
+        if loaded is not None
+    }
+)
+metrics.REGISTRY.gauge(
+    "stunning_model_memory_bytes",
+    "Memory used by loaded model components per checkpoint",
+    ["checkpoint"],
+    function=lambda: {(checkpoint,): size for checkpoint, size in model_registry.stats()["loaded"].items()}
+)
+
+# Background inference workers, each with its own share of the CPU cores
+INFERENCE_THREADS_PER_WORKER = int(os.getenv("INFERENCE_THREADS_PER_WORKER", str(max(1, (os.cpu_count() or 1) // INFERENCE_WORKERS))))
+
+def _record_finished_job(job):
+    JOBS.inc(kind=job.kind, status=job.status)
+
+job_queue = JobQueue(
+    num_workers=INFERENCE_WORKERS,
+    initializer=set_inference_threads,
+    initargs=(INFERENCE_THREADS_PER_WORKER,),
+    on_finish=_record_finished_job
+)
+
+# Uploaded and generated files, named by content hash in sharded directories
+UPLOAD_FOLDER = os.getenv("UPLOAD_FOLDER", "uploads")
+GENERATED_FOLDER = os.getenv("GENERATED_FOLDER", "generated")
+upload_store = ContentStore(UPLOAD_FOLDER)
+generated_store = ContentStore(GENERATED_FOLDER)
+
+# Upload limits: per file (checked once FastAPI has spooled it) and largest
+# image side in pixels; the request body limit is set with the middleware
+MAX_UPLOAD_MB = int(os.getenv("MAX_UPLOAD_MB", "20"))
+MAX_IMAGE_DIMENSION = int(os.getenv("MAX_IMAGE_DIMENSION", "4096"))
+
+async def _store_upload(upload: UploadFile) -> str:
+    # Stream an uploaded image into the store, validating it on the way;
+    # it is stored under the extension of its actual format
+    header = ImageHeader(max_dimension=MAX_IMAGE_DIMENSION)
+    try:
+        return await upload_store.put_stream(
+            read_upload(upload, MAX_UPLOAD_MB * 1024 * 1024, header),
+            lambda: header.extension
+        )
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=f"{upload.filename}: {e}")
+    except UploadRejected as e:
+        raise HTTPException(status_code=415, detail=f"{upload.filename}: {e}")
+
+# WebP thumbnails for galleries, rendered when a history entry is written
+# or on first request for older entries
+THUMBNAIL_FOLDER = os.getenv("THUMBNAIL_FOLDER", "thumbnails")
+THUMBNAIL_SIZES = [int(size) for size in os.getenv("THUMBNAIL_SIZES", "128,256,512").split(",") if size.strip()]
+THUMBNAIL_WORKERS = int(os.getenv("THUMBNAIL_WORKERS", "2"))
+thumbnail_store = ThumbnailStore(
+    ContentStore(THUMBNAIL_FOLDER),
+    file_digests,
+    sizes=THUMBNAIL_SIZES,
+    max_workers=THUMBNAIL_WORKERS
+)
+
+# Encoding of generated images; clients and individual requests may pick another format
+OUTPUT_FORMAT = os.getenv("OUTPUT_FORMAT", "png")
+PNG_COMPRESS_LEVEL = int(os.getenv("PNG_COMPRESS_LEVEL", "1"))
+JPEG_QUALITY = int(os.getenv("JPEG_QUALITY", "95"))
+OUTPUT_FORMATS = {
+    # PIL format, file extension, encoder options
+    "png": ("PNG", "png", {"compress_level": PNG_COMPRESS_LEVEL}),
+    "webp": ("WEBP", "webp", {"lossless": True, "quality": 25, "method": 2}),
+    "jpeg": ("JPEG", "jpg", {"quality": JPEG_QUALITY, "subsampling": 0}),
+}
+
+# Images are encoded and written on their own threads so inference workers
+# can start the next job while the previous result is being saved
+IMAGE_WRITER_WORKERS = int(os.getenv("IMAGE_WRITER_WORKERS", "2"))
+image_writer = ThreadPoolExecutor(max_workers=IMAGE_WRITER_WORKERS, thread_name_prefix="image-writer")
+
+# Appends lookbook entries with unique orders, even from concurrent jobs
+lookbook_appender = LookbookAppender(models.Lookbook, models.LookbookEntry)
 
-# Create required directories
-os.makedirs("uploads", exist_ok=True)
-os.makedirs("generated", exist_ok=True)
+def _thumbnail_urls(history_id: int) -> Dict[str, str]:
+    return {str(size): f"/histories/{history_id}/thumbnails/{size}" for size in thumbnail_store.sizes}
+
+def _find_thumbnail(source_path: str, size: int) -> Optional[str]:
+    # Touches the disk, so handlers run it on a worker thread
+    if not os.path.isfile(source_path):
+        raise FileNotFoundError(source_path)
+    return thumbnail_store.find(source_path, size)
+
+# Browsers may keep served images for this long; their URLs always map to the same content
+IMAGE_CACHE_MAX_AGE = int(os.getenv("IMAGE_CACHE_MAX_AGE", str(365 * 24 * 3600)))
+
+async def _image_response(path: Optional[str], request: Request) -> Response:
+    # Only files inside the upload, generated and thumbnail stores are ever served
+    roots = [os.path.realpath(store.root) for store in (upload_store, generated_store, thumbnail_store)]
+    real_path = os.path.realpath(path) if path else None
+    if real_path is None or not any(real_path.startswith(root + os.sep) for root in roots) or not os.path.isfile(real_path):
+        raise HTTPException(status_code=404, detail="Image not found")
+    return await file_response(
+        real_path,
+        request.headers,
+        cache_control=f"private, max-age={IMAGE_CACHE_MAX_AGE}, immutable"
+    )
 
 # Security functions
 def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+    return check_password(plain_password, hashed_password)
 
 def get_password_hash(password):
-    return pwd_context.hash(password)
+    return hash_password(password)
 
-def authenticate_user(db: Session, username: str, password: str):
-    user = db.query(models.User).filter(models.User.username == username).first()
-    if not user or not verify_password(password, user.hashed_password):
+async def authenticate_user(db: AsyncSession, username: str, password: str):
+    user = (await db.execute(select(models.User).where(models.User.username == username))).scalar_one_or_none()
+    if not user or not await password_hasher.verify(password, user.hashed_password):
         return False
     return user
 
@@ -77,7 +317,7 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_async_db)):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -91,9 +331,19 @@ async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = De
         token_data = schemas.TokenData(username=username)
     except JWTError:
         raise credentials_exception
-    user = db.query(models.User).filter(models.User.username == token_data.username).first()
-    if user is None:
+    
+    user = user_cache.get(token_data.username)
+    if user is not None:
+        USER_CACHE_LOOKUPS.inc(result="hit")
+        return user
+    USER_CACHE_LOOKUPS.inc(result="miss")
+    
+    db_user = (await db.execute(select(models.User).where(models.User.username == token_data.username))).scalar_one_or_none()
+    if db_user is None:
         raise credentials_exception
+    user = schemas.User.model_validate(db_user, from_attributes=True)
+    if user.is_active:
+        user_cache.put(token_data.username, user)
     return user
 
 async def get_current_active_user(current_user: schemas.User = Depends(get_current_user)):
@@ -103,8 +353,16 @@ async def get_current_active_user(current_user: schemas.User = Depends(get_curre
 
 # Authentication endpoints
 @app.post("/token", response_model=schemas.Token)
-async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
-    user = authenticate_user(db, form_data.username, form_data.password)
+async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_async_db)):
+    try:
+        user = await authenticate_user(db, form_data.username, form_data.password)
+    except PasswordHasherBusy as e:
+        LOGINS_REJECTED.inc()
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Too many logins in progress, retry shortly",
+            headers={"Retry-After": str(max(1, round(e.retry_after)))},
+        )
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -119,20 +377,20 @@ async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(
 
 # User endpoints
 @app.post("/users/", response_model=schemas.User)
-async def create_user(user: schemas.UserCreate, db: Session = Depends(get_db), current_user: schemas.User = Depends(get_current_active_user)):
+async def create_user(user: schemas.UserCreate, db: AsyncSession = Depends(get_async_db), current_user: schemas.User = Depends(get_current_active_user)):
     # Only admins can create users
     if current_user.role != "admin":
         raise HTTPException(status_code=403, detail="Not authorized to create users")
     
-    db_user = db.query(models.User).filter(models.User.username == user.username).first()
+    db_user = (await db.execute(select(models.User).where(models.User.username == user.username))).scalar_one_or_none()
     if db_user:
         raise HTTPException(status_code=400, detail="Username already registered")
     
-    db_user = db.query(models.User).filter(models.User.email == user.email).first()
+    db_user = (await db.execute(select(models.User).where(models.User.email == user.email))).scalar_one_or_none()
     if db_user:
         raise HTTPException(status_code=400, detail="Email already registered")
     
-    hashed_password = get_password_hash(user.password)
+    hashed_password = await password_hasher.hash(user.password)
     db_user = models.User(
         username=user.username,
         email=user.email,
@@ -140,57 +398,115 @@ async def create_user(user: schemas.UserCreate, db: Session = Depends(get_db), c
         role=user.role
     )
     db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
+    await db.commit()
+    await db.refresh(db_user)
+    return db_user
+
+@app.put("/users/{user_id}", response_model=schemas.User)
+async def update_user(user_id: int, user: schemas.UserUpdate, db: AsyncSession = Depends(get_async_db), current_user: schemas.User = Depends(get_current_active_user)):
+    # Only admins can change users
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Not authorized to update users")
+    
+    db_user = await db.get(models.User, user_id)
+    if db_user is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    
+    update_data = user.dict(exclude_unset=True)
+    for field, column in (("username", models.User.username), ("email", models.User.email)):
+        value = update_data.get(field)
+        if value is not None and value != getattr(db_user, field):
+            taken = (await db.execute(select(models.User.id).where(column == value))).first()
+            if taken:
+                raise HTTPException(status_code=400, detail=f"{field.capitalize()} already registered")
+    
+    password = update_data.pop("password", None)
+    if password:
+        db_user.hashed_password = await password_hasher.hash(password)
+    previous_username = db_user.username
+    for key, value in update_data.items():
+        if value is not None:
+            setattr(db_user, key, value)
+    
+    await db.commit()
+    await db.refresh(db_user)
+    
+    # Deactivation, role and name changes apply to the user's next request
+    user_cache.invalidate(previous_username)
+    user_cache.invalidate(db_user.username)
     return db_user
 
 @app.get("/users/me/", response_model=schemas.User)
 async def read_users_me(current_user: schemas.User = Depends(get_current_active_user)):
     return current_user
 
+def _check_checkpoint(checkpoint: Optional[str]):
+    if not model_registry.is_allowed(checkpoint):
+        raise HTTPException(status_code=400, detail=f"Unknown checkpoint: {checkpoint}")
+
+def _check_output_format(output_format: Optional[str]):
+    if output_format is not None and output_format not in OUTPUT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unknown output format: {output_format}; expected one of {', '.join(OUTPUT_FORMATS)}")
+
+async def _page(db: AsyncSession, query, order, cursor: Optional[str], skip: int, limit: int, response: Response, descending: bool = False):
+    # Keyset pagination: the next page starts after the cursor in X-Next-Cursor
+    try:
+        query = keyset(query, order, cursor, descending=descending)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    rows = (await db.execute(query.offset(skip).limit(limit + 1))).scalars().all()
+    rows, next_cursor = split_page(rows, order, limit)
+    if next_cursor is not None:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return rows
+
 # Client endpoints
 @app.post("/clients/", response_model=schemas.Client)
-async def create_client(client: schemas.ClientCreate, db: Session = Depends(get_db), current_user: schemas.User = Depends(get_current_active_user)):
+async def create_client(client: schemas.ClientCreate, db: AsyncSession = Depends(get_async_db), current_user: schemas.User = Depends(get_current_active_user)):
+    _check_checkpoint(client.checkpoint)
+    _check_output_format(client.output_format)
     db_client = models.Client(**client.dict())
     db.add(db_client)
-    db.commit()
-    db.refresh(db_client)
+    await db.commit()
+    await db.refresh(db_client)
     return db_client
 
 @app.get("/clients/", response_model=List[schemas.Client])
-async def read_clients(skip: int = 0, limit: int = 100, db: Session = Depends(get_db), current_user: schemas.User = Depends(get_current_active_user)):
-    clients = db.query(models.Client).offset(skip).limit(limit).all()
+async def read_clients(skip: int = 0, limit: int = 100, db: AsyncSession = Depends(get_async_db), current_user: schemas.User = Depends(get_current_active_user)):
+    clients = (await db.execute(select(models.Client).offset(skip).limit(limit))).scalars().all()
     return clients
 
 @app.get("/clients/{client_id}", response_model=schemas.Client)
-async def read_client(client_id: int, db: Session = Depends(get_db), current_user: schemas.User = Depends(get_current_active_user)):
-    db_client = db.query(models.Client).filter(models.Client.id == client_id).first()
+async def read_client(client_id: int, db: AsyncSession = Depends(get_async_db), current_user: schemas.User = Depends(get_current_active_user)):
+    db_client = await db.get(models.Client, client_id)
     if db_client is None:
         raise HTTPException(status_code=404, detail="Client not found")
     return db_client
 
 @app.put("/clients/{client_id}", response_model=schemas.Client)
-async def update_client(client_id: int, client: schemas.ClientUpdate, db: Session = Depends(get_db), current_user: schemas.User = Depends(get_current_active_user)):
-    db_client = db.query(models.Client).filter(models.Client.id == client_id).first()
+async def update_client(client_id: int, client: schemas.ClientUpdate, db: AsyncSession = Depends(get_async_db), current_user: schemas.User = Depends(get_current_active_user)):
+    db_client = await db.get(models.Client, client_id)
     if db_client is None:
         raise HTTPException(status_code=404, detail="Client not found")
     
     update_data = client.dict(exclude_unset=True)
+    _check_checkpoint(update_data.get("checkpoint"))
+    _check_output_format(update_data.get("output_format"))
     for key, value in update_data.items():
         setattr(db_client, key, value)
     
-    db.commit()
-    db.refresh(db_client)
+    await db.commit()
+    await db.refresh(db_client)
     return db_client
 
 @app.delete("/clients/{client_id}", response_model=schemas.Client)
-async def delete_client(client_id: int, db: Session = Depends(get_db), current_user: schemas.User = Depends(get_current_active_user)):
-    db_client = db.query(models.Client).filter(models.Client.id == client_id).first()
+async def delete_client(client_id: int, db: AsyncSession = Depends(get_async_db), current_user: schemas.User = Depends(get_current_active_user)):
+    db_client = await db.get(models.Client, client_id)
     if db_client is None:
         raise HTTPException(status_code=404, detail="Client not found")
     
-    db.delete(db_client)
-    db.commit()
+    await db.delete(db_client)
+    await db.commit()
     return db_client
 
 # Model endpoints
@@ -199,71 +515,80 @@ async def create_model(
     client_id: int = Form(...),
     name: str = Form(...),
     reference_images: List[UploadFile] = File(...),
-    db: Session = Depends(get_db),
+    checkpoint: Optional[str] = Form(None),
+    db: AsyncSession = Depends(get_async_db),
     current_user: schemas.User = Depends(get_current_active_user)
 ):
     # Check if client exists
-    db_client = db.query(models.Client).filter(models.Client.id == client_id).first()
+    db_client = await db.get(models.Client, client_id)
     if db_client is None:
         raise HTTPException(status_code=404, detail="Client not found")
     
-    # Save reference images
-    reference_image_paths = []
-    for i, file in enumerate(reference_images):
-        file_path = f"uploads/{datetime.now().strftime('%Y%m%d%H%M%S')}_{i}_{file.filename}"
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-        reference_image_paths.append(file_path)
+    _check_checkpoint(checkpoint)
+    
+    # Save reference images in parallel; identical images are stored once
+    with metrics.stage("upload"):
+        reference_image_paths = list(await asyncio.gather(*(_store_upload(file) for file in reference_images)))
     
     # Use the first image as the main reference
     main_reference_path = reference_image_paths[0] if reference_image_paths else None
     
     # Create base embedding using Stable Diffusion
-    embedding_path = sd_model.create_embedding(reference_image_paths)
+    with metrics.stage("embedding"):
+        embedding_path = model_registry.get(checkpoint or db_client.checkpoint).create_embedding(reference_image_paths)
     
     # Create model in database
     db_model = models.Model(
         client_id=client_id,
         name=name,
         base_embedding=embedding_path,
-        reference_image_path=main_reference_path
+        reference_image_path=main_reference_path,
+        checkpoint=checkpoint
     )
     db.add(db_model)
-    db.commit()
-    db.refresh(db_model)
+    await db.commit()
+    await db.refresh(db_model)
     
     return db_model
 
 @app.get("/models/", response_model=List[schemas.Model])
 async def read_models(
+    response: Response,
     skip: int = 0,
     limit: int = 100,
+    cursor: Optional[str] = None,
     client_id: Optional[int] = None,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: schemas.User = Depends(get_current_active_user)
 ):
-    query = db.query(models.Model)
+    query = select(models.Model)
     if client_id is not None:
-        query = query.filter(models.Model.client_id == client_id)
+        query = query.where(models.Model.client_id == client_id)
     
-    models_list = query.offset(skip).limit(limit).all()
-    return models_list
+    return await _page(db, query, (models.Model.created_at, models.Model.id), cursor, skip, limit, response)
 
 @app.get("/models/{model_id}", response_model=schemas.Model)
-async def read_model(model_id: int, db: Session = Depends(get_db), current_user: schemas.User = Depends(get_current_active_user)):
-    db_model = db.query(models.Model).filter(models.Model.id == model_id).first()
+async def read_model(model_id: int, db: AsyncSession = Depends(get_async_db), current_user: schemas.User = Depends(get_current_active_user)):
+    db_model = await db.get(models.Model, model_id)
     if db_model is None:
         raise HTTPException(status_code=404, detail="Model not found")
     return db_model
 
+@app.get("/models/{model_id}/reference-image")
+async def read_model_reference_image(model_id: int, request: Request, db: AsyncSession = Depends(get_async_db), current_user: schemas.User = Depends(get_current_active_user)):
+    db_model = await db.get(models.Model, model_id)
+    if db_model is None:
+        raise HTTPException(status_code=404, detail="Model not found")
+    return await _image_response(db_model.reference_image_path, request)
+
 @app.delete("/models/{model_id}", response_model=schemas.Model)
-async def delete_model(model_id: int, db: Session = Depends(get_db), current_user: schemas.User = Depends(get_current_active_user)):
-    db_model = db.query(models.Model).filter(models.Model.id == model_id).first()
+async def delete_model(model_id: int, db: AsyncSession = Depends(get_async_db), current_user: schemas.User = Depends(get_current_active_user)):
+    db_model = await db.get(models.Model, model_id)
     if db_model is None:
         raise HTTPException(status_code=404, detail="Model not found")
     
-    db.delete(db_model)
-    db.commit()
+    await db.delete(db_model)
+    await db.commit()
     return db_model
 
 # Layer endpoints
@@ -275,16 +600,14 @@ async def create_layer(
     negative_prompt: Optional[str] = Form(None),
     strength: float = Form(1.0),
     reference_image: Optional[UploadFile] = File(None),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: schemas.User = Depends(get_current_active_user)
 ):
     # Save reference image if provided
     reference_image_path = None
     if reference_image:
-        file_path = f"uploads/{datetime.now().strftime('%Y%m%d%H%M%S')}_{reference_image.filename}"
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(reference_image.file, buffer)
-        reference_image_path = file_path
+        with metrics.stage("upload"):
+            reference_image_path = await _store_upload(reference_image)
     
     # Create layer in database
     db_layer = models.Layer(
@@ -296,199 +619,618 @@ async def create_layer(
         reference_image_path=reference_image_path
     )
     db.add(db_layer)
-    db.commit()
-    db.refresh(db_layer)
+    await db.commit()
+    await db.refresh(db_layer)
     
     return db_layer
 
 @app.get("/layers/", response_model=List[schemas.Layer])
 async def read_layers(
+    response: Response,
     skip: int = 0,
     limit: int = 100,
+    cursor: Optional[str] = None,
     type: Optional[str] = None,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: schemas.User = Depends(get_current_active_user)
 ):
-    query = db.query(models.Layer)
+    query = select(models.Layer)
     if type is not None:
-        query = query.filter(models.Layer.type == type)
+        query = query.where(models.Layer.type == type)
     
-    layers = query.offset(skip).limit(limit).all()
-    return layers
+    return await _page(db, query, (models.Layer.created_at, models.Layer.id), cursor, skip, limit, response)
 
 @app.get("/layers/{layer_id}", response_model=schemas.Layer)
-async def read_layer(layer_id: int, db: Session = Depends(get_db), current_user: schemas.User = Depends(get_current_active_user)):
-    db_layer = db.query(models.Layer).filter(models.Layer.id == layer_id).first()
+async def read_layer(layer_id: int, db: AsyncSession = Depends(get_async_db), current_user: schemas.User = Depends(get_current_active_user)):
+    db_layer = await db.get(models.Layer, layer_id)
     if db_layer is None:
         raise HTTPException(status_code=404, detail="Layer not found")
     return db_layer
 
+@app.get("/layers/{layer_id}/image")
+async def read_layer_image(layer_id: int, request: Request, db: AsyncSession = Depends(get_async_db), current_user: schemas.User = Depends(get_current_active_user)):
+    db_layer = await db.get(models.Layer, layer_id)
+    if db_layer is None:
+        raise HTTPException(status_code=404, detail="Layer not found")
+    return await _image_response(db_layer.reference_image_path, request)
+
 @app.delete("/layers/{layer_id}", response_model=schemas.Layer)
-async def delete_layer(layer_id: int, db: Session = Depends(get_db), current_user: schemas.User = Depends(get_current_active_user)):
-    db_layer = db.query(models.Layer).filter(models.Layer.id == layer_id).first()
+async def delete_layer(layer_id: int, db: AsyncSession = Depends(get_async_db), current_user: schemas.User = Depends(get_current_active_user)):
+    db_layer = await db.get(models.Layer, layer_id)
     if db_layer is None:
         raise HTTPException(status_code=404, detail="Layer not found")
     
-    db.delete(db_layer)
-    db.commit()
+    await db.delete(db_layer)
+    await db.commit()
+    
+    # Drop cached prompt embeddings built from this layer
+    prompt_cache.invalidate_tag(("layer", layer_id))
     return db_layer
 
 # Generation endpoints
-@app.post("/generate/", response_model=schemas.GenerationResponse)
+def _save_history(model_id: int, image_path: str, prompt: Optional[str], negative_prompt: Optional[str], settings: Optional[Dict[str, Any]]):
+    db = SessionLocal()
+    try:
+        with metrics.stage("history"):
+            db_history = models.History(
+                model_id=model_id,
+                image_path=image_path,
+                prompt=prompt,
+                negative_prompt=negative_prompt,
+                settings=settings
+            )
+            db.add(db_history)
+            db.commit()
+            db.refresh(db_history)
+        thumbnail_store.submit(image_path)
+        return db_history.id
+    finally:
+        db.close()
+
+def _save_histories(model_id: int, image_paths: List[str], prompt: Optional[str], negative_prompt: Optional[str], settings: List[Dict[str, Any]], lookbook_id: Optional[int] = None):
+    # All history rows, then (given a lookbook) all its new entries after its
+    # last one, each inserted in a single batch and committed together
+    db = SessionLocal()
+    try:
+        with metrics.stage("history"):
+            histories = [
+                models.History(
+                    model_id=model_id,
+                    image_path=image_path,
+                    prompt=prompt,
+                    negative_prompt=negative_prompt,
+                    settings=image_settings
+                )
+                for image_path, image_settings in zip(image_paths, settings)
+            ]
+            db.add_all(histories)
+            db.flush()
+            history_ids = [history.id for history in histories]
+            entry_ids = []
+            if lookbook_id is not None:
+                entries = lookbook_appender.append(db, lookbook_id, history_ids)
+                entry_ids = [entry.id for entry in entries]
+            db.commit()
+        for image_path in image_paths:
+            thumbnail_store.submit(image_path)
+        return history_ids, entry_ids
+    finally:
+        db.close()
+
+def _progress_callback():
+    job = current_job()
+    if job is None:
+        return None
+    
+    def callback(step: int, total_steps: int, latents):
+        # Stop at this step: no image, no history entry
+        if job.cancel_requested.is_set():
+            raise GenerationCancelled(f"Job {job.id} cancelled at step {step}")
+        preview = None
+        if PREVIEW_EVERY_STEPS and (step % PREVIEW_EVERY_STEPS == 0 or step == total_steps):
+            preview = preview_data_url(latents_to_preview(latents))
+        job.update_progress(step, total_steps, preview)
+    return callback
+
+@contextmanager
+def _job_timings():
+    # Collect the running job's stage timings for its result's Server-Timing header
+    with metrics.collect_timings() as timings:
+        job = current_job()
+        if job is not None:
+            job.timings = timings
+            if job.started_at is not None:
+                metrics.observe_stage("queue_wait", (job.started_at - job.created_at).total_seconds())
+        yield
+
+def _store_generated(image: Image.Image, output_format: str) -> str:
+    format, extension, options = OUTPUT_FORMATS[output_format]
+    with metrics.stage("save"):
+        return generated_store.put_image(image, format=format, extension=extension, **options)
+
+def _write_result(image: Image.Image, output_format: str, finish) -> Future:
+    # Encode and store the image on the writer pool, then call finish with its
+    # path; the job ends when the returned future does. The job's context is
+    # copied so the save stage still lands in its timings.
+    context = contextvars.copy_context()
+    return image_writer.submit(context.run, lambda: finish(_store_generated(image, output_format)))
+
+def _write_results(images: List[Image.Image], output_format: str, finish) -> Future:
+    # Like _write_result, for several images stored one after another
+    context = contextvars.copy_context()
+    return image_writer.submit(context.run, lambda: finish([_store_generated(image, output_format) for image in images]))
+
+def _run_generation(request: schemas.GenerationRequest, checkpoint: Optional[str], base_embedding: str, hair_layer, outfit_layer, scene_layer, cache_key: Optional[str] = None):
+    with _job_timings():
+        settings = dict(request.settings or {})
+        output_format = settings.pop("output_format", OUTPUT_FORMAT)
+        with model_registry.lease(checkpoint) as sd_model:
+            image, _ = sd_model.apply_styling_layers(
+                base_model_path=base_embedding,
+                hair_layer=hair_layer,
+                outfit_layer=outfit_layer,
+                scene_layer=scene_layer,
+                prompt=request.prompt or "",
+                negative_prompt=request.negative_prompt or "",
+                step_callback=_progress_callback(),
+                save=False,
+                **settings
+            )
+        
+        def finish(image_path: str):
+            history_id = _save_history(request.model_id, image_path, request.prompt, request.negative_prompt, request.settings)
+            result = {"image_path": image_path, "history_id": history_id}
+            if cache_key is not None:
+                result_cache.put(cache_key, result)
+            return result
+        return _write_result(image, output_format, finish)
+
+def _run_inpaint(model_id: int, checkpoint: Optional[str], prompt: str, negative_prompt: Optional[str], image_path: str, mask_path: str, output_format: str = OUTPUT_FORMAT):
+    with _job_timings():
+        img = Image.open(image_path)
+        mask_img = Image.open(mask_path)
+        with model_registry.lease(checkpoint) as sd_model:
+            inpainted, _ = sd_model.inpaint_image(
+                image=img,
+                mask_image=mask_img,
+                prompt=prompt,
+                negative_prompt=negative_prompt,
+                step_callback=_progress_callback(),
+                save=False
+            )
+        
+        def finish(result_path: str):
+            history_id = _save_history(model_id, result_path, prompt, negative_prompt, {"inpaint": True, "output_format": output_format})
+            return {"image_path": result_path, "history_id": history_id}
+        return _write_result(inpainted, output_format, finish)
+
+def _run_variations(request: schemas.GenerationRequest, checkpoint: Optional[str], base_embedding: str, hair_layer, outfit_layer, scene_layer, seeds: List[int]):
+    with _job_timings():
+        settings = dict(request.settings or {})
+        output_format = settings.pop("output_format", OUTPUT_FORMAT)
+        settings.pop("seed", None)
+        with model_registry.lease(checkpoint) as sd_model:
+            images = sd_model.apply_styling_layer_variations(
+                base_model_path=base_embedding,
+                seeds=seeds,
+                hair_layer=hair_layer,
+                outfit_layer=outfit_layer,
+                scene_layer=scene_layer,
+                prompt=request.prompt or "",
+                negative_prompt=request.negative_prompt or "",
+                step_callback=_progress_callback(),
+                **settings
+            )
+        
+        # Each entry records its own seed, so any variation can be regenerated alone
+        history_settings = [{**(request.settings or {}), "seed": seed} for seed in seeds]
+        
+        def finish(image_paths: List[str]):
+            history_ids, _ = _save_histories(request.model_id, image_paths, request.prompt, request.negative_prompt, history_settings)
+            return {
+                "image_path": image_paths[0],
+                "history_id": history_ids[0],
+                "image_paths": image_paths,
+                "history_ids": history_ids,
+                "seeds": seeds
+            }
+        return _write_results(images, output_format, finish)
+
+def _run_matrix_generation(request: schemas.MatrixGenerationRequest, checkpoint: Optional[str], base_embedding: str, combinations, seeds: List[int]):
+    with _job_timings():
+        settings = dict(request.settings or {})
+        output_format = settings.pop("output_format", OUTPUT_FORMAT)
+        settings.pop("seed", None)
+        with model_registry.lease(checkpoint) as sd_model:
+            images = sd_model.apply_styling_layer_combinations(
+                base_model_path=base_embedding,
+                combinations=combinations,
+                prompt=request.prompt or "",
+                negative_prompt=request.negative_prompt or "",
+                seeds=seeds,
+                batch_size=MAX_BATCH_SIZE,
+                step_callback=_progress_callback(),
+                **settings
+            )
+        
+        # Each entry records the layers and seed it was generated with
+        history_settings = [
+            {
+                **(request.settings or {}),
+                "seed": seed,
+                **{f"{kind}_layer_id": layer["id"] if layer else None for kind, layer in zip(("hair", "outfit", "scene"), layers)}
+            }
+            for layers, seed in zip(combinations, seeds)
+        ]
+        
+        def finish(image_paths: List[str]):
+            history_ids, entry_ids = _save_histories(
+                request.model_id, image_paths, request.prompt, request.negative_prompt, history_settings, request.lookbook_id
+            )
+            return {
+                "lookbook_id": request.lookbook_id,
+                "image_paths": image_paths,
+                "history_ids": history_ids,
+                "entry_ids": entry_ids
+            }
+        return _write_results(images, output_format, finish)
+
+def _model_checkpoint(db_model: models.Model) -> Optional[str]:
+    # A model's own checkpoint wins over its client's; None selects the default
+    return db_model.checkpoint or db_model.client.checkpoint
+
+def _output_format(db_model: models.Model, requested: Optional[str]) -> str:
+    # The request's format wins over the client's, then the server default
+    _check_output_format(requested)
+    return requested or db_model.client.output_format or OUTPUT_FORMAT
+
+def _generation_cache_key(request: schemas.GenerationRequest, checkpoint: Optional[str], base_embedding: str, layers) -> Optional[str]:
+    settings = request.settings or {}
+    # Unseeded generations are random, so there is nothing to reuse; variations
+    # are rendered and recorded as a set
+    if settings.get("seed") is None or request.variations > 1:
+        return None
+    return canonical_request_key(
+        checkpoint=checkpoint or model_registry.default_checkpoint,
+        base_embedding=base_embedding,
+        layers=[
+            {key: layer[key] for key in ("prompt", "negative_prompt", "strength")} if layer else None
+            for layer in layers
+        ],
+        prompt=request.prompt or "",
+        negative_prompt=request.negative_prompt or "",
+        settings=settings
+    )
+
+def _layer_dict(db_layer: models.Layer) -> Dict[str, Any]:
+    return {
+        "id": db_layer.id,
+        "prompt": db_layer.prompt,
+        "negative_prompt": db_layer.negative_prompt,
+        "strength": db_layer.strength,
+        "reference_image_path": db_layer.reference_image_path
+    }
+
+async def _layer_config(db: AsyncSession, layer_id: Optional[int]):
+    if not layer_id:
+        return None
+    db_layer = await db.get(models.Layer, layer_id)
+    if db_layer is None:
+        return None
+    return _layer_dict(db_layer)
+
+@app.post("/generate/", response_model=schemas.JobResponse, status_code=status.HTTP_202_ACCEPTED)
 async def generate_image(
     request: schemas.GenerationRequest,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: schemas.User = Depends(get_current_active_user)
 ):
     # Get model
-    db_model = db.query(models.Model).filter(models.Model.id == request.model_id).first()
+    with metrics.stage("db"):
+        db_model = await db.get(models.Model, request.model_id, options=[selectinload(models.Model.client)])
     if db_model is None:
         raise HTTPException(status_code=404, detail="Model not found")
     
+    # Expand sampler presets so history, cache and worker see the same settings
+    try:
+        request.settings = resolve_sampler_settings(request.settings)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    settings = request.settings or {}
+    request.settings = {**settings, "output_format": _output_format(db_model, settings.get("output_format"))}
+    if not 1 <= request.variations <= MAX_VARIATIONS:
+        raise HTTPException(status_code=400, detail=f"variations must be between 1 and {MAX_VARIATIONS}")
+    
     # Get layers
-    hair_layer = None
-    outfit_layer = None
-    scene_layer = None
-    
-    if request.hair_layer_id:
-        db_hair = db.query(models.Layer).filter(models.Layer.id == request.hair_layer_id).first()
-        if db_hair:
-            hair_layer = {
-                "prompt": db_hair.prompt,
-                "negative_prompt": db_hair.negative_prompt,
-                "strength": db_hair.strength,
-                "reference_image_path": db_hair.reference_image_path
-            }
+    with metrics.stage("db"):
+        hair_layer = await _layer_config(db, request.hair_layer_id)
+        outfit_layer = await _layer_config(db, request.outfit_layer_id)
+        scene_layer = await _layer_config(db, request.scene_layer_id)
+        checkpoint = _model_checkpoint(db_model)
     
-    if request.outfit_layer_id:
-        db_outfit = db.query(models.Layer).filter(models.Layer.id == request.outfit_layer_id).first()
-        if db_outfit:
-            outfit_layer = {
-                "prompt": db_outfit.prompt,
-                "negative_prompt": db_outfit.negative_prompt,
-                "strength": db_outfit.strength,
-                "reference_image_path": db_outfit.reference_image_path
-            }
+    # Serve identical seeded requests from the result cache
+    with metrics.stage("result_cache"):
+        cache_key = _generation_cache_key(request, checkpoint, db_model.base_embedding, (hair_layer, outfit_layer, scene_layer))
+        cached = result_cache.get(cache_key) if cache_key else None
+    if cached is not None:
+        result = {"image_path": cached["image_path"], "history_id": None}
+        if request.record_history:
+            with metrics.stage("history"):
+                db_history = models.History(
+                    model_id=request.model_id,
+                    image_path=cached["image_path"],
+                    prompt=request.prompt,
+                    negative_prompt=request.negative_prompt,
+                    settings=request.settings
+                )
+                db.add(db_history)
+                await db.commit()
+                await db.refresh(db_history)
+            result["history_id"] = db_history.id
+        job = job_queue.complete("generate", {**result, "cached": True}, owner_id=current_user.id)
+        return {"job_id": job.id, "status": job.status, "cached": True}
     
-    if request.scene_layer_id:
-        db_scene = db.query(models.Layer).filter(models.Layer.id == request.scene_layer_id).first()
-        if db_scene:
-            scene_layer = {
-                "prompt": db_scene.prompt,
-                "negative_prompt": db_scene.negative_prompt,
-                "strength": db_scene.strength,
-                "reference_image_path": db_scene.reference_image_path
-            }
+    if request.variations > 1:
+        # Consecutive seeds from the requested one, or random ones
+        seed = settings.get("seed")
+        seeds = [
+            seed + index if seed is not None else random.randrange(2 ** 32)
+            for index in range(request.variations)
+        ]
+        job = job_queue.submit(
+            "variations",
+            _run_variations,
+            request,
+            checkpoint,
+            db_model.base_embedding,
+            hair_layer,
+            outfit_layer,
+            scene_layer,
+            seeds,
+            owner_id=current_user.id,
+            total_steps=settings.get("num_inference_steps", 30)
+        )
+        return {"job_id": job.id, "status": job.status}
     
-    # Generate image
-    output_path = f"generated/{datetime.now().strftime('%Y%m%d%H%M%S')}.png"
-    _, image_path = sd_model.apply_styling_layers(
-        base_model_path=db_model.base_embedding,
-        hair_layer=hair_layer,
-        outfit_layer=outfit_layer,
-        scene_layer=scene_layer,
-        prompt=request.prompt or "",
-        negative_prompt=request.negative_prompt or "",
-        output_path=output_path,
-        **(request.settings or {})
+    # Queue generation; the worker stores the image and the history entry
+    job = job_queue.submit(
+        "generate",
+        _run_generation,
+        request,
+        checkpoint,
+        db_model.base_embedding,
+        hair_layer,
+        outfit_layer,
+        scene_layer,
+        cache_key,
+        owner_id=current_user.id,
+        total_steps=(request.settings or {}).get("num_inference_steps", 30)
     )
     
-    # Save to history
-    db_history = models.History(
-        model_id=request.model_id,
-        image_path=image_path,
-        prompt=request.prompt,
-        negative_prompt=request.negative_prompt,
-        settings=request.settings
+    return {"job_id": job.id, "status": job.status}
+
+@app.post("/generate/matrix/", response_model=schemas.JobResponse, status_code=status.HTTP_202_ACCEPTED)
+async def generate_layer_matrix(
+    request: schemas.MatrixGenerationRequest,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: schemas.User = Depends(get_current_active_user)
+):
+    # Generate every hair x outfit x scene (x seed) combination as one job and
+    # add the results to a lookbook in order
+    with metrics.stage("db"):
+        db_model = await db.get(models.Model, request.model_id, options=[selectinload(models.Model.client)])
+        db_lookbook = await db.get(models.Lookbook, request.lookbook_id)
+    if db_model is None:
+        raise HTTPException(status_code=404, detail="Model not found")
+    if db_lookbook is None:
+        raise HTTPException(status_code=404, detail="Lookbook not found")
+    
+    try:
+        request.settings = resolve_sampler_settings(request.settings)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    settings = request.settings or {}
+    request.settings = {**settings, "output_format": _output_format(db_model, settings.get("output_format"))}
+    
+    axes = [request.hair_layer_ids or [None], request.outfit_layer_ids or [None], request.scene_layer_ids or [None]]
+    cells = list(itertools.product(*axes, request.seeds or [settings.get("seed")]))
+    if len(cells) > MAX_MATRIX_SIZE:
+        raise HTTPException(status_code=400, detail=f"Matrix has {len(cells)} combinations; at most {MAX_MATRIX_SIZE} are allowed")
+    
+    # Every layer of the matrix in one query
+    layer_ids = {layer_id for axis in axes for layer_id in axis if layer_id is not None}
+    layers = {}
+    if layer_ids:
+        with metrics.stage("db"):
+            db_layers = (await db.execute(select(models.Layer).where(models.Layer.id.in_(layer_ids)))).scalars().all()
+        layers = {db_layer.id: _layer_dict(db_layer) for db_layer in db_layers}
+    missing = sorted(layer_ids - layers.keys())
+    if missing:
+        raise HTTPException(status_code=404, detail=f"Layers not found: {', '.join(map(str, missing))}")
+    
+    combinations = [tuple(layers.get(layer_id) for layer_id in cell[:3]) for cell in cells]
+    # Unseeded cells get a seed of their own, so each one can be regenerated
+    seeds = [random.randrange(2 ** 32) if cell[3] is None else cell[3] for cell in cells]
+    batches = -(-len(cells) // MAX_BATCH_SIZE)
+    
+    job = job_queue.submit(
+        "matrix",
+        _run_matrix_generation,
+        request,
+        _model_checkpoint(db_model),
+        db_model.base_embedding,
+        combinations,
+        seeds,
+        owner_id=current_user.id,
+        total_steps=batches * settings.get("num_inference_steps", 30)
     )
-    db.add(db_history)
-    db.commit()
-    db.refresh(db_history)
     
-    return {"image_path": image_path, "history_id": db_history.id}
+    return {"job_id": job.id, "status": job.status}
 
-@app.post("/inpaint/", response_model=schemas.GenerationResponse)
+@app.post("/inpaint/", response_model=schemas.JobResponse, status_code=status.HTTP_202_ACCEPTED)
 async def inpaint_image(
     model_id: int = Form(...),
     prompt: str = Form(...),
     negative_prompt: Optional[str] = Form(None),
     image: UploadFile = File(...),
     mask: UploadFile = File(...),
-    db: Session = Depends(get_db),
+    output_format: Optional[str] = Form(None),
+    db: AsyncSession = Depends(get_async_db),
     current_user: schemas.User = Depends(get_current_active_user)
 ):
     # Get model
-    db_model = db.query(models.Model).filter(models.Model.id == model_id).first()
+    with metrics.stage("db"):
+        db_model = await db.get(models.Model, model_id, options=[selectinload(models.Model.client)])
+        checkpoint = _model_checkpoint(db_model) if db_model is not None else None
     if db_model is None:
         raise HTTPException(status_code=404, detail="Model not found")
+    output_format = _output_format(db_model, output_format)
     
     # Save uploaded images
-    image_path = f"uploads/{datetime.now().strftime('%Y%m%d%H%M%S')}_image.png"
-    with open(image_path, "wb") as buffer:
-        shutil.copyfileobj(image.file, buffer)
-    
-    mask_path = f"uploads/{datetime.now().strftime('%Y%m%d%H%M%S')}_mask.png"
-    with open(mask_path, "wb") as buffer:
-        shutil.copyfileobj(mask.file, buffer)
-    
-    # Load images
-    img = Image.open(image_path)
-    mask_img = Image.open(mask_path)
-    
-    # Perform inpainting
-    output_path = f"generated/{datetime.now().strftime('%Y%m%d%H%M%S')}_inpainted.png"
-    _, result_path = sd_model.inpaint_image(
-        image=img,
-        mask_image=mask_img,
-        prompt=prompt,
-        negative_prompt=negative_prompt,
-        output_path=output_path
-    )
+    with metrics.stage("upload"):
+        image_path, mask_path = await asyncio.gather(_store_upload(image), _store_upload(mask))
     
-    # Save to history
-    db_history = models.History(
-        model_id=model_id,
-        image_path=result_path,
-        prompt=prompt,
-        negative_prompt=negative_prompt,
-        settings={"inpaint": True}
+    # Queue inpainting; the worker stores the image and the history entry
+    job = job_queue.submit(
+        "inpaint",
+        _run_inpaint,
+        model_id,
+        checkpoint,
+        prompt,
+        negative_prompt,
+        image_path,
+        mask_path,
+        output_format,
+        owner_id=current_user.id,
+        total_steps=30
     )
-    db.add(db_history)
-    db.commit()
-    db.refresh(db_history)
     
-    return {"image_path": result_path, "history_id": db_history.id}
+    return {"job_id": job.id, "status": job.status}
+
+# Job endpoints
+def _get_owned_job(job_id: str, current_user: schemas.User):
+    job = job_queue.get(job_id)
+    if job is None or (job.owner_id != current_user.id and current_user.role != "admin"):
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@app.get("/jobs/{job_id}", response_model=schemas.Job)
+async def read_job(job_id: str, current_user: schemas.User = Depends(get_current_active_user)):
+    return _get_owned_job(job_id, current_user)
+
+@app.post("/jobs/{job_id}/cancel", response_model=schemas.Job)
+async def cancel_job(job_id: str, current_user: schemas.User = Depends(get_current_active_user)):
+    # Queued jobs are dropped; running jobs stop at their next denoising step
+    job = _get_owned_job(job_id, current_user)
+    if job.finished:
+        raise HTTPException(status_code=409, detail=f"Job is {job.status}")
+    return job_queue.cancel(job.id)
+
+def _server_sent_event(event: str, data: Dict[str, Any]) -> str:
+    return f"event: {event}\ndata: {json.dumps(jsonable_encoder(data))}\n\n"
+
+async def _job_events(job):
+    version = -1
+    while True:
+        if job.progress_version != version:
+            version = job.progress_version
+            yield _server_sent_event("progress", {
+                "status": job.status,
+                "progress": job.progress,
+                "preview": job.preview
+            })
+        if job.finished:
+            yield _server_sent_event("done", {
+                "status": job.status,
+                "result": job.result,
+                "error": job.error
+            })
+            return
+        await asyncio.sleep(JOB_EVENT_INTERVAL_SECONDS)
+
+@app.get("/jobs/{job_id}/events")
+async def stream_job_events(job_id: str, current_user: schemas.User = Depends(get_current_active_user)):
+    # Server-sent events: step progress with periodic latent previews, then the result
+    job = _get_owned_job(job_id, current_user)
+    return StreamingResponse(
+        _job_events(job),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.get("/jobs/{job_id}/result", response_model=Union[schemas.GenerationResponse, schemas.MatrixGenerationResponse])
+async def read_job_result(job_id: str, response: Response, current_user: schemas.User = Depends(get_current_active_user)):
+    job = _get_owned_job(job_id, current_user)
+    if job.timings:
+        # Where the job's own time went, next to this request's timings
+        response.headers["Server-Timing"] = metrics.server_timing_header(job.timings, prefix="job-")
+    if job.status == JobStatus.FAILED:
+        raise HTTPException(status_code=500, detail=f"Job failed: {job.error}")
+    if job.status != JobStatus.SUCCEEDED:
+        raise HTTPException(status_code=409, detail=f"Job is {job.status}")
+    return job.result
 
 # History endpoints
+def _history_response(db_history: models.History) -> schemas.History:
+    return schemas.History.model_validate(db_history, from_attributes=True).model_copy(update={"thumbnail_urls": _thumbnail_urls(db_history.id)})
+
 @app.get("/histories/", response_model=List[schemas.History])
 async def read_histories(
+    response: Response,
     skip: int = 0,
     limit: int = 100,
+    cursor: Optional[str] = None,
     model_id: Optional[int] = None,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: schemas.User = Depends(get_current_active_user)
 ):
-    query = db.query(models.History)
+    query = select(models.History)
     if model_id is not None:
-        query = query.filter(models.History.model_id == model_id)
+        query = query.where(models.History.model_id == model_id)
     
-    histories = query.order_by(models.History.created_at.desc()).offset(skip).limit(limit).all()
-    return histories
+    # Newest first
+    histories = await _page(db, query, (models.History.created_at, models.History.id), cursor, skip, limit, response, descending=True)
+    return [_history_response(history) for history in histories]
 
 @app.get("/histories/{history_id}", response_model=schemas.History)
-async def read_history(history_id: int, db: Session = Depends(get_db), current_user: schemas.User = Depends(get_current_active_user)):
-    db_history = db.query(models.History).filter(models.History.id == history_id).first()
+async def read_history(history_id: int, db: AsyncSession = Depends(get_async_db), current_user: schemas.User = Depends(get_current_active_user)):
+    db_history = await db.get(models.History, history_id)
     if db_history is None:
         raise HTTPException(status_code=404, detail="History not found")
-    return db_history
+    return _history_response(db_history)
+
+@app.get("/histories/{history_id}/image")
+async def read_history_image(history_id: int, request: Request, db: AsyncSession = Depends(get_async_db), current_user: schemas.User = Depends(get_current_active_user)):
+    db_history = await db.get(models.History, history_id)
+    if db_history is None:
+        raise HTTPException(status_code=404, detail="History not found")
+    return await _image_response(db_history.image_path, request)
+
+@app.get("/histories/{history_id}/thumbnails/{size}")
+async def read_history_thumbnail(history_id: int, size: int, request: Request, db: AsyncSession = Depends(get_async_db), current_user: schemas.User = Depends(get_current_active_user)):
+    if size not in thumbnail_store.sizes:
+        raise HTTPException(status_code=404, detail=f"Thumbnail sizes are {', '.join(map(str, thumbnail_store.sizes))}")
+    db_history = await db.get(models.History, history_id)
+    if db_history is None or not db_history.image_path:
+        raise HTTPException(status_code=404, detail="History not found")
+    try:
+        path = await asyncio.to_thread(_find_thumbnail, db_history.image_path, size)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="History not found")
+    if path is None:
+        # Older entries get their thumbnails rendered on first request
+        with metrics.stage("thumbnail"):
+            paths = await asyncio.wrap_future(thumbnail_store.submit(db_history.image_path))
+        path = paths[size]
+    return await _image_response(path, request)
 
 # Lookbook endpoints
 @app.post("/lookbooks/", response_model=schemas.Lookbook)
-async def create_lookbook(lookbook: schemas.LookbookCreate, db: Session = Depends(get_db), current_user: schemas.User = Depends(get_current_active_user)):
+async def create_lookbook(lookbook: schemas.LookbookCreate, db: AsyncSession = Depends(get_async_db), current_user: schemas.User = Depends(get_current_active_user)):
     db_lookbook = models.Lookbook(**lookbook.dict())
     db.add(db_lookbook)
-    db.commit()
-    db.refresh(db_lookbook)
+    await db.commit()
+    await db.refresh(db_lookbook)
     return db_lookbook
 
 @app.get("/lookbooks/", response_model=List[schemas.Lookbook])
@@ -496,65 +1238,137 @@ async def read_lookbooks(
     skip: int = 0,
     limit: int = 100,
     client_id: Optional[int] = None,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: schemas.User = Depends(get_current_active_user)
 ):
-    query = db.query(models.Lookbook)
+    query = select(models.Lookbook)
     if client_id is not None:
-        query = query.filter(models.Lookbook.client_id == client_id)
+        query = query.where(models.Lookbook.client_id == client_id)
     
-    lookbooks = query.offset(skip).limit(limit).all()
+    lookbooks = (await db.execute(query.offset(skip).limit(limit))).scalars().all()
     return lookbooks
 
 @app.post("/lookbooks/{lookbook_id}/entries/", response_model=schemas.LookbookEntry)
 async def add_lookbook_entry(
     lookbook_id: int,
     entry: schemas.LookbookEntryCreate,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: schemas.User = Depends(get_current_active_user)
 ):
     # Check if lookbook exists
-    db_lookbook = db.query(models.Lookbook).filter(models.Lookbook.id == lookbook_id).first()
+    db_lookbook = await db.get(models.Lookbook, lookbook_id)
     if db_lookbook is None:
         raise HTTPException(status_code=404, detail="Lookbook not found")
     
     # Check if history exists
-    db_history = db.query(models.History).filter(models.History.id == entry.history_id).first()
+    db_history = await db.get(models.History, entry.history_id)
     if db_history is None:
         raise HTTPException(status_code=404, detail="History not found")
     
-    # Create entry
-    db_entry = models.LookbookEntry(**entry.dict())
-    db.add(db_entry)
-    db.commit()
-    db.refresh(db_entry)
+    # Create entry; without an order it goes after the last one
+    if entry.order is None:
+        db_entry = (await db.run_sync(lambda session: lookbook_appender.append(session, lookbook_id, [entry.history_id], entry.notes)))[0]
+    else:
+        db_entry = models.LookbookEntry(**entry.dict())
+        db.add(db_entry)
+    await db.commit()
+    await db.refresh(db_entry)
     
     return db_entry
 
 @app.get("/lookbooks/{lookbook_id}/entries/", response_model=List[schemas.LookbookEntry])
 async def read_lookbook_entries(
     lookbook_id: int,
+    response: Response,
     skip: int = 0,
     limit: int = 100,
-    db: Session = Depends(get_db),
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_db),
     current_user: schemas.User = Depends(get_current_active_user)
 ):
     # Check if lookbook exists
-    db_lookbook = db.query(models.Lookbook).filter(models.Lookbook.id == lookbook_id).first()
+    db_lookbook = await db.get(models.Lookbook, lookbook_id)
     if db_lookbook is None:
         raise HTTPException(status_code=404, detail="Lookbook not found")
     
-    entries = db.query(models.LookbookEntry).filter(
-        models.LookbookEntry.lookbook_id == lookbook_id
-    ).order_by(models.LookbookEntry.order).offset(skip).limit(limit).all()
+    query = select(models.LookbookEntry).where(models.LookbookEntry.lookbook_id == lookbook_id)
+    entries = await _page(db, query, (models.LookbookEntry.order, models.LookbookEntry.id), cursor, skip, limit, response)
     
-    return entries
+    return [
+        schemas.LookbookEntry.model_validate(entry, from_attributes=True).model_copy(update={"thumbnail_urls": _thumbnail_urls(entry.history_id)})
+        for entry in entries
+    ]
+
+# Inference statistics
+@app.get("/stats/inference")
+async def read_inference_stats(current_user: schemas.User = Depends(get_current_active_user)):
+    return {
+        "queue_depth": job_queue.queue_depth,
+        "jobs": job_queue.stats(),
+        "registry": model_registry.stats(),
+        "prompt_cache": prompt_cache.stats(),
+        "result_cache": result_cache.stats(),
+        "user_cache": user_cache.stats(),
+        "password_hasher": password_hasher.stats(),
+        "checkpoints": {
+            checkpoint: {
+                "batching": sd_model.batcher.stats() if sd_model.batcher else None,
+                "memory": sd_model.memory_report()
+            }
+            for checkpoint, sd_model in model_registry.models().items()
+        }
+    }
+
+# Startup warm-up
+def _warm_up():
+    warmup_state["status"] = "warming_up"
+    try:
+        with model_registry.lease() as sd_model:
+            sd_model.warm_up(WARMUP_PIPELINES)
+        warmup_state["status"] = "ready"
+    except Exception as e:
+        logger.exception("Warm-up failed")
+        warmup_state["status"] = "failed"
+        warmup_state["error"] = str(e)
+
+@app.on_event("startup")
+def start_warm_up():
+    if not WARMUP_PIPELINES:
+        warmup_state["status"] = "ready"
+        return
+    # Warm up in the background so /health keeps answering meanwhile
+    threading.Thread(target=_warm_up, name="warm-up", daemon=True).start()
+
+@app.on_event("shutdown")
+def shutdown_job_queue():
+    job_queue.shutdown(wait=False)
+    image_writer.shutdown(wait=True)
+    thumbnail_store.shutdown(wait=False)
+    password_hasher.shutdown(wait=False)
+
+# Prometheus scrape endpoint
+@app.get("/metrics", include_in_schema=False)
+async def read_metrics():
+    return PlainTextResponse(metrics.REGISTRY.render(), media_type="text/plain; version=0.0.4")
 
 # Health check endpoint
 @app.get("/health")
 async def health_check():
     return {"status": "ok", "timestamp": datetime.utcnow()}
 
+# Readiness endpoint; only route traffic here once the models are warm
+@app.get("/ready")
+async def readiness_check():
+    body = {
+        "status": warmup_state["status"],
+        "error": warmup_state["error"],
+        "load_timings": model_registry.get().load_timings,
+        "timestamp": datetime.utcnow()
+    }
+    if warmup_state["status"] != "ready":
+        return JSONResponse(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, content=jsonable_encoder(body))
+    return body
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
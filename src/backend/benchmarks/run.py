@@ -0,0 +1,400 @@
+"""
+Offline benchmarks for the generation API.
+
+Drives the ASGI app in-process through httpx, with every checkpoint backed
+by a deterministic stub pipeline, so no weights, GPU or network are needed.
+Each scenario runs a fixed number of requests at several concurrency levels
+and reports p50/p95/p99 latency and throughput. Generation and inpainting
+latencies are end to end: submit, poll until the job finishes, fetch the
+result.
+
+Run from src/ (the app uses package-relative imports). Server settings such
+as INFERENCE_WORKERS or BATCH_WINDOW_MS are read from the environment as
+usual:
+
+    python -m backend.benchmarks.run
+    python -m backend.benchmarks.run --compare backend/benchmarks/baseline.json
+    python -m backend.benchmarks.run --output backend/benchmarks/baseline.json
+"""
+import argparse
+import asyncio
+import importlib
+import io
+import json
+import logging
+import os
+import platform
+import sys
+import tempfile
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+import httpx
+from PIL import Image
+
+SCENARIOS = ["generate", "generate_fast", "generate_variations", "generate_matrix", "inpaint", "upload_model", "list_models", "list_histories", "list_layers"]
+JOB_POLL_INTERVAL_SECONDS = 0.005
+BENCH_USER = {"username": "bench", "email": "bench@example.com", "password": "bench-password"}
+
+
+def percentile(values: List[float], q: float) -> float:
+    """Percentile with linear interpolation between closest ranks."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * q / 100
+    lower = int(rank)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (rank - lower)
+
+
+def summarize(latencies: List[float], errors: int, elapsed: float) -> Dict[str, Any]:
+    return {
+        "requests": len(latencies) + errors,
+        "errors": errors,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "mean_ms": round(sum(latencies) / len(latencies) * 1000, 2) if latencies else 0.0,
+        "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+    }
+
+
+def _png_bytes(size: int, color) -> bytes:
+    buffer = io.BytesIO()
+    Image.new("RGB", (size, size), color).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+class Benchmark:
+    """Sets up the app with stub pipelines and runs the scenarios against it."""
+
+    def __init__(self, args: argparse.Namespace):
+        self.args = args
+        self.app_module = None
+        self.client: Optional[httpx.AsyncClient] = None
+        self.client_id = None
+        self.model_id = None
+        self.layer_ids: List[int] = []
+        self.lookbook_id = None
+        self.image_bytes = _png_bytes(args.size, (200, 160, 140))
+        self.mask_bytes = _png_bytes(args.size, (255, 255, 255))
+        self._seed = 0
+
+    def load_app(self):
+        # The app reads its configuration at import time
+        self.app_module = importlib.import_module("backend.app")
+        from .stub_pipeline import install_stub_pipelines
+
+        create_model = self.app_module._create_sd_model
+        step_seconds = self.args.step_ms / 1000
+        self.app_module.model_registry.factory = lambda checkpoint: install_stub_pipelines(
+            create_model(checkpoint), step_seconds
+        )
+
+        # Seed an admin account directly; creating users needs an admin
+        db = self.app_module.SessionLocal()
+        try:
+            models = self.app_module.models
+            if not db.query(models.User).filter(models.User.username == BENCH_USER["username"]).first():
+                db.add(models.User(
+                    username=BENCH_USER["username"],
+                    email=BENCH_USER["email"],
+                    hashed_password=self.app_module.get_password_hash(BENCH_USER["password"]),
+                    role="admin"
+                ))
+                db.commit()
+        finally:
+            db.close()
+
+    async def setup(self):
+        response = await self.client.post(
+            "/token",
+            data={"username": BENCH_USER["username"], "password": BENCH_USER["password"]}
+        )
+        response.raise_for_status()
+        self.client.headers["Authorization"] = f"Bearer {response.json()['access_token']}"
+
+        response = await self.client.post("/clients/", json={"name": "Benchmark Agency"})
+        response.raise_for_status()
+        self.client_id = response.json()["id"]
+
+        await self.upload_model(0)
+        response = await self.client.get("/models/", params={"client_id": self.client_id})
+        self.model_id = response.json()[0]["id"]
+
+        # One layer of each type, then a second hair and outfit for the matrix
+        for layer_type, prompt in (
+            ("hair", "long wavy hair"),
+            ("outfit", "linen summer dress"),
+            ("scene", "beach at golden hour"),
+            ("hair", "sleek bob"),
+            ("outfit", "tailored blazer"),
+        ):
+            response = await self.client.post("/layers/", data={
+                "name": f"bench {layer_type}",
+                "type": layer_type,
+                "prompt": prompt,
+                "strength": "0.8"
+            })
+            response.raise_for_status()
+            self.layer_ids.append(response.json()["id"])
+
+        response = await self.client.post("/lookbooks/", json={"client_id": self.client_id, "name": "Benchmark Lookbook"})
+        response.raise_for_status()
+        self.lookbook_id = response.json()["id"]
+
+    def next_seed(self) -> int:
+        self._seed += 1
+        return self._seed
+
+    async def wait_for_job(self, job_id: str):
+        while True:
+            response = await self.client.get(f"/jobs/{job_id}")
+            response.raise_for_status()
+            job_status = response.json()["status"]
+            if job_status == "succeeded":
+                break
+            if job_status in ("failed", "cancelled"):
+                raise RuntimeError(f"Job {job_id} {job_status}: {response.json().get('error')}")
+            await asyncio.sleep(JOB_POLL_INTERVAL_SECONDS)
+        response = await self.client.get(f"/jobs/{job_id}/result")
+        response.raise_for_status()
+
+    async def generate(self, index: int, preset: Optional[str] = None, variations: int = 1):
+        # Unique seeds keep the result cache out of the measurement
+        settings = {
+            "seed": self.next_seed(),
+            "width": self.args.size,
+            "height": self.args.size,
+            "num_inference_steps": self.args.steps,
+        }
+        if preset:
+            settings["preset"] = preset
+            del settings["num_inference_steps"]
+        response = await self.client.post("/generate/", json={
+            "model_id": self.model_id,
+            "hair_layer_id": self.layer_ids[0],
+            "outfit_layer_id": self.layer_ids[1],
+            "scene_layer_id": self.layer_ids[2],
+            "prompt": f"studio portrait {index % 4}",
+            "negative_prompt": "blurry",
+            "settings": settings,
+            "variations": variations
+        })
+        response.raise_for_status()
+        await self.wait_for_job(response.json()["job_id"])
+
+    async def generate_fast(self, index: int):
+        await self.generate(index, preset="fast")
+
+    async def generate_variations(self, index: int):
+        await self.generate(index, variations=4)
+
+    async def generate_matrix(self, index: int):
+        # 2 hair x 2 outfit x 1 scene, added to a lookbook
+        response = await self.client.post("/generate/matrix/", json={
+            "model_id": self.model_id,
+            "lookbook_id": self.lookbook_id,
+            "hair_layer_ids": [self.layer_ids[0], self.layer_ids[3]],
+            "outfit_layer_ids": [self.layer_ids[1], self.layer_ids[4]],
+            "scene_layer_ids": [self.layer_ids[2]],
+            "prompt": f"studio portrait {index % 4}",
+            "negative_prompt": "blurry",
+            "settings": {
+                "seed": self.next_seed(),
+                "width": self.args.size,
+                "height": self.args.size,
+                "num_inference_steps": self.args.steps,
+            }
+        })
+        response.raise_for_status()
+        await self.wait_for_job(response.json()["job_id"])
+
+    async def inpaint(self, index: int):
+        response = await self.client.post(
+            "/inpaint/",
+            data={"model_id": str(self.model_id), "prompt": "red lipstick"},
+            files={
+                "image": ("image.png", self.image_bytes, "image/png"),
+                "mask": ("mask.png", self.mask_bytes, "image/png"),
+            }
+        )
+        response.raise_for_status()
+        await self.wait_for_job(response.json()["job_id"])
+
+    async def upload_model(self, index: int):
+        response = await self.client.post(
+            "/models/",
+            data={"client_id": str(self.client_id), "name": f"bench model {index}"},
+            files=[
+                ("reference_images", (f"reference_{n}.png", self.image_bytes, "image/png"))
+                for n in range(2)
+            ]
+        )
+        response.raise_for_status()
+
+    async def list_models(self, index: int):
+        (await self.client.get("/models/", params={"client_id": self.client_id})).raise_for_status()
+
+    async def list_histories(self, index: int):
+        (await self.client.get("/histories/", params={"model_id": self.model_id})).raise_for_status()
+
+    async def list_layers(self, index: int):
+        (await self.client.get("/layers/")).raise_for_status()
+
+    async def run_level(self, request: Callable[[int], Awaitable[None]], concurrency: int) -> Dict[str, Any]:
+        """Run args.requests requests with at most concurrency in flight."""
+        latencies: List[float] = []
+        errors = 0
+        pending = iter(range(self.args.requests))
+
+        async def worker():
+            nonlocal errors
+            for index in pending:
+                started = time.perf_counter()
+                try:
+                    await request(index)
+                except Exception as e:
+                    errors += 1
+                    print(f"  request failed: {e}", file=sys.stderr)
+                    continue
+                latencies.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        return summarize(latencies, errors, time.perf_counter() - started)
+
+    async def run(self) -> Dict[str, Any]:
+        transport = httpx.ASGITransport(app=self.app_module.app)
+        results: Dict[str, Dict[str, Any]] = {}
+        async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=None) as client:
+            self.client = client
+            await self.setup()
+            for scenario in self.args.scenarios:
+                request = getattr(self, scenario)
+                # One untimed request so lazy setup is not measured
+                await request(-1)
+                results[scenario] = {}
+                for concurrency in self.args.concurrency:
+                    summary = await self.run_level(request, concurrency)
+                    results[scenario][str(concurrency)] = summary
+                    print(
+                        f"{scenario:<20} c={concurrency:<3} p50 {summary['p50_ms']:>9.1f} ms  "
+                        f"p95 {summary['p95_ms']:>9.1f} ms  p99 {summary['p99_ms']:>9.1f} ms  "
+                        f"{summary['throughput_rps']:>8.1f} req/s  errors {summary['errors']}"
+                    )
+        self.app_module.job_queue.shutdown()
+        return results
+
+    def environment(self) -> Dict[str, Any]:
+        module = self.app_module
+        return {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "server": {
+                "INFERENCE_WORKERS": module.INFERENCE_WORKERS,
+                "INFERENCE_THREADS_PER_WORKER": module.INFERENCE_THREADS_PER_WORKER,
+                "BATCH_WINDOW_MS": module.BATCH_WINDOW_MS,
+                "MAX_BATCH_SIZE": module.MAX_BATCH_SIZE,
+                "PROMPT_CACHE_MB": module.PROMPT_CACHE_MB,
+                "RESULT_CACHE_SIZE": module.RESULT_CACHE_SIZE,
+            },
+        }
+
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any], max_regression: Optional[float]) -> bool:
+    """
+    Print relative changes against a baseline.
+
+    Returns:
+        False if any p95 latency regressed by more than max_regression percent
+    """
+    ok = True
+    print("\nChange against baseline (negative latency / positive throughput is better):")
+    for scenario, levels in results["results"].items():
+        for concurrency, summary in levels.items():
+            previous = baseline.get("results", {}).get(scenario, {}).get(concurrency)
+            if not previous:
+                continue
+            changes = {
+                metric: (summary[metric] - previous[metric]) / previous[metric] * 100 if previous[metric] else 0.0
+                for metric in ("p50_ms", "p95_ms", "p99_ms", "throughput_rps")
+            }
+            print(
+                f"{scenario:<20} c={concurrency:<3} " +
+                "  ".join(f"{metric} {change:+6.1f}%" for metric, change in changes.items())
+            )
+            if max_regression is not None and changes["p95_ms"] > max_regression:
+                ok = False
+    return ok
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="Comma-separated scenarios to run")
+    parser.add_argument("--concurrency", default="1,4,8", help="Comma-separated concurrency levels")
+    parser.add_argument("--requests", type=int, default=32, help="Requests per scenario and concurrency level")
+    parser.add_argument("--steps", type=int, default=30, help="Denoising steps per generation")
+    parser.add_argument("--step-ms", type=float, default=10.0, help="Simulated UNet time per denoising step")
+    parser.add_argument("--size", type=int, default=512, help="Width and height of generated images")
+    parser.add_argument("--output", help="Write results as JSON to this path, e.g. to record a new baseline")
+    parser.add_argument("--compare", help="Baseline JSON to compare against")
+    parser.add_argument("--verbose", action="store_true", help="Keep the app's request and job logging")
+    parser.add_argument("--max-regression", type=float, help="Exit with status 1 if any p95 latency regressed by more than this many percent")
+    args = parser.parse_args(argv)
+
+    args.scenarios = [s for s in args.scenarios.split(",") if s]
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+    args.concurrency = [int(c) for c in args.concurrency.split(",") if c]
+    return args
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    output = os.path.abspath(args.output) if args.output else None
+    baseline_path = os.path.abspath(args.compare) if args.compare else None
+
+    # Run in a scratch directory with its own database so nothing real is touched
+    workdir = tempfile.mkdtemp(prefix="stunning-bench-")
+    os.chdir(workdir)
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    os.environ["HF_HUB_OFFLINE"] = "1"
+    os.environ.setdefault("WARMUP_PIPELINES", "")
+
+    benchmark = Benchmark(args)
+    benchmark.load_app()
+    if not args.verbose:
+        logging.disable(logging.INFO)
+    print(f"Benchmarking in {workdir}")
+    results = {
+        "environment": benchmark.environment(),
+        "config": {
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "steps": args.steps,
+            "step_ms": args.step_ms,
+            "size": args.size,
+        },
+        "results": asyncio.run(benchmark.run()),
+    }
+
+    if output:
+        with open(output, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"Results written to {output}")
+
+    if baseline_path:
+        with open(baseline_path) as f:
+            baseline = json.load(f)
+        if not compare(results, baseline, args.max_regression):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
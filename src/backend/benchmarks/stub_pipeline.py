@@ -0,0 +1,134 @@
+import time
+import zlib
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional
+
+import torch
+from diffusers import DDIMScheduler
+from PIL import Image
+
+from ..ai_models.previews import latents_to_preview
+from ..ai_models.stable_diffusion import StableDiffusionModel
+
+HIDDEN_SIZE = 64
+VOCAB_SIZE = 4096
+
+
+class StubTokenizer:
+    """Maps words to stable token IDs; stands in for the CLIP tokenizer."""
+
+    model_max_length = 77
+
+    def __call__(self, text, padding=None, max_length=None, truncation=None, return_tensors=None):
+        texts = [text] if isinstance(text, str) else list(text)
+        length = max_length or self.model_max_length
+        input_ids = torch.zeros(len(texts), length, dtype=torch.long)
+        for row, item in enumerate(texts):
+            ids = [zlib.crc32(word.encode("utf-8")) % VOCAB_SIZE for word in item.split()][:length]
+            input_ids[row, :len(ids)] = torch.tensor(ids, dtype=torch.long)
+        return SimpleNamespace(input_ids=input_ids)
+
+
+class StubTextEncoder(torch.nn.Module):
+    """A fixed random embedding table with the text encoder's output shape."""
+
+    def __init__(self):
+        super().__init__()
+        generator = torch.Generator().manual_seed(0)
+        self.embedding = torch.nn.Embedding(VOCAB_SIZE, HIDDEN_SIZE)
+        with torch.no_grad():
+            self.embedding.weight.copy_(torch.randn(VOCAB_SIZE, HIDDEN_SIZE, generator=generator))
+
+    def forward(self, input_ids: torch.Tensor):
+        return (self.embedding(input_ids),)
+
+
+class StubPipeline:
+    """
+    Deterministic stand-in for the diffusers text-to-image and inpainting
+    pipelines.
+
+    Accepts the same call arguments, walks the scheduler's timesteps and
+    reports latents to the step callback, and returns an image derived from
+    the seeded latents. Each denoising step sleeps for a fixed time in place
+    of the UNet, so benchmark numbers reflect serving overhead and queueing
+    rather than the host's compute speed.
+    """
+
+    def __init__(self, step_seconds: float = 0.01, text_encoder: Optional[StubTextEncoder] = None):
+        """
+        Initialize the stub.
+
+        Args:
+            step_seconds: Simulated UNet time per denoising step
+            text_encoder: Text encoder to share with another stub pipeline
+        """
+        self.step_seconds = step_seconds
+        self.tokenizer = StubTokenizer()
+        self.text_encoder = text_encoder or StubTextEncoder()
+        self.scheduler = DDIMScheduler()
+
+    @property
+    def components(self) -> Dict[str, Any]:
+        return {"tokenizer": self.tokenizer, "text_encoder": self.text_encoder, "scheduler": self.scheduler}
+
+    def __call__(
+        self,
+        prompt=None,
+        negative_prompt=None,
+        prompt_embeds: torch.Tensor = None,
+        negative_prompt_embeds: torch.Tensor = None,
+        image: Image.Image = None,
+        mask_image: Image.Image = None,
+        width: int = 512,
+        height: int = 512,
+        num_inference_steps: int = 30,
+        guidance_scale: float = 7.5,
+        generator=None,
+        callback=None,
+        callback_steps: int = 1,
+        **kwargs
+    ):
+        if image is not None:
+            width, height = image.size
+        if prompt_embeds is not None:
+            batch_size = prompt_embeds.shape[0]
+        elif isinstance(prompt, list):
+            batch_size = len(prompt)
+        else:
+            batch_size = 1
+        generators: List[Optional[torch.Generator]] = generator if isinstance(generator, list) else [generator] * batch_size
+
+        latents = torch.stack([
+            torch.randn(4, height // 8, width // 8, generator=item_generator)
+            for item_generator in generators
+        ])
+
+        self.scheduler.set_timesteps(num_inference_steps)
+        for step, timestep in enumerate(self.scheduler.timesteps):
+            time.sleep(self.step_seconds)
+            latents = latents * 0.98
+            if callback is not None and step % callback_steps == 0:
+                callback(step, timestep, latents)
+
+        images = [
+            latents_to_preview(latents, index).resize((width, height), Image.NEAREST)
+            for index in range(batch_size)
+        ]
+        return SimpleNamespace(images=images)
+
+
+def install_stub_pipelines(model: StableDiffusionModel, step_seconds: float = 0.01) -> StableDiffusionModel:
+    """
+    Back a StableDiffusionModel with stub pipelines so it never loads weights.
+
+    Args:
+        model: Model to patch, typically fresh from the registry factory
+        step_seconds: Simulated UNet time per denoising step
+
+    Returns:
+        The same model
+    """
+    model.txt2img_pipeline = StubPipeline(step_seconds)
+    model.inpaint_pipeline = StubPipeline(step_seconds, text_encoder=model.txt2img_pipeline.text_encoder)
+    return model
@@ -0,0 +1,191 @@
+import asyncio
+import hashlib
+import mimetypes
+import os
+import re
+import threading
+from collections import OrderedDict
+from typing import Dict, Mapping, Optional, Tuple
+
+from starlette.responses import Response
+
+CHUNK_SIZE = 256 * 1024
+
+# Content-addressed files (see storage.ContentStore) are named by their SHA-256
+_DIGEST_NAME = re.compile(r"^[0-9a-f]{64}$")
+_RANGE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+ZERO_COPY_EXTENSION = "http.response.zerocopysend"
+
+
+class DigestCache:
+    """
+    SHA-256 digests of files. Files stored by content hash carry the digest
+    in their name; any other file is hashed once and remembered, keyed by
+    path, size and mtime, until it changes.
+    """
+
+    def __init__(self, max_entries: int = 4096):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Tuple[str, int, int], str]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, path: str, stat: Optional[os.stat_result] = None) -> str:
+        name = os.path.splitext(os.path.basename(path))[0]
+        if _DIGEST_NAME.match(name):
+            return name
+        if stat is None:
+            stat = os.stat(path)
+        key = (path, stat.st_size, stat.st_mtime_ns)
+        with self._lock:
+            digest = self._entries.get(key)
+            if digest is not None:
+                self._entries.move_to_end(key)
+                return digest
+        hasher = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                hasher.update(chunk)
+        digest = hasher.hexdigest()
+        with self._lock:
+            self._entries[key] = digest
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return digest
+
+
+# Shared by everything that keys files by content, e.g. ETags and thumbnails
+file_digests = DigestCache()
+
+
+def content_etag(path: str, stat: os.stat_result) -> str:
+    """
+    Return a strong ETag derived from a file's content.
+
+    Files stored by content hash carry the digest in their name; any other
+    file is hashed once and remembered until it changes.
+    """
+    return f'"{file_digests.get(path, stat)}"'
+
+
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """
+    Parse a single-range Range header.
+
+    Returns:
+        Inclusive (start, end) byte positions, or None to serve the whole
+        file (no header, a multi-range or malformed header)
+
+    Raises:
+        ValueError: If the range cannot be satisfied
+    """
+    if not header:
+        return None
+    match = _RANGE.match(header.strip())
+    if match is None:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        # Suffix range: the last N bytes
+        length = int(last)
+        if length == 0:
+            raise ValueError("Empty suffix range")
+        return max(0, size - length), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        raise ValueError("Range starts beyond the end of the file")
+    return start, end
+
+
+def _etag_matches(header: Optional[str], etag: str) -> bool:
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    # Weak comparison, as If-None-Match requires
+    candidates = [candidate.strip() for candidate in header.split(",")]
+    return any(candidate.replace("W/", "", 1) == etag for candidate in candidates)
+
+
+class FileRangeResponse(Response):
+    """
+    Sends a byte range of a file.
+
+    Uses the ASGI zero-copy send extension when the server offers it, so the
+    kernel copies the file straight to the socket; otherwise the file is read
+    in chunks on a worker thread.
+    """
+
+    def __init__(self, path: str, start: int, end: int, status_code: int, headers: Mapping[str, str], media_type: Optional[str]):
+        super().__init__(status_code=status_code, headers=headers, media_type=media_type)
+        self.path = path
+        self.start = start
+        self.end = end
+        self.headers["content-length"] = str(end - start + 1)
+
+    async def __call__(self, scope, receive, send):
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        count = self.end - self.start + 1
+        with open(self.path, "rb") as f:
+            if ZERO_COPY_EXTENSION in scope.get("extensions", {}):
+                await send({"type": ZERO_COPY_EXTENSION, "file": f, "offset": self.start, "count": count, "more_body": False})
+                return
+            await asyncio.to_thread(f.seek, self.start)
+            remaining = count
+            more_body = True
+            while more_body:
+                chunk = await asyncio.to_thread(f.read, min(CHUNK_SIZE, remaining)) if remaining > 0 else b""
+                remaining -= len(chunk)
+                # An empty read means the file shrank while being sent; end the response
+                more_body = bool(chunk) and remaining > 0
+                await send({"type": "http.response.body", "body": chunk, "more_body": more_body})
+
+
+async def file_response(
+    path: str,
+    request_headers: Mapping[str, str],
+    cache_control: str = "private, max-age=31536000, immutable",
+    media_type: Optional[str] = None
+) -> Response:
+    """
+    Serve a file with a content-derived ETag, conditional GET and Range support.
+
+    Args:
+        path: File to serve
+        request_headers: Headers of the request being answered
+        cache_control: Cache-Control value for the response
+        media_type: Content type; guessed from the file name by default
+
+    Returns:
+        304 if the client's copy is current, 206 for a satisfiable range,
+        416 for an unsatisfiable one, and 200 with the whole file otherwise
+    """
+    stat = await asyncio.to_thread(os.stat, path)
+    etag = await asyncio.to_thread(content_etag, path, stat)
+    headers: Dict[str, str] = {"etag": etag, "cache-control": cache_control, "accept-ranges": "bytes"}
+
+    if _etag_matches(request_headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+
+    media_type = media_type or mimetypes.guess_type(path)[0] or "application/octet-stream"
+    size = stat.st_size
+    range_header = request_headers.get("range")
+    if_range = request_headers.get("if-range")
+    if if_range is not None and if_range.strip() != etag:
+        # The client's partial copy is stale; send the whole file
+        range_header = None
+
+    try:
+        byte_range = parse_range(range_header, size)
+    except ValueError:
+        headers["content-range"] = f"bytes */{size}"
+        return Response(status_code=416, headers=headers)
+
+    if byte_range is None:
+        return FileRangeResponse(path, 0, size - 1, 200, headers, media_type)
+    start, end = byte_range
+    headers["content-range"] = f"bytes {start}-{end}/{size}"
+    return FileRangeResponse(path, start, end, 206, headers, media_type)
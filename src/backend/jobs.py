@@ -0,0 +1,294 @@
+import logging
+import threading
+import uuid
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+_current = threading.local()
+
+
+def current_job() -> Optional["Job"]:
+    """Return the job running on the calling worker thread, if any."""
+    return getattr(_current, "job", None)
+
+
+class JobStatus:
+    QUEUED = "queued"
+    RUNNING = "running"
+    SUCCEEDED = "succeeded"
+    FAILED = "failed"
+    CANCELLED = "cancelled"
+
+    FINISHED = (SUCCEEDED, FAILED, CANCELLED)
+
+
+class Job:
+    """State of a single background job."""
+
+    def __init__(self, kind: str, owner_id: Optional[int] = None, total_steps: Optional[int] = None):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.owner_id = owner_id
+        self.status = JobStatus.QUEUED
+        self.result: Optional[Dict[str, Any]] = None
+        self.error: Optional[str] = None
+        self.created_at = datetime.utcnow()
+        self.started_at: Optional[datetime] = None
+        self.finished_at: Optional[datetime] = None
+        self.done = threading.Event()
+
+        # Denoising progress, updated from the pipeline step callback
+        self.progress: Optional[Dict[str, int]] = None
+        if total_steps is not None:
+            self.progress = {"step": 0, "total_steps": total_steps}
+        self.preview: Optional[str] = None
+        self.progress_version = 0
+
+        # Set by JobQueue.cancel(); running work stops at its next step
+        self.cancel_requested = threading.Event()
+        self.steps_saved: Optional[int] = None
+
+        # Seconds spent in each stage of the work, filled in by the job itself
+        self.timings: Dict[str, float] = {}
+
+    def update_progress(self, step: int, total_steps: int, preview: Optional[str] = None):
+        """
+        Record denoising progress.
+
+        Args:
+            step: Number of completed steps
+            total_steps: Total number of steps
+            preview: Latest preview image as a data URL, if one was rendered
+        """
+        self.progress = {"step": step, "total_steps": total_steps}
+        if preview is not None:
+            self.preview = preview
+        self.progress_version += 1
+
+    @property
+    def finished(self) -> bool:
+        return self.status in JobStatus.FINISHED
+
+    def _remaining_steps(self) -> Optional[int]:
+        if self.progress is None or self.progress.get("total_steps") is None:
+            return None
+        return max(0, self.progress["total_steps"] - self.progress["step"])
+
+
+class JobQueue:
+    """
+    Runs inference jobs on a pool of worker threads so request handlers
+    can return as soon as a job is submitted.
+    """
+
+    def __init__(
+        self,
+        num_workers: int = 1,
+        max_finished_jobs: int = 1000,
+        initializer: Optional[Callable[..., None]] = None,
+        initargs: tuple = (),
+        on_finish: Optional[Callable[[Job], None]] = None
+    ):
+        """
+        Initialize the job queue.
+
+        Args:
+            num_workers: Number of worker threads running jobs concurrently
+            max_finished_jobs: Number of finished jobs kept for status lookups
+            initializer: Called once in each worker thread before it runs jobs
+            initargs: Arguments for initializer
+            on_finish: Called with each job once it has finished, e.g. to
+                record metrics
+        """
+        self.num_workers = num_workers
+        self.max_finished_jobs = max_finished_jobs
+        self.on_finish = on_finish
+        self._executor = ThreadPoolExecutor(
+            max_workers=num_workers,
+            thread_name_prefix="inference",
+            initializer=initializer,
+            initargs=initargs
+        )
+        self._jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.cancelled_jobs = 0
+        self.steps_saved = 0
+
+    def submit(
+        self,
+        kind: str,
+        fn: Callable[..., Dict[str, Any]],
+        *args,
+        owner_id: Optional[int] = None,
+        total_steps: Optional[int] = None,
+        **kwargs
+    ) -> Job:
+        """
+        Queue a job for execution.
+
+        Args:
+            kind: Job type, e.g. "generate" or "inpaint"
+            fn: Callable doing the work; its return value becomes the job
+                result. It may instead return a Future to hand the rest of the
+                work (e.g. encoding the image) to another pool: the worker is
+                freed right away and the job finishes when the Future does
+            *args: Positional arguments for fn
+            owner_id: ID of the user who submitted the job
+            total_steps: Expected number of denoising steps, if known
+            **kwargs: Keyword arguments for fn
+
+        Returns:
+            The queued job
+        """
+        job = Job(kind, owner_id=owner_id, total_steps=total_steps)
+        with self._lock:
+            self._jobs[job.id] = job
+            self._prune()
+        self._executor.submit(self._run, job, fn, args, kwargs)
+        logger.info(f"Queued {kind} job {job.id}")
+        return job
+
+    def complete(self, kind: str, result: Dict[str, Any], owner_id: Optional[int] = None) -> Job:
+        """
+        Record a job whose result is already known, e.g. from a cache.
+
+        Args:
+            kind: Job type
+            result: The job result
+            owner_id: ID of the user who submitted the job
+
+        Returns:
+            The finished job
+        """
+        job = Job(kind, owner_id=owner_id)
+        job.result = result
+        job.status = JobStatus.SUCCEEDED
+        job.started_at = job.finished_at = job.created_at
+        job.done.set()
+        with self._lock:
+            self._jobs[job.id] = job
+            self._prune()
+        self._notify(job)
+        return job
+
+    def cancel(self, job_id: str) -> Optional[Job]:
+        """
+        Cancel a queued or running job.
+
+        A queued job is finished right away and never runs. A running job is
+        only flagged; its work must check job.cancel_requested (e.g. from a
+        step callback) and raise to stop. Finished jobs are left unchanged.
+
+        Returns:
+            The job, or None if it does not exist
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job.finished:
+                return job
+            job.cancel_requested.set()
+            cancelled_while_queued = job.status == JobStatus.QUEUED
+            if cancelled_while_queued:
+                self._mark_cancelled(job)
+                job.finished_at = datetime.utcnow()
+                job.done.set()
+        logger.info(f"Cancellation requested for job {job_id}")
+        if cancelled_while_queued:
+            self._notify(job)
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def jobs(self) -> List[Job]:
+        with self._lock:
+            return list(self._jobs.values())
+
+    @property
+    def queue_depth(self) -> int:
+        """Number of jobs waiting for a free worker."""
+        with self._lock:
+            return sum(1 for job in self._jobs.values() if job.status == JobStatus.QUEUED)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "queue_depth": sum(1 for job in self._jobs.values() if job.status == JobStatus.QUEUED),
+                "running": sum(1 for job in self._jobs.values() if job.status == JobStatus.RUNNING),
+                "cancelled": self.cancelled_jobs,
+                "steps_saved": self.steps_saved,
+            }
+
+    def shutdown(self, wait: bool = True):
+        self._executor.shutdown(wait=wait, cancel_futures=True)
+
+    def _run(self, job: Job, fn: Callable, args: tuple, kwargs: dict):
+        with self._lock:
+            if job.finished:
+                # Cancelled while queued
+                return
+            job.status = JobStatus.RUNNING
+            job.started_at = datetime.utcnow()
+        _current.job = job
+        try:
+            result = fn(*args, **kwargs)
+        except Exception as e:
+            self._finish(job, error=e)
+            return
+        finally:
+            _current.job = None
+        if isinstance(result, Future):
+            result.add_done_callback(lambda future: self._finish_from_future(job, future))
+        else:
+            self._finish(job, result=result)
+
+    def _finish_from_future(self, job: Job, future: Future):
+        if future.cancelled():
+            self._finish(job, error=RuntimeError("Job result was cancelled"))
+        elif future.exception() is not None:
+            self._finish(job, error=future.exception())
+        else:
+            self._finish(job, result=future.result())
+
+    def _finish(self, job: Job, result: Optional[Dict[str, Any]] = None, error: Optional[BaseException] = None):
+        try:
+            if error is None:
+                job.result = result
+                job.status = JobStatus.SUCCEEDED
+            elif job.cancel_requested.is_set():
+                with self._lock:
+                    self._mark_cancelled(job)
+                logger.info(f"Job {job.id} cancelled, {job.steps_saved} steps saved")
+            else:
+                logger.error(f"Job {job.id} failed", exc_info=error)
+                job.error = str(error)
+                job.status = JobStatus.FAILED
+        finally:
+            job.finished_at = datetime.utcnow()
+            job.done.set()
+            self._notify(job)
+
+    def _notify(self, job: Job):
+        if self.on_finish is None:
+            return
+        try:
+            self.on_finish(job)
+        except Exception:
+            logger.exception(f"on_finish failed for job {job.id}")
+
+    def _mark_cancelled(self, job: Job):
+        job.status = JobStatus.CANCELLED
+        job.steps_saved = job._remaining_steps()
+        self.cancelled_jobs += 1
+        self.steps_saved += job.steps_saved or 0
+
+    def _prune(self):
+        """Drop the oldest finished jobs beyond the retention limit."""
+        finished = [job_id for job_id, job in self._jobs.items() if job.finished]
+        for job_id in finished[:max(0, len(finished) - self.max_finished_jobs)]:
+            del self._jobs[job_id]
@@ -0,0 +1,51 @@
+from datetime import datetime
+from typing import Any, List, Optional, Sequence
+
+from sqlalchemy import func, select, update
+from sqlalchemy.orm import Session
+
+
+class LookbookAppender:
+    """
+    Appends entries to the end of a lookbook with unique, consecutive orders.
+
+    Reading the last order and inserting after it is only safe if no one
+    else appends to the same lookbook in between. Every append therefore
+    starts by touching the lookbook row: on PostgreSQL that row lock queues
+    concurrent appends to the same lookbook, across threads and processes;
+    on SQLite the write takes the database write lock. Either way the
+    second append reads the last order only after the first has committed.
+    """
+
+    def __init__(self, lookbook_model: Any, entry_model: Any):
+        """
+        Initialize the appender.
+
+        Args:
+            lookbook_model: Mapped lookbook class, with id and updated_at
+            entry_model: Mapped entry class, with lookbook_id, history_id, order and notes
+        """
+        self.lookbook_model = lookbook_model
+        self.entry_model = entry_model
+
+    def append(self, db: Session, lookbook_id: int, history_ids: Sequence[int], notes: Optional[str] = None) -> List[Any]:
+        """
+        Add entries for the given histories after the lookbook's last entry.
+
+        The lookbook stays locked until the session's transaction ends, so
+        commit (or roll back) right after.
+
+        Returns:
+            The new entries, in order
+        """
+        lookbook, entry = self.lookbook_model, self.entry_model
+        db.execute(update(lookbook).where(lookbook.id == lookbook_id).values(updated_at=datetime.utcnow()))
+        last_order = db.scalar(select(func.max(entry.order)).where(entry.lookbook_id == lookbook_id))
+        first_order = 0 if last_order is None else last_order + 1
+        entries = [
+            entry(lookbook_id=lookbook_id, history_id=history_id, order=first_order + index, notes=notes)
+            for index, history_id in enumerate(history_ids)
+        ]
+        db.add_all(entries)
+        db.flush()
+        return entries
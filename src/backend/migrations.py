@@ -0,0 +1,86 @@
+import logging
+from datetime import datetime
+from typing import Callable, List, Sequence, Tuple
+
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Connection, Engine
+
+logger = logging.getLogger(__name__)
+
+# Tables are created from the models with create_all, which never alters an
+# existing table. Migrations bring databases created by older versions up to
+# date; each runs once, in order, and is recorded in schema_migrations. They
+# check before changing anything, so they also run cleanly on new databases.
+
+
+def _add_columns(columns: Sequence[Tuple[str, str, str]]) -> Callable[[Connection], None]:
+    def migrate(connection: Connection):
+        inspector = inspect(connection)
+        tables = set(inspector.get_table_names())
+        for table, column, ddl_type in columns:
+            if table not in tables:
+                continue
+            if column not in {existing["name"] for existing in inspector.get_columns(table)}:
+                connection.execute(text(f'ALTER TABLE {table} ADD COLUMN {column} {ddl_type}'))
+    return migrate
+
+
+def _create_indexes(indexes: Sequence[Tuple[str, str, Sequence[str]]]) -> Callable[[Connection], None]:
+    def migrate(connection: Connection):
+        tables = set(inspect(connection).get_table_names())
+        for name, table, columns in indexes:
+            if table not in tables:
+                continue
+            quoted = ", ".join(f'"{column}"' for column in columns)
+            connection.execute(text(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({quoted})"))
+    return migrate
+
+
+MIGRATIONS: List[Tuple[str, Callable[[Connection], None]]] = [
+    # Checkpoint selection per client, overridable per model
+    ("0001_checkpoint_columns", _add_columns([
+        ("clients", "checkpoint", "VARCHAR"),
+        ("models", "checkpoint", "VARCHAR"),
+    ])),
+    # Encoding of a client's generated images
+    ("0002_client_output_format_column", _add_columns([
+        ("clients", "output_format", "VARCHAR"),
+    ])),
+    # Composite indexes matching the keyset pagination order of each listing,
+    # with and without its usual filter
+    ("0003_keyset_pagination_indexes", _create_indexes([
+        ("ix_histories_created_at_id", "histories", ("created_at", "id")),
+        ("ix_histories_model_id_created_at_id", "histories", ("model_id", "created_at", "id")),
+        ("ix_models_created_at_id", "models", ("created_at", "id")),
+        ("ix_models_client_id_created_at_id", "models", ("client_id", "created_at", "id")),
+        ("ix_layers_created_at_id", "layers", ("created_at", "id")),
+        ("ix_layers_type_created_at_id", "layers", ("type", "created_at", "id")),
+        ("ix_lookbook_entries_lookbook_id_order_id", "lookbook_entries", ("lookbook_id", "order", "id")),
+    ])),
+]
+
+
+def upgrade(engine: Engine) -> List[str]:
+    """
+    Apply the migrations that have not run on this database yet.
+
+    Returns:
+        Names of the migrations applied
+    """
+    applied = []
+    with engine.begin() as connection:
+        connection.execute(text(
+            "CREATE TABLE IF NOT EXISTS schema_migrations (name VARCHAR PRIMARY KEY, applied_at TIMESTAMP NOT NULL)"
+        ))
+        done = {row[0] for row in connection.execute(text("SELECT name FROM schema_migrations"))}
+        for name, migrate in MIGRATIONS:
+            if name in done:
+                continue
+            logger.info(f"Applying migration {name}")
+            migrate(connection)
+            connection.execute(
+                text("INSERT INTO schema_migrations (name, applied_at) VALUES (:name, :applied_at)"),
+                {"name": name, "applied_at": datetime.utcnow()}
+            )
+            applied.append(name)
+    return applied
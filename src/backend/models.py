@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, ForeignKey, DateTime, Text, JSON
+from sqlalchemy import Column, Integer, String, Float, ForeignKey, DateTime, Text, JSON, Index
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 from datetime import datetime
@@ -14,6 +14,8 @@ class Client(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     theme_settings = Column(JSON, nullable=True)
+    checkpoint = Column(String, nullable=True)  # Base Stable Diffusion checkpoint for the client's models
+    output_format = Column(String, nullable=True)  # png, webp or jpeg for generated images
 
     # Relationships
     models = relationship("Model", back_populates="client", cascade="all, delete-orphan")
@@ -22,12 +24,17 @@ class Client(Base):
 
 class Model(Base):
     __tablename__ = "models"
+    __table_args__ = (
+        Index("ix_models_created_at_id", "created_at", "id"),
+        Index("ix_models_client_id_created_at_id", "client_id", "created_at", "id"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     client_id = Column(Integer, ForeignKey("clients.id"))
     name = Column(String, index=True)
     base_embedding = Column(String)  # Path to the stored embedding file
     reference_image_path = Column(String)
+    checkpoint = Column(String, nullable=True)  # Overrides the client's checkpoint
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
@@ -39,6 +46,10 @@ class Model(Base):
 
 class Layer(Base):
     __tablename__ = "layers"
+    __table_args__ = (
+        Index("ix_layers_created_at_id", "created_at", "id"),
+        Index("ix_layers_type_created_at_id", "type", "created_at", "id"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String, index=True)
@@ -71,6 +82,10 @@ class ModelLayer(Base):
 
 class History(Base):
     __tablename__ = "histories"
+    __table_args__ = (
+        Index("ix_histories_created_at_id", "created_at", "id"),
+        Index("ix_histories_model_id_created_at_id", "model_id", "created_at", "id"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     model_id = Column(Integer, ForeignKey("models.id"))
@@ -102,6 +117,9 @@ class Lookbook(Base):
 
 class LookbookEntry(Base):
     __tablename__ = "lookbook_entries"
+    __table_args__ = (
+        Index("ix_lookbook_entries_lookbook_id_order_id", "lookbook_id", "order", "id"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     lookbook_id = Column(Integer, ForeignKey("lookbooks.id"))
@@ -0,0 +1,87 @@
+import base64
+import json
+from datetime import datetime
+from typing import Any, List, Optional, Sequence, Tuple
+
+from sqlalchemy import tuple_
+
+
+def encode_cursor(values: Sequence[Any]) -> str:
+    """Encode the sort key of the last row of a page as an opaque cursor."""
+    payload = [value.isoformat() if isinstance(value, datetime) else value for value in values]
+    return base64.urlsafe_b64encode(json.dumps(payload, separators=(",", ":")).encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str, columns: Sequence[Any]) -> List[Any]:
+    """
+    Decode a cursor into sort key values for the given columns.
+
+    Raises:
+        ValueError: If the cursor is malformed or does not match the columns
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+    except (ValueError, UnicodeError) as e:
+        raise ValueError("Invalid cursor") from e
+    if not isinstance(values, list) or len(values) != len(columns):
+        raise ValueError("Invalid cursor")
+    return [_decode_value(column, value) for column, value in zip(columns, values)]
+
+
+def _decode_value(column: Any, value: Any) -> Any:
+    # Cursors come from clients, so every value must have its column's type
+    if value is None:
+        return None
+    try:
+        python_type = column.type.python_type
+    except NotImplementedError:
+        return value
+    if python_type is datetime:
+        if not isinstance(value, str):
+            raise ValueError("Invalid cursor")
+        try:
+            return datetime.fromisoformat(value)
+        except (TypeError, ValueError) as e:
+            raise ValueError("Invalid cursor") from e
+    if python_type is float and isinstance(value, int) and not isinstance(value, bool):
+        return float(value)
+    if not isinstance(value, python_type) or (isinstance(value, bool) and python_type is not bool):
+        raise ValueError("Invalid cursor")
+    return value
+
+
+def keyset(statement, columns: Sequence[Any], cursor: Optional[str] = None, descending: bool = False):
+    """
+    Order a query or select by columns and start it after a cursor.
+
+    The last column must be unique (e.g. the primary key) so the order is
+    total. With a composite index on the filter and sort columns, every page
+    is an index range scan, however deep it is.
+
+    Args:
+        statement: ORM query or select statement
+        columns: Sort columns, e.g. (History.created_at, History.id)
+        cursor: Cursor returned with the previous page, if any
+        descending: Sort newest first
+
+    Raises:
+        ValueError: If the cursor is invalid
+    """
+    if cursor:
+        after = tuple_(*decode_cursor(cursor, columns))
+        statement = statement.where(tuple_(*columns) < after if descending else tuple_(*columns) > after)
+    return statement.order_by(*(column.desc() if descending else column.asc() for column in columns))
+
+
+def split_page(rows: Sequence[Any], columns: Sequence[Any], limit: int) -> Tuple[List[Any], Optional[str]]:
+    """
+    Split rows fetched with limit + 1 into a page and the cursor of the next one.
+
+    Returns:
+        The page, and the next page's cursor or None on the last page
+    """
+    page = list(rows[:limit])
+    if len(rows) <= limit or not page:
+        return page, None
+    return page, encode_cursor([getattr(page[-1], column.key) for column in columns])
@@ -0,0 +1,125 @@
+import asyncio
+import multiprocessing
+import threading
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Dict, Optional
+
+from passlib.context import CryptContext
+
+# Each worker process builds its own context on import
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+
+def hash_password(password: str) -> str:
+    return pwd_context.hash(password)
+
+
+def verify_password(plain_password: str, hashed_password: str) -> bool:
+    return pwd_context.verify(plain_password, hashed_password)
+
+
+class PasswordHasherBusy(Exception):
+    """Raised when too many verifications are already waiting for a worker."""
+
+    def __init__(self, retry_after: float):
+        super().__init__("Password verification queue is full")
+        self.retry_after = retry_after
+
+
+class PasswordHasher:
+    """
+    Runs bcrypt hashing and verification on a bounded process pool.
+
+    Every hash costs a few hundred milliseconds of CPU. Run on the event loop
+    it stalls all requests, and run on threads it competes for the GIL with
+    the rest of the server; separate processes keep it off both. Verification
+    is admission-controlled: once max_pending calls are waiting or running,
+    further ones are rejected at once instead of queueing behind them, so a
+    burst of logins cannot tie up the server.
+    """
+
+    def __init__(self, max_workers: int = 2, max_pending: int = 8, retry_after: float = 1.0):
+        """
+        Initialize the hasher.
+
+        Args:
+            max_workers: Worker processes; 0 runs hashes on a thread instead
+            max_pending: Verifications admitted at once (0 for no limit)
+            retry_after: Seconds rejected callers are told to wait
+        """
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.retry_after = retry_after
+        self._executor: Optional[Executor] = None
+        self._lock = threading.Lock()
+        self.pending = 0
+        # Outcomes of admitted verifications: matching password, wrong
+        # password, or an error such as an unreadable hash
+        self.verified = 0
+        self.mismatched = 0
+        self.errors = 0
+        self.rejected = 0
+
+    def _get_executor(self) -> Executor:
+        # Workers are started on first use, and spawned rather than forked so
+        # they never inherit the inference threads or loaded models
+        with self._lock:
+            if self._executor is None:
+                if self.max_workers > 0:
+                    self._executor = ProcessPoolExecutor(
+                        max_workers=self.max_workers,
+                        mp_context=multiprocessing.get_context("spawn")
+                    )
+                else:
+                    self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="password-hasher")
+            return self._executor
+
+    async def hash(self, password: str) -> str:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._get_executor(), hash_password, password)
+
+    async def verify(self, plain_password: str, hashed_password: str) -> bool:
+        """
+        Check a password against its hash.
+
+        Raises:
+            PasswordHasherBusy: If max_pending verifications are already admitted
+        """
+        with self._lock:
+            if self.max_pending and self.pending >= self.max_pending:
+                self.rejected += 1
+                raise PasswordHasherBusy(self.retry_after)
+            self.pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            matched = await loop.run_in_executor(self._get_executor(), verify_password, plain_password, hashed_password)
+        except BaseException:
+            with self._lock:
+                self.pending -= 1
+                self.errors += 1
+            raise
+        with self._lock:
+            self.pending -= 1
+            if matched:
+                self.verified += 1
+            else:
+                self.mismatched += 1
+        return matched
+
+    def shutdown(self, wait: bool = True):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait, cancel_futures=True)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "workers": self.max_workers,
+                "max_pending": self.max_pending,
+                "pending": self.pending,
+                "verified": self.verified,
+                "mismatched": self.mismatched,
+                "errors": self.errors,
+                "rejected": self.rejected,
+            }
@@ -7,6 +7,8 @@ class ClientBase(BaseModel):
     name: str
     description: Optional[str] = None
     theme_settings: Optional[Dict[str, Any]] = None
+    checkpoint: Optional[str] = None
+    output_format: Optional[str] = None  # png, webp or jpeg; the server default when unset
 
 
 class ClientCreate(ClientBase):
@@ -30,6 +32,7 @@ class ModelBase(BaseModel):
     name: str
     client_id: int
     reference_image_path: Optional[str] = None
+    checkpoint: Optional[str] = None
 
 
 class ModelCreate(ModelBase):
@@ -120,6 +123,7 @@ class HistoryCreate(HistoryBase):
 class History(HistoryBase):
     id: int
     created_at: datetime
+    thumbnail_urls: Dict[str, str] = {}  # WebP thumbnail URL by size
 
     class Config:
         orm_mode = True
@@ -158,7 +162,7 @@ class LookbookEntryBase(BaseModel):
 
 
 class LookbookEntryCreate(LookbookEntryBase):
-    pass
+    order: Optional[int] = None  # None appends after the last entry
 
 
 class LookbookEntryUpdate(LookbookEntryBase):
@@ -172,6 +176,7 @@ class LookbookEntry(LookbookEntryBase):
     id: int
     created_at: datetime
     updated_at: datetime
+    thumbnail_urls: Dict[str, str] = {}  # Thumbnails of the entry's history image
 
     class Config:
         orm_mode = True
@@ -192,6 +197,7 @@ class UserUpdate(UserBase):
     email: Optional[str] = None
     password: Optional[str] = None
     role: Optional[str] = None
+    is_active: Optional[bool] = None
 
 
 class User(UserBase):
@@ -222,6 +228,24 @@ class GenerationRequest(BaseModel):
     prompt: Optional[str] = None
     negative_prompt: Optional[str] = None
     settings: Optional[Dict[str, Any]] = None
+    # Still add a history entry when the result is served from the cache
+    record_history: bool = True
+    # Images rendered in one pipeline call, each with its own seed
+    variations: int = 1
+
+
+class MatrixGenerationRequest(BaseModel):
+    model_id: int
+    lookbook_id: int
+    # One image per combination of the listed layers (and seeds); an empty
+    # list leaves that layer out
+    hair_layer_ids: List[int] = []
+    outfit_layer_ids: List[int] = []
+    scene_layer_ids: List[int] = []
+    seeds: Optional[List[int]] = None
+    prompt: Optional[str] = None
+    negative_prompt: Optional[str] = None
+    settings: Optional[Dict[str, Any]] = None
 
 
 class InpaintRequest(BaseModel):
@@ -235,4 +259,37 @@ class InpaintRequest(BaseModel):
 
 class GenerationResponse(BaseModel):
     image_path: str
-    history_id: int
+    history_id: Optional[int] = None  # None for cached results not recorded in history
+    cached: bool = False
+    # Every image of a variations request, the first of which is image_path
+    image_paths: List[str] = []
+    history_ids: List[int] = []
+    seeds: List[int] = []
+
+
+class MatrixGenerationResponse(BaseModel):
+    lookbook_id: int
+    image_paths: List[str]
+    history_ids: List[int]
+    entry_ids: List[int]
+
+
+class JobResponse(BaseModel):
+    job_id: str
+    status: str
+    cached: bool = False
+
+
+class Job(BaseModel):
+    id: str
+    kind: str
+    status: str
+    error: Optional[str] = None
+    progress: Optional[Dict[str, int]] = None
+    steps_saved: Optional[int] = None
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+
+    class Config:
+        orm_mode = True
@@ -0,0 +1,141 @@
+import asyncio
+import hashlib
+import io
+import os
+import re
+import tempfile
+from typing import AsyncIterable, BinaryIO, Callable, Optional, Union
+
+from PIL import Image
+
+CHUNK_SIZE = 1024 * 1024
+
+_EXTENSION = re.compile(r"^[a-z0-9]{1,8}$")
+
+
+def file_extension(filename: Optional[str], default: str = "bin") -> str:
+    """Return a safe, lowercase extension for an uploaded file name."""
+    extension = os.path.splitext(filename or "")[1].lstrip(".").lower()
+    return extension if _EXTENSION.match(extension) else default
+
+
+class ContentStore:
+    """
+    Stores files under the SHA-256 of their content, sharded into nested
+    directories.
+
+    A file with digest "abcdef..." and extension "png" lands at
+    root/ab/cd/abcdef....png, so no directory grows beyond a few hundred
+    entries, identical content is stored once, and concurrent writes can
+    never overwrite each other's files. Writes go to a temporary file in the
+    store and are renamed into place, so readers never see partial files.
+    """
+
+    def __init__(self, root: str, shard_levels: int = 2, shard_width: int = 2):
+        """
+        Initialize the store.
+
+        Args:
+            root: Directory holding the store
+            shard_levels: Number of nested shard directories
+            shard_width: Hex digits of the digest per shard directory
+        """
+        self.root = root
+        self.shard_levels = shard_levels
+        self.shard_width = shard_width
+        self._tmp = os.path.join(root, ".tmp")
+        os.makedirs(self._tmp, exist_ok=True)
+
+    def shard_dir(self, digest: str) -> str:
+        """Return the directory holding files with the given digest."""
+        shards = [digest[i * self.shard_width:(i + 1) * self.shard_width] for i in range(self.shard_levels)]
+        return os.path.join(self.root, *shards)
+
+    def path_for(self, digest: str, extension: str) -> str:
+        return os.path.join(self.shard_dir(digest), f"{digest}.{extension}")
+
+    def put_bytes(self, data: bytes, extension: str) -> str:
+        """
+        Store a blob.
+
+        Returns:
+            Path of the stored file
+        """
+        return self.put_file(io.BytesIO(data), extension)
+
+    def put_file(self, fileobj: BinaryIO, extension: str) -> str:
+        """
+        Store the remaining content of a file object, hashing it as it is copied.
+
+        Returns:
+            Path of the stored file; an existing file with the same content is reused
+        """
+        digest = hashlib.sha256()
+        fd, tmp_path = tempfile.mkstemp(dir=self._tmp)
+        try:
+            with os.fdopen(fd, "wb") as tmp:
+                for chunk in iter(lambda: fileobj.read(CHUNK_SIZE), b""):
+                    digest.update(chunk)
+                    tmp.write(chunk)
+            return self._commit(tmp_path, digest.hexdigest(), extension)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    async def put_stream(self, chunks: AsyncIterable[bytes], extension: Union[str, Callable[[], str]]) -> str:
+        """
+        Store an async stream of chunks without blocking the event loop.
+
+        Hashing and disk writes run on worker threads, one chunk at a time, so
+        the whole stream is never held in memory. If the stream raises (e.g.
+        a size or validation error), the partial file is discarded.
+
+        Args:
+            chunks: Content to store
+            extension: File extension, or a callable returning it once the
+                stream is exhausted, e.g. from a format sniffed from the content
+
+        Returns:
+            Path of the stored file; an existing file with the same content is reused
+        """
+        digest = hashlib.sha256()
+        fd, tmp_path = tempfile.mkstemp(dir=self._tmp)
+        tmp = os.fdopen(fd, "wb")
+        try:
+            async for chunk in chunks:
+                await asyncio.to_thread(_hash_and_write, digest, tmp, chunk)
+            await asyncio.to_thread(tmp.close)
+            if callable(extension):
+                extension = extension()
+            return await asyncio.to_thread(self._commit, tmp_path, digest.hexdigest(), extension)
+        except BaseException:
+            tmp.close()
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def put_image(self, image: Image.Image, format: str = "PNG", extension: str = "png", **save_options) -> str:
+        """
+        Encode and store an image.
+
+        Returns:
+            Path of the stored file
+        """
+        buffer = io.BytesIO()
+        image.save(buffer, format=format, **save_options)
+        return self.put_bytes(buffer.getvalue(), extension)
+
+    def _commit(self, tmp_path: str, digest: str, extension: str) -> str:
+        path = self.path_for(digest, extension)
+        if os.path.exists(path):
+            os.remove(tmp_path)
+            return path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(tmp_path, path)
+        return path
+
+
+def _hash_and_write(digest, fileobj: BinaryIO, chunk: bytes):
+    digest.update(chunk)
+    fileobj.write(chunk)
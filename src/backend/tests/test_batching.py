@@ -0,0 +1,72 @@
+import threading
+import pytest
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import MagicMock
+
+from ai_models.batching import MicroBatcher
+
+def test_compatible_requests_share_a_batch():
+    calls = []
+
+    def run_batch(key, items):
+        calls.append((key, [item["prompt"] for item in items]))
+        return [f"image for {item['prompt']}" for item in items]
+
+    batcher = MicroBatcher(run_batch, window_ms=500, max_batch_size=3)
+
+    with ThreadPoolExecutor(max_workers=3) as pool:
+        futures = [
+            pool.submit(batcher.submit, (512, 512, 30, 7.5), {"prompt": f"prompt {i}"})
+            for i in range(3)
+        ]
+        results = [future.result(timeout=5) for future in futures]
+
+    # One pipeline call, and each caller only gets its own image
+    assert len(calls) == 1
+    assert sorted(calls[0][1]) == ["prompt 0", "prompt 1", "prompt 2"]
+    assert results == ["image for prompt 0", "image for prompt 1", "image for prompt 2"]
+
+    stats = batcher.stats()
+    assert stats["batches"] == 1
+    assert stats["items"] == 3
+    assert stats["max_batch_size"] == 3
+    assert stats["batch_size_counts"] == {3: 1}
+
+def test_incompatible_requests_run_separately():
+    run_batch = MagicMock(side_effect=lambda key, items: [key] * len(items))
+    batcher = MicroBatcher(run_batch, window_ms=50, max_batch_size=4)
+
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        small = pool.submit(batcher.submit, (512, 512, 30, 7.5), {"prompt": "a"})
+        large = pool.submit(batcher.submit, (768, 768, 30, 7.5), {"prompt": "b"})
+        assert small.result(timeout=5) == (512, 512, 30, 7.5)
+        assert large.result(timeout=5) == (768, 768, 30, 7.5)
+
+    assert run_batch.call_count == 2
+
+def test_batch_errors_reach_every_caller():
+    started = threading.Event()
+
+    def run_batch(key, items):
+        started.set()
+        raise RuntimeError("pipeline failed")
+
+    batcher = MicroBatcher(run_batch, window_ms=10)
+
+    with pytest.raises(RuntimeError, match="pipeline failed"):
+        batcher.submit("key", {"prompt": "a"})
+    assert started.is_set()
+
+def test_exception_result_only_fails_its_own_caller():
+    def run_batch(key, items):
+        return [ValueError("cancelled") if item["prompt"] == "b" else item["prompt"] for item in items]
+
+    batcher = MicroBatcher(run_batch, window_ms=500, max_batch_size=2)
+
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        ok = pool.submit(batcher.submit, "key", {"prompt": "a"})
+        failed = pool.submit(batcher.submit, "key", {"prompt": "b"})
+
+        assert ok.result(timeout=5) == "a"
+        with pytest.raises(ValueError):
+            failed.result(timeout=5)
@@ -0,0 +1,45 @@
+import asyncio
+
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from database import _async_url, _set_sqlite_pragmas
+
+def test_async_url_uses_async_drivers():
+    assert _async_url("sqlite:///./stunning.db") == "sqlite+aiosqlite:///./stunning.db"
+    assert _async_url("postgresql://user:secret@db/stunning") == "postgresql+asyncpg://user:secret@db/stunning"
+    # Explicit drivers are kept
+    assert _async_url("sqlite+pysqlite:///x.db") == "sqlite+pysqlite:///x.db"
+
+def test_sqlite_pragmas(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'test.db'}")
+    event.listen(engine, "connect", _set_sqlite_pragmas)
+
+    with engine.connect() as connection:
+        assert connection.execute(text("PRAGMA journal_mode")).scalar() == "wal"
+        assert connection.execute(text("PRAGMA synchronous")).scalar() == 1  # NORMAL
+        assert connection.execute(text("PRAGMA busy_timeout")).scalar() > 0
+
+def test_async_reads_do_not_wait_for_open_write(tmp_path):
+    url = f"sqlite:///{tmp_path / 'test.db'}"
+    engine = create_engine(url)
+    event.listen(engine, "connect", _set_sqlite_pragmas)
+    with engine.begin() as connection:
+        connection.execute(text("CREATE TABLE histories (id INTEGER PRIMARY KEY)"))
+        connection.execute(text("INSERT INTO histories VALUES (1)"))
+
+    async_engine = create_async_engine(_async_url(url))
+    event.listen(async_engine.sync_engine, "connect", _set_sqlite_pragmas)
+
+    async def read():
+        async with async_engine.connect() as connection:
+            return (await connection.execute(text("SELECT COUNT(*) FROM histories"))).scalar()
+
+    # With WAL, a reader sees the last commit while a write transaction is open
+    with engine.connect() as writer:
+        writer.execute(text("BEGIN IMMEDIATE"))
+        writer.execute(text("INSERT INTO histories VALUES (2)"))
+        assert asyncio.run(read()) == 1
+        writer.execute(text("COMMIT"))
+    assert asyncio.run(read()) == 2
+    asyncio.run(async_engine.dispose())
@@ -0,0 +1,120 @@
+import asyncio
+import hashlib
+
+import pytest
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+
+from file_serving import file_response, parse_range
+
+DATA = bytes(range(256)) * 8
+
+@pytest.fixture
+def client(tmp_path):
+    digest = hashlib.sha256(DATA).hexdigest()
+    stored = tmp_path / f"{digest}.png"
+    stored.write_bytes(DATA)
+    legacy = tmp_path / "legacy.png"
+    legacy.write_bytes(DATA)
+
+    app = FastAPI()
+
+    @app.get("/stored")
+    async def read_stored(request: Request):
+        return await file_response(str(stored), request.headers)
+
+    @app.get("/legacy")
+    async def read_legacy(request: Request):
+        return await file_response(str(legacy), request.headers)
+
+    return TestClient(app)
+
+def test_serves_file_with_content_etag(client):
+    response = client.get("/stored")
+
+    assert response.status_code == 200
+    assert response.content == DATA
+    assert response.headers["content-type"] == "image/png"
+    assert response.headers["etag"] == f'"{hashlib.sha256(DATA).hexdigest()}"'
+    assert "max-age" in response.headers["cache-control"]
+    # Files not named by their digest are hashed, giving the same ETag
+    assert client.get("/legacy").headers["etag"] == response.headers["etag"]
+
+def test_if_none_match_returns_304(client):
+    etag = client.get("/stored").headers["etag"]
+
+    response = client.get("/stored", headers={"If-None-Match": etag})
+
+    assert response.status_code == 304
+    assert response.content == b""
+    assert client.get("/stored", headers={"If-None-Match": '"other"'}).status_code == 200
+
+def test_range_requests(client):
+    response = client.get("/stored", headers={"Range": "bytes=10-19"})
+    assert response.status_code == 206
+    assert response.content == DATA[10:20]
+    assert response.headers["content-range"] == f"bytes 10-19/{len(DATA)}"
+
+    assert client.get("/stored", headers={"Range": "bytes=-5"}).content == DATA[-5:]
+    assert client.get("/stored", headers={"Range": f"bytes={len(DATA)}-"}).status_code == 416
+    # A stale If-Range gets the whole file
+    stale = client.get("/stored", headers={"Range": "bytes=0-9", "If-Range": '"other"'})
+    assert stale.status_code == 200 and stale.content == DATA
+
+def test_parse_range():
+    assert parse_range(None, 100) is None
+    assert parse_range("bytes=0-", 100) == (0, 99)
+    assert parse_range("bytes=90-200", 100) == (90, 99)
+    assert parse_range("bytes=0-1,5-6", 100) is None
+    with pytest.raises(ValueError):
+        parse_range("bytes=5-4", 100)
+
+def test_zero_copy_send_passes_through_metrics_middleware(tmp_path):
+    from metrics import MetricsRegistry, RequestMetricsMiddleware
+
+    path = tmp_path / "image.png"
+    path.write_bytes(DATA)
+    registry = MetricsRegistry()
+    requests = registry.counter("requests_total", "Requests", ["method", "endpoint", "status"])
+    durations = registry.histogram("request_seconds", "Request time", ["method", "endpoint"])
+
+    app = FastAPI()
+    app.add_middleware(RequestMetricsMiddleware, requests=requests, durations=durations)
+
+    @app.get("/image")
+    async def read_image(request: Request):
+        return await file_response(str(path), request.headers)
+
+    # Called as a server offering the zero-copy send extension would
+    messages = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        messages.append(message)
+
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": "/image",
+        "raw_path": b"/image",
+        "query_string": b"",
+        "root_path": "",
+        "headers": [(b"host", b"test")],
+        "client": ("127.0.0.1", 1234),
+        "server": ("test", 80),
+        "extensions": {"http.response.zerocopysend": {}},
+    }
+    asyncio.run(app(scope, receive, send))
+
+    start, body = messages
+    assert start["status"] == 200
+    headers = dict(start["headers"])
+    assert b"total;dur=" in headers[b"server-timing"]
+    assert body["type"] == "http.response.zerocopysend"
+    assert body["count"] == len(DATA) and body["offset"] == 0
+    assert requests.value(method="GET", endpoint="/image", status="200") == 1
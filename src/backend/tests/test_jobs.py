@@ -0,0 +1,190 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+
+from jobs import JobQueue, JobStatus, current_job
+
+@pytest.fixture
+def job_queue():
+    queue = JobQueue(num_workers=2)
+    yield queue
+    queue.shutdown()
+
+def test_submit_returns_before_job_runs(job_queue):
+    release = threading.Event()
+
+    def work():
+        release.wait(5)
+        return {"image_path": "generated/test.png", "history_id": 1}
+
+    job = job_queue.submit("generate", work, owner_id=1)
+
+    # The job is still pending until the worker is released
+    assert job.status in (JobStatus.QUEUED, JobStatus.RUNNING)
+    assert job_queue.get(job.id) is job
+
+    release.set()
+    assert job.done.wait(5)
+    assert job.status == JobStatus.SUCCEEDED
+    assert job.result == {"image_path": "generated/test.png", "history_id": 1}
+    assert job.owner_id == 1
+
+def test_failed_job_records_error(job_queue):
+    def work():
+        raise RuntimeError("out of memory")
+
+    job = job_queue.submit("inpaint", work)
+    assert job.done.wait(5)
+
+    assert job.status == JobStatus.FAILED
+    assert job.error == "out of memory"
+    assert job.result is None
+
+def test_queue_depth_counts_waiting_jobs():
+    queue = JobQueue(num_workers=1)
+    release = threading.Event()
+
+    try:
+        running = queue.submit("generate", release.wait, 5)
+        waiting = queue.submit("generate", release.wait, 5)
+
+        assert waiting.status == JobStatus.QUEUED
+        assert queue.queue_depth >= 1
+
+        release.set()
+        assert running.done.wait(5) and waiting.done.wait(5)
+        assert queue.queue_depth == 0
+    finally:
+        queue.shutdown()
+
+def test_finished_jobs_are_pruned():
+    queue = JobQueue(num_workers=1, max_finished_jobs=2)
+
+    try:
+        jobs = [queue.submit("generate", dict) for _ in range(3)]
+        for job in jobs:
+            assert job.done.wait(5)
+
+        # Pruning happens on submit, so one more job evicts the oldest finished ones
+        last = queue.submit("generate", dict)
+        assert last.done.wait(5)
+        assert queue.get(jobs[0].id) is None
+        assert queue.get(jobs[2].id) is jobs[2]
+    finally:
+        queue.shutdown()
+
+def test_running_job_reports_progress(job_queue):
+    def work():
+        job = current_job()
+        job.update_progress(1, 4)
+        job.update_progress(2, 4, preview="data:image/jpeg;base64,AAAA")
+        job.update_progress(3, 4)
+        return {"image_path": "generated/test.png"}
+
+    job = job_queue.submit("generate", work)
+    assert job.done.wait(5)
+
+    assert job.progress == {"step": 3, "total_steps": 4}
+    # The last rendered preview is kept between preview steps
+    assert job.preview == "data:image/jpeg;base64,AAAA"
+    assert job.progress_version == 3
+    # Outside a worker there is no current job
+    assert current_job() is None
+
+def test_cancel_queued_job_never_runs():
+    queue = JobQueue(num_workers=1)
+    release = threading.Event()
+    ran = []
+    try:
+        blocker = queue.submit("generate", release.wait, 5)
+        job = queue.submit("generate", lambda: ran.append(True), total_steps=30)
+
+        assert queue.cancel(job.id) is job
+        assert job.status == JobStatus.CANCELLED
+        assert job.done.is_set()
+        assert job.steps_saved == 30
+
+        release.set()
+        assert blocker.done.wait(5)
+    finally:
+        queue.shutdown()
+
+    assert ran == []
+    assert queue.stats() == {"queue_depth": 0, "running": 0, "cancelled": 1, "steps_saved": 30}
+
+def test_cancel_running_job_records_steps_saved(job_queue):
+    started = threading.Event()
+
+    def work():
+        job = current_job()
+        job.update_progress(12, 50)
+        started.set()
+        # Stand-in for the pipeline step callback
+        while not job.cancel_requested.wait(0.01):
+            pass
+        raise RuntimeError("stopped at step 12")
+
+    job = job_queue.submit("generate", work, total_steps=50)
+    assert started.wait(5)
+
+    job_queue.cancel(job.id)
+    assert job.done.wait(5)
+
+    assert job.status == JobStatus.CANCELLED
+    assert job.error is None
+    assert job.result is None
+    assert job.steps_saved == 38
+
+def test_cancel_finished_job_is_noop(job_queue):
+    job = job_queue.submit("generate", lambda: {"image_path": "generated/test.png"})
+    assert job.done.wait(5)
+
+    job_queue.cancel(job.id)
+    assert job.status == JobStatus.SUCCEEDED
+    assert job.steps_saved is None
+    assert job_queue.cancel("missing") is None
+
+def test_on_finish_sees_every_outcome():
+    finished = []
+    queue = JobQueue(num_workers=1, on_finish=lambda job: finished.append((job.kind, job.status)))
+    try:
+        ok = queue.submit("generate", lambda: {"image_path": "generated/test.png"})
+        failed = queue.submit("inpaint", lambda: 1 / 0)
+        assert ok.done.wait(5) and failed.done.wait(5)
+        queue.complete("generate", {"image_path": "generated/cached.png"})
+    finally:
+        queue.shutdown()
+
+    assert finished == [
+        ("generate", JobStatus.SUCCEEDED),
+        ("inpaint", JobStatus.FAILED),
+        ("generate", JobStatus.SUCCEEDED),
+    ]
+
+def test_job_finishes_with_returned_future():
+    queue = JobQueue(num_workers=1)
+    writer = ThreadPoolExecutor(max_workers=1)
+    release = threading.Event()
+
+    def encode():
+        release.wait(5)
+        return {"image_path": "generated/test.webp"}
+
+    try:
+        job = queue.submit("generate", lambda: writer.submit(encode))
+        # The worker is free for the next job while the first is still encoding
+        other = queue.submit("generate", lambda: {"image_path": "generated/other.png"})
+        assert other.done.wait(5)
+        assert job.status == JobStatus.RUNNING
+
+        release.set()
+        assert job.done.wait(5)
+        assert job.status == JobStatus.SUCCEEDED
+        assert job.result == {"image_path": "generated/test.webp"}
+
+        failing = queue.submit("generate", lambda: writer.submit(lambda: 1 / 0))
+        assert failing.done.wait(5)
+        assert failing.status == JobStatus.FAILED
+    finally:
+        queue.shutdown()
+        writer.shutdown()
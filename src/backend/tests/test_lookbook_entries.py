@@ -0,0 +1,45 @@
+import threading
+
+from sqlalchemy import create_engine, event, select
+from sqlalchemy.orm import sessionmaker
+
+from database import _set_sqlite_pragmas
+from lookbook_entries import LookbookAppender
+from models import Base, Lookbook, LookbookEntry
+
+def test_concurrent_appends_get_unique_consecutive_orders(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'test.db'}", connect_args={"check_same_thread": False})
+    event.listen(engine, "connect", _set_sqlite_pragmas)
+    Base.metadata.create_all(engine)
+    Session = sessionmaker(bind=engine)
+    with Session() as db:
+        db.add(Lookbook(id=1, name="Summer"))
+        db.commit()
+
+    appender = LookbookAppender(Lookbook, LookbookEntry)
+    start = threading.Barrier(4)
+    errors = []
+
+    def append_batch(batch: int):
+        try:
+            start.wait()
+            with Session() as db:
+                appender.append(db, 1, [batch * 10 + n for n in range(5)])
+                db.commit()
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=append_batch, args=(batch,)) for batch in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    with Session() as db:
+        entries = db.scalars(select(LookbookEntry).order_by(LookbookEntry.order)).all()
+    assert [entry.order for entry in entries] == list(range(20))
+    # Each batch stays contiguous and in its own order
+    for start_index in range(0, 20, 5):
+        history_ids = [entry.history_id for entry in entries[start_index:start_index + 5]]
+        assert history_ids == list(range(history_ids[0], history_ids[0] + 5))
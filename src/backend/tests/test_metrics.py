@@ -0,0 +1,54 @@
+import pytest
+
+from metrics import MetricsRegistry, collect_timings, observe_stage, server_timing_header, stage, STAGE_SECONDS
+
+def test_counter_and_gauge_render_in_prometheus_format():
+    registry = MetricsRegistry()
+    requests = registry.counter("requests_total", "Requests", ["endpoint", "status"])
+    registry.gauge("queue_depth", "Queued jobs", function=lambda: 3)
+
+    requests.inc(endpoint="/generate/", status="202")
+    requests.inc(endpoint="/generate/", status="202")
+    requests.inc(endpoint='/odd"path', status="404")
+
+    text = registry.render()
+    assert "# TYPE requests_total counter" in text
+    assert 'requests_total{endpoint="/generate/",status="202"} 2' in text
+    assert 'requests_total{endpoint="/odd\\"path",status="404"} 1' in text
+    assert "# TYPE queue_depth gauge\nqueue_depth 3" in text
+
+    with pytest.raises(ValueError):
+        requests.inc(endpoint="/generate/")
+    with pytest.raises(ValueError):
+        registry.counter("requests_total", "Duplicate")
+
+def test_histogram_buckets_are_cumulative():
+    registry = MetricsRegistry()
+    latency = registry.histogram("latency_seconds", "Latency", ["stage"], buckets=(0.1, 1.0))
+
+    for value in (0.05, 0.5, 0.7, 3.0):
+        latency.observe(value, stage="denoise")
+
+    text = registry.render()
+    assert 'latency_seconds_bucket{stage="denoise",le="0.1"} 1' in text
+    assert 'latency_seconds_bucket{stage="denoise",le="1"} 3' in text
+    assert 'latency_seconds_bucket{stage="denoise",le="+Inf"} 4' in text
+    assert 'latency_seconds_sum{stage="denoise"} 4.25' in text
+    assert 'latency_seconds_count{stage="denoise"} 4' in text
+
+def test_stages_are_collected_per_context():
+    before = STAGE_SECONDS.count(stage="test_stage")
+
+    with collect_timings() as timings:
+        with stage("test_stage"):
+            pass
+        observe_stage("test_stage", 0.5)
+        observe_stage("other_stage", 0.25)
+
+    # Outside a collection only the histogram is updated
+    observe_stage("test_stage", 1.0)
+
+    assert set(timings) == {"test_stage", "other_stage"}
+    assert 0.5 <= timings["test_stage"] < 0.6
+    assert STAGE_SECONDS.count(stage="test_stage") == before + 3
+    assert server_timing_header({"db": 0.0012, "denoise": 2.5}, prefix="job-") == "job-db;dur=1.2, job-denoise;dur=2500.0"
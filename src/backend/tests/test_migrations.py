@@ -0,0 +1,73 @@
+from sqlalchemy import create_engine, inspect, select, text
+from sqlalchemy.orm import Session
+
+import models
+from migrations import MIGRATIONS, upgrade
+
+def _old_database(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'old.db'}")
+    with engine.begin() as connection:
+        connection.execute(text("CREATE TABLE clients (id INTEGER PRIMARY KEY, name VARCHAR)"))
+        connection.execute(text("CREATE TABLE models (id INTEGER PRIMARY KEY, client_id INTEGER, created_at DATETIME)"))
+        connection.execute(text("CREATE TABLE histories (id INTEGER PRIMARY KEY, model_id INTEGER, created_at DATETIME)"))
+    return engine
+
+def test_upgrade_adds_columns_and_indexes_once(tmp_path):
+    engine = _old_database(tmp_path)
+
+    assert upgrade(engine) == [name for name, _ in MIGRATIONS]
+    assert upgrade(engine) == []
+
+    inspector = inspect(engine)
+    assert {"checkpoint", "output_format"} <= {column["name"] for column in inspector.get_columns("clients")}
+    assert "checkpoint" in {column["name"] for column in inspector.get_columns("models")}
+    assert "ix_histories_model_id_created_at_id" in {index["name"] for index in inspector.get_indexes("histories")}
+
+def test_upgrade_reruns_renamed_steps_harmlessly(tmp_path):
+    # Databases upgraded while the columns shared one step recorded it by
+    # name; the split steps run again and find the columns already there
+    engine = _old_database(tmp_path)
+    upgrade(engine)
+    with engine.begin() as connection:
+        connection.execute(text("DELETE FROM schema_migrations"))
+        connection.execute(text(
+            "INSERT INTO schema_migrations (name, applied_at) "
+            "VALUES ('0001_checkpoint_and_output_format_columns', '2024-01-01')"
+        ))
+
+    assert upgrade(engine) == [name for name, _ in MIGRATIONS]
+    assert "output_format" in {column["name"] for column in inspect(engine).get_columns("clients")}
+
+def test_checkpoint_selection_works_on_upgraded_database(tmp_path):
+    # A database from before checkpoint selection: today's schema without
+    # the checkpoint columns, holding a client and a model
+    engine = create_engine(f"sqlite:///{tmp_path / 'old.db'}")
+    models.Base.metadata.create_all(engine)
+    with engine.begin() as connection:
+        connection.execute(text("ALTER TABLE clients DROP COLUMN checkpoint"))
+        connection.execute(text("ALTER TABLE clients DROP COLUMN output_format"))
+        connection.execute(text("ALTER TABLE models DROP COLUMN checkpoint"))
+        connection.execute(text("INSERT INTO clients (id, name) VALUES (1, 'acme')"))
+        connection.execute(text("INSERT INTO models (id, client_id, name) VALUES (1, 1, 'spring')"))
+
+    assert "0001_checkpoint_columns" in upgrade(engine)
+
+    with Session(engine) as db:
+        model = db.scalar(select(models.Model))
+        assert (model.name, model.checkpoint, model.client.checkpoint) == ("spring", None, None)
+        model.client.checkpoint = "custom/checkpoint"
+        db.commit()
+    with Session(engine) as db:
+        assert db.scalar(select(models.Client.checkpoint)) == "custom/checkpoint"
+
+def test_keyset_query_uses_index(tmp_path):
+    engine = _old_database(tmp_path)
+    upgrade(engine)
+
+    with engine.connect() as connection:
+        plan = " ".join(str(row[-1]) for row in connection.execute(text(
+            "EXPLAIN QUERY PLAN SELECT * FROM histories WHERE model_id = 1 AND (created_at, id) < ('2024-01-01', 5) "
+            "ORDER BY created_at DESC, id DESC LIMIT 101"
+        )))
+    assert "ix_histories_model_id_created_at_id" in plan
+    assert "TEMP B-TREE" not in plan
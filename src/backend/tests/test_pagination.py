@@ -0,0 +1,65 @@
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import Column, DateTime, Integer, create_engine
+from sqlalchemy.orm import Session, declarative_base
+
+from pagination import decode_cursor, encode_cursor, keyset, split_page
+
+Base = declarative_base()
+
+class Item(Base):
+    __tablename__ = "items"
+
+    id = Column(Integer, primary_key=True)
+    created_at = Column(DateTime)
+
+ORDER = (Item.created_at, Item.id)
+
+@pytest.fixture
+def db():
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    with Session(engine) as session:
+        start = datetime(2024, 1, 1)
+        # Pairs of rows share a timestamp, so the id has to break ties
+        session.add_all([Item(id=i, created_at=start + timedelta(minutes=i // 2)) for i in range(1, 12)])
+        session.commit()
+        yield session
+
+def _all_pages(db, limit, descending=False):
+    pages, cursor = [], None
+    while True:
+        rows = keyset(db.query(Item), ORDER, cursor, descending=descending).limit(limit + 1).all()
+        page, cursor = split_page(rows, ORDER, limit)
+        pages.append([item.id for item in page])
+        if cursor is None:
+            return pages
+
+def test_pages_cover_all_rows_once(db):
+    assert _all_pages(db, 4) == [[1, 2, 3, 4], [5, 6, 7, 8], [9, 10, 11]]
+    assert _all_pages(db, 4, descending=True) == [[11, 10, 9, 8], [7, 6, 5, 4], [3, 2, 1]]
+    assert _all_pages(db, 11) == [list(range(1, 12))]
+
+def test_cursor_round_trip():
+    cursor = encode_cursor([datetime(2024, 1, 1, 12, 30), 42])
+
+    assert decode_cursor(cursor, ORDER) == [datetime(2024, 1, 1, 12, 30), 42]
+    with pytest.raises(ValueError):
+        decode_cursor("not a cursor", ORDER)
+    with pytest.raises(ValueError):
+        decode_cursor(encode_cursor([1]), ORDER)
+    # [1,2]: well-formed, but 1 is no timestamp
+    with pytest.raises(ValueError):
+        decode_cursor("WzEsMl0", ORDER)
+
+@pytest.mark.parametrize("values", [
+    [1, 2],  # not a timestamp
+    ["2024-01-01T00:00:00", "2"],  # id of the wrong type
+    ["yesterday", 2],  # malformed timestamp
+    ["2024-01-01T00:00:00", True],
+    [[], {}],
+])
+def test_crafted_cursors_are_invalid(values):
+    with pytest.raises(ValueError):
+        decode_cursor(encode_cursor(values), ORDER)
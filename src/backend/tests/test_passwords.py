@@ -0,0 +1,57 @@
+import asyncio
+
+import pytest
+
+from passwords import PasswordHasher, PasswordHasherBusy, verify_password
+
+def test_hash_and_verify_in_worker_process():
+    hasher = PasswordHasher(max_workers=1)
+
+    async def run():
+        hashed = await hasher.hash("secret")
+        return hashed, await hasher.verify("secret", hashed), await hasher.verify("wrong", hashed)
+
+    try:
+        hashed, good, bad = asyncio.run(run())
+    finally:
+        hasher.shutdown()
+
+    assert verify_password("secret", hashed)
+    assert good and not bad
+    assert hasher.stats()["verified"] == 1
+    assert hasher.stats()["mismatched"] == 1
+
+def test_failed_verifications_are_not_counted_as_verified():
+    hasher = PasswordHasher(max_workers=0)
+
+    try:
+        with pytest.raises(ValueError):
+            asyncio.run(hasher.verify("secret", "not a bcrypt hash"))
+    finally:
+        hasher.shutdown()
+
+    assert hasher.stats()["errors"] == 1
+    assert hasher.stats()["verified"] == 0
+    assert hasher.stats()["pending"] == 0
+
+def test_verifications_beyond_max_pending_are_rejected():
+    hasher = PasswordHasher(max_workers=0, max_pending=1, retry_after=2)
+
+    async def run():
+        hashed = await hasher.hash("secret")
+        return await asyncio.gather(
+            hasher.verify("secret", hashed),
+            hasher.verify("secret", hashed),
+            return_exceptions=True
+        )
+
+    try:
+        first, second = asyncio.run(run())
+    finally:
+        hasher.shutdown()
+
+    assert first is True
+    assert isinstance(second, PasswordHasherBusy)
+    assert second.retry_after == 2
+    assert hasher.stats()["rejected"] == 1
+    assert hasher.stats()["pending"] == 0
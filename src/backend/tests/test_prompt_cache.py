@@ -0,0 +1,50 @@
+import torch
+
+from ai_models.prompt_cache import PromptEmbeddingCache, normalize_prompt
+
+def test_normalize_prompt():
+    assert normalize_prompt("Beautiful  woman, , long hair,") == "beautiful woman, long hair"
+    assert normalize_prompt(" , blue dress") == "blue dress"
+    assert normalize_prompt(None) == ""
+
+def test_hits_and_misses():
+    cache = PromptEmbeddingCache()
+    key = cache.make_key("model", "long hair")
+    embeds = torch.zeros(1, 77, 8)
+
+    assert cache.get(key) is None
+    cache.put(key, embeds)
+
+    # Keys are normalized, so spacing and case differences still hit
+    assert cache.get(cache.make_key("model", "Long  hair")) is embeds
+    assert cache.get(cache.make_key("other-model", "long hair")) is None
+
+    stats = cache.stats()
+    assert stats["hits"] == 1
+    assert stats["misses"] == 2
+
+def test_memory_budget_evicts_least_recently_used():
+    entry = torch.zeros(1, 77, 8)
+    entry_bytes = entry.element_size() * entry.nelement()
+    cache = PromptEmbeddingCache(max_bytes=entry_bytes * 2)
+
+    cache.put(("m", "a"), torch.zeros(1, 77, 8))
+    cache.put(("m", "b"), torch.zeros(1, 77, 8))
+    cache.get(("m", "a"))
+    cache.put(("m", "c"), torch.zeros(1, 77, 8))
+
+    assert cache.get(("m", "b")) is None
+    assert cache.get(("m", "a")) is not None
+    assert cache.get(("m", "c")) is not None
+    assert cache.current_bytes == entry_bytes * 2
+    assert cache.stats()["evictions"] == 1
+
+def test_invalidate_tag():
+    cache = PromptEmbeddingCache()
+    cache.put(("m", "woman, long hair"), torch.zeros(1), tags=[("layer", 1)])
+    cache.put(("m", "woman, blue dress"), torch.zeros(1), tags=[("layer", 2)])
+    cache.add_tags(("m", "woman, blue dress"), [("layer", 1)])
+
+    assert cache.invalidate_tag(("layer", 1)) == 2
+    assert len(cache) == 0
+    assert cache.current_bytes == 0
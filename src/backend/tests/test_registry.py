@@ -0,0 +1,71 @@
+from unittest.mock import MagicMock
+import pytest
+
+from ai_models.registry import ModelRegistry
+
+def make_model(size):
+    # A stand-in for StableDiffusionModel that "loads" when leased
+    model = MagicMock()
+    model.is_loaded = False
+    model.memory_report.side_effect = lambda: {"total": size if model.is_loaded else 0}
+
+    def unload():
+        model.is_loaded = False
+    model.unload.side_effect = unload
+    return model
+
+@pytest.fixture
+def registry():
+    models = {}
+
+    def factory(checkpoint):
+        models[checkpoint] = make_model(100)
+        return models[checkpoint]
+
+    registry = ModelRegistry(
+        factory,
+        default_checkpoint="base",
+        allowed_checkpoints=["anime", "photo"],
+        memory_budget_bytes=250
+    )
+    registry.created = models
+    return registry
+
+def use(registry, checkpoint=None):
+    with registry.lease(checkpoint) as model:
+        model.is_loaded = True
+    return model
+
+def test_lease_counts_hits_and_loads(registry):
+    first = use(registry)
+    second = use(registry, "base")
+
+    assert first is second
+    assert registry.stats()["loads"] == 1
+    assert registry.stats()["hits"] == 1
+
+def test_least_recently_used_model_is_evicted(registry):
+    use(registry, "base")
+    use(registry, "anime")
+    use(registry, "base")
+    photo = use(registry, "photo")
+
+    # Loading a third 100-byte model exceeds the 250-byte budget
+    registry.created["anime"].unload.assert_called_once()
+    registry.created["base"].unload.assert_not_called()
+    assert photo.is_loaded
+    stats = registry.stats()
+    assert stats["evictions"] == 1
+    assert set(stats["loaded"]) == {"base", "photo"}
+
+def test_models_in_use_are_not_evicted(registry):
+    with registry.lease("base") as base:
+        base.is_loaded = True
+        use(registry, "anime")
+        use(registry, "photo")
+        base.unload.assert_not_called()
+
+def test_unknown_checkpoint_is_rejected(registry):
+    assert not registry.is_allowed("somewhere/else")
+    with pytest.raises(ValueError):
+        use(registry, "somewhere/else")
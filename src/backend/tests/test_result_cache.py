@@ -0,0 +1,57 @@
+import os
+
+from result_cache import ResultCache, canonical_request_key
+
+def test_canonical_key_ignores_formatting_differences():
+    first = canonical_request_key(
+        prompt=" beautiful woman ",
+        settings={"seed": 42, "guidance_scale": 7.0, "width": 512},
+        layers=[{"prompt": "long hair", "negative_prompt": None, "strength": 1.0}, None]
+    )
+    second = canonical_request_key(
+        layers=[{"strength": 1, "prompt": "long hair"}, None],
+        settings={"width": 512, "guidance_scale": 7, "seed": 42},
+        prompt="beautiful woman"
+    )
+    assert first == second
+
+def test_canonical_key_changes_with_inputs():
+    base = canonical_request_key(prompt="woman", settings={"seed": 1})
+    assert canonical_request_key(prompt="woman", settings={"seed": 2}) != base
+    assert canonical_request_key(prompt="woman", settings={"seed": 1}, layers=[{"strength": 0.5}]) != base
+
+def test_hit_returns_stored_result(tmp_path):
+    image_path = tmp_path / "image.png"
+    image_path.write_bytes(b"png")
+    cache = ResultCache()
+
+    assert cache.get("key") is None
+    cache.put("key", {"image_path": str(image_path), "history_id": 1})
+    # History entries belong to the request that wrote them
+    assert cache.get("key") == {"image_path": str(image_path)}
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+
+def test_missing_image_is_a_miss(tmp_path):
+    image_path = tmp_path / "image.png"
+    image_path.write_bytes(b"png")
+    cache = ResultCache()
+    cache.put("key", {"image_path": str(image_path), "history_id": 1})
+
+    os.remove(image_path)
+    assert cache.get("key") is None
+    assert len(cache) == 0
+
+def test_size_bound_evicts_least_recently_used(tmp_path):
+    image_path = tmp_path / "image.png"
+    image_path.write_bytes(b"png")
+    cache = ResultCache(max_entries=2)
+
+    for key in ("a", "b"):
+        cache.put(key, {"image_path": str(image_path), "history_id": 1})
+    cache.get("a")
+    cache.put("c", {"image_path": str(image_path), "history_id": 2})
+
+    assert cache.get("b") is None
+    assert cache.get("a") is not None
+    assert cache.stats()["evictions"] == 1
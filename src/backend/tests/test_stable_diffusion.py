@@ -1,10 +1,12 @@
 import pytest
 from unittest.mock import patch, MagicMock
+from concurrent.futures import ThreadPoolExecutor
 import os
 import torch
 from PIL import Image
 
 from ai_models.stable_diffusion import StableDiffusionModel
+from ai_models.prompt_cache import PromptEmbeddingCache
 
 @pytest.fixture
 def sd_model():
@@ -98,17 +100,13 @@ def test_apply_styling_layers(sd_model):
         output_path="generated/styled_test.png"
     )
     
-    # Verify generate_image was called with combined prompts
+    # Layers reach generate_image as blended embeddings, next to the request's own prompts
     sd_model.generate_image.assert_called_once()
     call_args = sd_model.generate_image.call_args
-    assert "beautiful woman" in call_args[1]["prompt"]
-    assert "long hair" in call_args[1]["prompt"]
-    assert "blue dress" in call_args[1]["prompt"]
-    assert "beach sunset" in call_args[1]["prompt"]
-    assert "ugly" in call_args[1]["negative_prompt"]
-    assert "bald" in call_args[1]["negative_prompt"]
-    assert "naked" in call_args[1]["negative_prompt"]
-    assert "indoor" in call_args[1]["negative_prompt"]
+    assert call_args[1]["prompt"] == "beautiful woman"
+    assert call_args[1]["negative_prompt"] == "ugly"
+    assert call_args[1]["prompt_embeds"] is not None
+    assert call_args[1]["negative_prompt_embeds"] is not None
     
     # Verify the output path
     assert output_path == "generated/styled_test.png"
@@ -126,3 +124,401 @@ def test_create_embedding(sd_model):
     
     # Verify the file was created (in this case, it's a simulated file)
     assert os.path.exists(output_path)
+
+def test_create_embedding_defaults_to_output_dir(tmp_path):
+    # Without an output path, embeddings land in the configured folder
+    model = StableDiffusionModel(device="cpu", output_dir=str(tmp_path / "outputs"))
+    output_path = model.create_embedding(reference_images=["test1.jpg"])
+    
+    assert os.path.dirname(output_path) == str(tmp_path / "outputs")
+    assert os.path.exists(output_path)
+
+@patch("ai_models.stable_diffusion.DDIMScheduler")
+@patch("ai_models.stable_diffusion.StableDiffusionPipeline")
+def test_generate_batch(mock_pipeline, mock_scheduler, sd_model):
+    mock_instance = MagicMock()
+    mock_pipeline.from_pretrained.return_value = mock_instance
+    mock_images = [MagicMock(spec=Image.Image), MagicMock(spec=Image.Image)]
+    mock_instance.return_value = MagicMock(images=mock_images)
+    
+    images = sd_model.generate_batch(
+        prompts=["first prompt", "second prompt"],
+        negative_prompts=["blurry", None],
+        seeds=[1, 2]
+    )
+    
+    # One pipeline call with a prompt list and a generator per item
+    mock_instance.assert_called_once()
+    call_kwargs = mock_instance.call_args.kwargs
+    assert call_kwargs["prompt"] == ["first prompt", "second prompt"]
+    assert call_kwargs["negative_prompt"] == ["blurry", ""]
+    assert len(call_kwargs["generator"]) == 2
+    assert call_kwargs["generator"][0].initial_seed() == 1
+    assert call_kwargs["generator"][1].initial_seed() == 2
+    assert images == mock_images
+
+def test_encode_prompt_uses_cache():
+    model = StableDiffusionModel(device="cpu", prompt_cache=PromptEmbeddingCache())
+    
+    # Mock a loaded pipeline with a tokenizer and text encoder
+    pipeline = MagicMock()
+    pipeline.tokenizer.model_max_length = 77
+    pipeline.tokenizer.return_value = MagicMock(input_ids=torch.zeros(1, 77, dtype=torch.long))
+    pipeline.text_encoder.return_value = (torch.ones(1, 77, 8),)
+    model.txt2img_pipeline = pipeline
+    
+    first = model.encode_prompt("Long hair", tags=[("layer", 1)])
+    second = model.encode_prompt("long  hair")
+    
+    # The text encoder only runs once for equivalent prompts
+    assert pipeline.text_encoder.call_count == 1
+    assert second is first
+    
+    inputs = model._prompt_inputs("long hair", None)
+    assert inputs["prompt_embeds"].shape == (1, 77, 8)
+    assert inputs["negative_prompt_embeds"].shape == (1, 77, 8)
+    assert "prompt" not in inputs
+    
+    # Deleting the layer drops its entries
+    model.prompt_cache.invalidate_tag(("layer", 1))
+    model.encode_prompt("long hair")
+    assert pipeline.text_encoder.call_count == 3
+
+def test_apply_styling_layers_blends_layer_strengths():
+    model = StableDiffusionModel(device="cpu", prompt_cache=PromptEmbeddingCache())
+    model.txt2img_pipeline = MagicMock()
+    model.generate_image = MagicMock(return_value=(MagicMock(), "generated/styled_test.png"))
+    
+    # Deterministic fake encoder: every prompt maps to a constant embedding
+    values = {"beautiful woman": 1.0, "long hair": 3.0, "blue dress": 5.0, "": 0.0}
+    model._encode_text = MagicMock(side_effect=lambda text: torch.full((1, 77, 8), values[text]))
+    
+    hair_layer = {"id": 1, "prompt": "long hair", "strength": 1.0}
+    outfit_layer = {"id": 2, "prompt": "blue dress", "strength": 0.5}
+    
+    model.apply_styling_layers(
+        base_model_path="test_embedding.pt",
+        hair_layer=hair_layer,
+        outfit_layer=outfit_layer,
+        prompt="beautiful woman",
+        output_path="generated/styled_test.png"
+    )
+    
+    # (1 * 1.0 + 1 * 3.0 + 0.5 * 5.0) / 2.5
+    call_kwargs = model.generate_image.call_args.kwargs
+    assert torch.allclose(call_kwargs["prompt_embeds"], torch.full((1, 77, 8), 2.6))
+    assert torch.allclose(call_kwargs["negative_prompt_embeds"], torch.zeros(1, 77, 8))
+    
+    # Changing only a strength reuses the cached per-layer encodings
+    encoder_calls = model._encode_text.call_count
+    outfit_layer["strength"] = 1.0
+    model.apply_styling_layers(
+        base_model_path="test_embedding.pt",
+        hair_layer=hair_layer,
+        outfit_layer=outfit_layer,
+        prompt="beautiful woman"
+    )
+    assert model._encode_text.call_count == encoder_calls
+    assert torch.allclose(model.generate_image.call_args.kwargs["prompt_embeds"], torch.full((1, 77, 8), 3.0))
+
+@patch("ai_models.stable_diffusion.DDIMScheduler")
+@patch("ai_models.stable_diffusion.StableDiffusionInpaintPipeline")
+@patch("ai_models.stable_diffusion.StableDiffusionPipeline")
+def test_pipelines_share_components(mock_pipeline, mock_inpaint_pipeline, mock_scheduler, sd_model):
+    text_encoder = torch.nn.Linear(4, 4)
+    vae = torch.nn.Linear(4, 2)
+    mock_instance = MagicMock()
+    mock_instance.components = {
+        "text_encoder": text_encoder,
+        "vae": vae,
+        "tokenizer": MagicMock(),
+        "scheduler": MagicMock(),
+    }
+    mock_pipeline.from_pretrained.return_value = mock_instance
+    mock_inpaint_pipeline.return_value = MagicMock(components=mock_instance.components)
+    
+    sd_model._load_txt2img_pipeline()
+    sd_model._load_inpaint_pipeline()
+    
+    # The inpainting pipeline is built from the loaded components, not loaded again
+    mock_pipeline.from_pretrained.assert_called_once()
+    mock_inpaint_pipeline.from_pretrained.assert_not_called()
+    call_kwargs = mock_inpaint_pipeline.call_args.kwargs
+    assert call_kwargs["text_encoder"] is text_encoder
+    assert call_kwargs["vae"] is vae
+    assert call_kwargs["scheduler"] is not mock_instance.components["scheduler"]
+    
+    # Shared components are only counted once
+    report = sd_model.memory_report()
+    assert report["text_encoder"] == (16 + 4) * 4
+    assert report["vae"] == (8 + 2) * 4
+    assert report["total"] == report["text_encoder"] + report["vae"]
+
+@patch("ai_models.stable_diffusion.DDIMScheduler")
+@patch("ai_models.stable_diffusion.StableDiffusionPipeline")
+def test_warm_up(mock_pipeline, mock_scheduler, sd_model):
+    mock_instance = MagicMock()
+    mock_pipeline.from_pretrained.return_value = mock_instance
+    
+    sd_model.warm_up(["txt2img"])
+    
+    # A single tiny denoising step primes the pipeline
+    mock_instance.assert_called_once()
+    call_kwargs = mock_instance.call_args.kwargs
+    assert call_kwargs["num_inference_steps"] == 1
+    assert call_kwargs["width"] == 64
+    
+    assert {"txt2img.scheduler", "txt2img.weights", "txt2img.to_device", "txt2img.warmup"} <= set(sd_model.load_timings)
+    
+    with pytest.raises(ValueError):
+        sd_model.warm_up(["upscale"])
+
+class FakeScheduler:
+    def __init__(self):
+        self.timesteps = None
+
+class FakePipeline:
+    """Records the scheduler and generator each call ran with."""
+    def __init__(self):
+        self.scheduler = FakeScheduler()
+        self.calls = []
+    
+    def __call__(self, generator=None, **kwargs):
+        self.scheduler.timesteps = kwargs["num_inference_steps"]
+        self.calls.append((self.scheduler, generator.initial_seed()))
+        return MagicMock(images=[MagicMock(spec=Image.Image)])
+
+def test_concurrent_calls_use_own_generator_and_scheduler():
+    model = StableDiffusionModel(device="cpu", concurrent=True)
+    pipeline = FakePipeline()
+    model.txt2img_pipeline = pipeline
+    global_seed = torch.initial_seed()
+    
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        futures = [
+            pool.submit(model.generate_image, prompt=f"prompt {seed}", seed=seed, output_path=f"generated/concurrent_{seed}.png")
+            for seed in (1, 2)
+        ]
+        for future in futures:
+            future.result(timeout=5)
+    
+    # Copies share the call log; each call had its own scheduler and seed
+    schedulers = [scheduler for scheduler, _ in pipeline.calls]
+    assert sorted(seed for _, seed in pipeline.calls) == [1, 2]
+    assert schedulers[0] is not schedulers[1]
+    assert pipeline.scheduler not in schedulers
+    assert pipeline.scheduler.timesteps is None
+    
+    # The process-wide RNG is left alone
+    assert torch.initial_seed() == global_seed
+
+def test_step_callback_receives_progress_and_previews():
+    from ai_models.previews import latents_to_preview, preview_data_url
+    
+    class SteppingPipeline(FakePipeline):
+        def __call__(self, generator=None, callback=None, callback_steps=1, **kwargs):
+            for step in range(kwargs["num_inference_steps"]):
+                callback(step, 999 - step, torch.zeros(1, 4, 8, 8))
+            return super().__call__(generator=generator, **kwargs)
+    
+    model = StableDiffusionModel(device="cpu")
+    model.txt2img_pipeline = SteppingPipeline()
+    updates = []
+    
+    model.generate_image(
+        prompt="a portrait",
+        num_inference_steps=3,
+        output_path="generated/progress.png",
+        step_callback=lambda step, total, latents: updates.append((step, total, latents_to_preview(latents)))
+    )
+    
+    assert [(step, total) for step, total, _ in updates] == [(1, 3), (2, 3), (3, 3)]
+    # One preview pixel per latent
+    preview = updates[-1][2]
+    assert preview.size == (8, 8)
+    assert preview_data_url(preview).startswith("data:image/jpeg;base64,")
+
+def test_cancelled_generation_stops_without_saving(tmp_path):
+    from ai_models.stable_diffusion import GenerationCancelled
+    
+    class SteppingPipeline(FakePipeline):
+        def __call__(self, generator=None, callback=None, callback_steps=1, **kwargs):
+            batch_size = len(generator) if isinstance(generator, list) else 1
+            for step in range(kwargs["num_inference_steps"]):
+                callback(step, 999 - step, torch.zeros(batch_size, 4, 8, 8))
+            self.calls.append(kwargs)
+            return MagicMock(images=[Image.new("RGB", (8, 8)) for _ in range(batch_size)])
+    
+    def cancel_at(cancel_step, steps_run):
+        def callback(step, total, latents):
+            steps_run.append(step)
+            if step == cancel_step:
+                raise GenerationCancelled()
+        return callback
+    
+    model = StableDiffusionModel(device="cpu")
+    model.txt2img_pipeline = SteppingPipeline()
+    
+    # A single generation is aborted at the cancelling step
+    steps_run = []
+    output_path = tmp_path / "cancelled.png"
+    with pytest.raises(GenerationCancelled):
+        model.generate_image(
+            prompt="a",
+            num_inference_steps=10,
+            output_path=str(output_path),
+            step_callback=cancel_at(3, steps_run)
+        )
+    assert steps_run == [1, 2, 3]
+    assert not output_path.exists()
+    
+    # In a batch, the other image still finishes
+    cancelled_steps, kept_steps = [], []
+    images = model.generate_batch(
+        prompts=["a", "b"],
+        num_inference_steps=5,
+        step_callbacks=[cancel_at(2, cancelled_steps), cancel_at(None, kept_steps)]
+    )
+    assert isinstance(images[0], GenerationCancelled)
+    assert isinstance(images[1], Image.Image)
+    assert cancelled_steps == [1, 2]
+    assert kept_steps == [1, 2, 3, 4, 5]
+
+def test_resolve_sampler_settings():
+    from ai_models.stable_diffusion import resolve_sampler_settings
+    
+    assert resolve_sampler_settings(None) is None
+    assert resolve_sampler_settings({"preset": "fast", "seed": 1}) == {"scheduler": "dpm++", "num_inference_steps": 14, "seed": 1}
+    # Explicit settings win over the preset
+    assert resolve_sampler_settings({"preset": "fast", "num_inference_steps": 12})["num_inference_steps"] == 12
+    assert resolve_sampler_settings({"scheduler": "euler"}) == {"scheduler": "euler"}
+    
+    with pytest.raises(ValueError):
+        resolve_sampler_settings({"preset": "slow"})
+    with pytest.raises(ValueError):
+        resolve_sampler_settings({"scheduler": "lms"})
+
+def test_scheduler_selected_per_call():
+    from diffusers import DDIMScheduler, DPMSolverMultistepScheduler
+    
+    model = StableDiffusionModel(device="cpu")
+    pipeline = FakePipeline()
+    pipeline.scheduler = DDIMScheduler()
+    model.txt2img_pipeline = pipeline
+    
+    model.generate_image(prompt="a", seed=1, scheduler="dpm++", output_path="generated/dpm.png")
+    model.generate_image(prompt="b", seed=2, scheduler="dpm++", output_path="generated/dpm.png")
+    model.generate_image(prompt="c", seed=3, output_path="generated/default.png")
+    
+    (first, _), (second, _), (default, _) = pipeline.calls
+    assert isinstance(first, DPMSolverMultistepScheduler)
+    assert first.config.use_karras_sigmas
+    # Built from the loaded config once, then copied for every call
+    assert first is not second
+    assert len(model._schedulers) == 1
+    # The pipeline itself keeps its default scheduler
+    assert default is pipeline.scheduler
+    assert isinstance(pipeline.scheduler, DDIMScheduler)
+    
+    with pytest.raises(ValueError):
+        model.generate_image(prompt="d", scheduler="lms")
+
+def test_stage_observer_times_inference_stages(tmp_path):
+    class SteppingPipeline(FakePipeline):
+        def __call__(self, generator=None, callback=None, callback_steps=1, **kwargs):
+            for step in range(kwargs["num_inference_steps"]):
+                callback(step, 999 - step, torch.zeros(1, 4, 8, 8))
+            return MagicMock(images=[Image.new("RGB", (8, 8))])
+    
+    stages = []
+    model = StableDiffusionModel(device="cpu", stage_observer=lambda stage, seconds: stages.append((stage, seconds)))
+    model.txt2img_pipeline = SteppingPipeline()
+    steps = []
+    
+    model.generate_image(
+        prompt="a portrait",
+        num_inference_steps=4,
+        output_path=str(tmp_path / "timed.png"),
+        step_callback=lambda step, total, latents: steps.append(step)
+    )
+    
+    assert [stage for stage, _ in stages] == ["denoise", "decode", "save"]
+    assert all(seconds >= 0 for _, seconds in stages)
+    # The timing wrapper still forwards every step
+    assert steps == [1, 2, 3, 4]
+
+def test_layer_combinations_run_in_batches_with_shared_encodings():
+    from ai_models.stable_diffusion import GenerationCancelled
+    
+    class SteppingPipeline(FakePipeline):
+        def __call__(self, generator=None, callback=None, callback_steps=1, prompt_embeds=None, **kwargs):
+            batch_size = len(generator)
+            for step in range(kwargs["num_inference_steps"]):
+                callback(step, 999 - step, torch.zeros(batch_size, 4, 8, 8))
+            self.calls.append(([g.initial_seed() for g in generator], prompt_embeds[:, 0, 0].tolist()))
+            return MagicMock(images=[Image.new("RGB", (8, 8)) for _ in range(batch_size)])
+    
+    model = StableDiffusionModel(device="cpu", max_batch_size=3)
+    model.txt2img_pipeline = SteppingPipeline()
+    values = {"long hair": 1.0, "bob": 3.0, "dress": 5.0, "blazer": 7.0, "": 0.0}
+    model._encode_text = MagicMock(side_effect=lambda text: torch.full((1, 77, 8), values[text]))
+    
+    hair = [{"id": 1, "prompt": "long hair"}, {"id": 2, "prompt": "bob"}]
+    outfits = [{"id": 3, "prompt": "dress"}, {"id": 4, "prompt": "blazer"}]
+    combinations = [(h, o, None) for h in hair for o in outfits]
+    steps = []
+    
+    images = model.apply_styling_layer_combinations(
+        base_model_path="test_embedding.pt",
+        combinations=combinations,
+        seeds=[10, 11, 12, 13],
+        num_inference_steps=2,
+        step_callback=lambda step, total, latents: steps.append((step, total))
+    )
+    
+    assert len(images) == 4
+    # Two pipeline calls of at most max_batch_size, in order
+    assert model.txt2img_pipeline.calls == [([10, 11, 12], [3.0, 4.0, 4.0]), ([13], [5.0])]
+    # Every layer encoded once, plus the empty negative prompt
+    assert model._encode_text.call_count == 5
+    # Progress counts across batches, once per step
+    assert steps == [(1, 4), (2, 4), (3, 4), (4, 4)]
+    
+    # Cancelling stops the remaining batches
+    model.txt2img_pipeline.calls.clear()
+    
+    def cancel(step, total, latents):
+        raise GenerationCancelled()
+    
+    with pytest.raises(GenerationCancelled):
+        model.apply_styling_layer_combinations(
+            base_model_path="test_embedding.pt",
+            combinations=combinations,
+            num_inference_steps=2,
+            step_callback=cancel
+        )
+    assert model.txt2img_pipeline.calls == []
+
+def test_variations_share_conditioning_in_one_call():
+    class BatchPipeline(FakePipeline):
+        def __call__(self, generator=None, prompt_embeds=None, **kwargs):
+            self.calls.append(([g.initial_seed() for g in generator], prompt_embeds[:, 0, 0].tolist()))
+            return MagicMock(images=[Image.new("RGB", (8, 8)) for _ in generator])
+    
+    model = StableDiffusionModel(device="cpu")
+    model.txt2img_pipeline = BatchPipeline()
+    values = {"portrait": 1.0, "long hair": 3.0, "": 0.0}
+    model._encode_text = MagicMock(side_effect=lambda text: torch.full((1, 77, 8), values[text]))
+    
+    images = model.apply_styling_layer_variations(
+        base_model_path="test_embedding.pt",
+        seeds=[5, 6, 7],
+        hair_layer={"id": 1, "prompt": "long hair"},
+        prompt="portrait",
+        num_inference_steps=2
+    )
+    
+    assert len(images) == 3
+    assert model.txt2img_pipeline.calls == [([5, 6, 7], [2.0, 2.0, 2.0])]
+    # Prompt, layer and empty negative prompt, each encoded once
+    assert model._encode_text.call_count == 3
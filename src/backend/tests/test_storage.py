@@ -0,0 +1,66 @@
+import asyncio
+import io
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from PIL import Image
+
+from storage import ContentStore, file_extension
+
+def test_files_are_named_by_content_and_sharded(tmp_path):
+    store = ContentStore(str(tmp_path / "uploads"))
+
+    path = store.put_bytes(b"reference image", "png")
+
+    relative = os.path.relpath(path, store.root).split(os.sep)
+    assert len(relative) == 3
+    first, second, name = relative
+    assert name.startswith(first + second) and name.endswith(".png")
+    with open(path, "rb") as f:
+        assert f.read() == b"reference image"
+
+def test_identical_content_is_stored_once(tmp_path):
+    store = ContentStore(str(tmp_path / "uploads"))
+
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        paths = list(pool.map(lambda _: store.put_file(io.BytesIO(b"same image"), "png"), range(8)))
+    other = store.put_bytes(b"another image", "png")
+
+    assert len(set(paths)) == 1
+    assert other != paths[0]
+    # No temporary files are left behind
+    assert os.listdir(os.path.join(store.root, ".tmp")) == []
+
+def test_put_image_encodes_png(tmp_path):
+    store = ContentStore(str(tmp_path / "generated"))
+
+    path = store.put_image(Image.new("RGB", (8, 8), "red"))
+
+    assert path.endswith(".png")
+    assert Image.open(path).getpixel((0, 0)) == (255, 0, 0)
+    assert store.put_image(Image.new("RGB", (8, 8), "red")) == path
+
+def test_file_extension():
+    assert file_extension("Portrait.JPG") == "jpg"
+    assert file_extension("../../etc/passwd") == "bin"
+    assert file_extension(None, "png") == "png"
+    assert file_extension("archive.tar.gz") == "gz"
+
+def test_put_stream_stores_chunks_and_discards_failed_streams(tmp_path):
+    store = ContentStore(str(tmp_path / "uploads"))
+
+    async def chunks(fail=False):
+        yield b"streamed "
+        yield b"image"
+        if fail:
+            raise ValueError("too large")
+
+    path = asyncio.run(store.put_stream(chunks(), lambda: "png"))
+    with open(path, "rb") as f:
+        assert f.read() == b"streamed image"
+    assert path == store.put_bytes(b"streamed image", "png")
+
+    with pytest.raises(ValueError):
+        asyncio.run(store.put_stream(chunks(fail=True), "png"))
+    assert os.listdir(os.path.join(store.root, ".tmp")) == []
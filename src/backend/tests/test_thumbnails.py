@@ -0,0 +1,55 @@
+import hashlib
+import os
+
+from PIL import Image
+
+from file_serving import DigestCache
+from storage import ContentStore
+from thumbnails import ThumbnailStore
+
+def _source(tmp_path, name=None, size=(600, 300)):
+    path = tmp_path / "source.png"
+    Image.new("RGB", size, "blue").save(path)
+    if name is None:
+        name = hashlib.sha256(path.read_bytes()).hexdigest()
+    target = tmp_path / f"{name}.png"
+    os.replace(path, target)
+    return str(target)
+
+def test_renders_webp_thumbnails_at_each_size(tmp_path):
+    store = ThumbnailStore(ContentStore(str(tmp_path / "thumbnails")), DigestCache(), sizes=(64, 256))
+    source = _source(tmp_path)
+
+    paths = store.submit(source).result()
+
+    assert set(paths) == {64, 256}
+    with Image.open(paths[64]) as thumbnail:
+        assert thumbnail.format == "WEBP"
+        assert thumbnail.size == (64, 32)
+    with Image.open(paths[256]) as thumbnail:
+        assert thumbnail.size == (256, 128)
+    assert store.find(source, 64) == paths[64]
+    store.shutdown()
+
+def test_existing_thumbnails_are_reused(tmp_path):
+    store = ThumbnailStore(ContentStore(str(tmp_path / "thumbnails")), DigestCache(), sizes=(64,))
+    source = _source(tmp_path)
+
+    first = store.submit(source).result()
+    second = store.submit(source).result()
+
+    assert first == second
+    assert store.rendered == 1
+    store.shutdown()
+
+def test_legacy_files_are_keyed_by_content(tmp_path):
+    store = ThumbnailStore(ContentStore(str(tmp_path / "thumbnails")), DigestCache(), sizes=(64,))
+    legacy = _source(tmp_path, name="generated_1234")
+
+    assert store.find(legacy, 64) is None
+    path = store.submit(legacy).result()[64]
+
+    digest = hashlib.sha256(open(legacy, "rb").read()).hexdigest()
+    assert os.path.basename(path) == f"{digest}-64.webp"
+    assert os.path.dirname(path) == store.store.shard_dir(digest)
+    store.shutdown()
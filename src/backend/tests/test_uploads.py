@@ -0,0 +1,79 @@
+import asyncio
+import io
+
+import pytest
+from fastapi import FastAPI, Request
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.testclient import TestClient
+from PIL import Image
+
+from uploads import ImageHeader, RequestSizeLimitMiddleware, UnsupportedUpload, UploadTooLarge, read_upload
+
+class FakeUpload:
+    def __init__(self, data: bytes, size=None):
+        self._file = io.BytesIO(data)
+        self.size = size
+
+    async def read(self, size: int = -1) -> bytes:
+        return self._file.read(size)
+
+def _image_bytes(format="PNG", size=(16, 8)) -> bytes:
+    buffer = io.BytesIO()
+    Image.new("RGB", size, "red").save(buffer, format=format)
+    return buffer.getvalue()
+
+async def _collect(chunks):
+    return b"".join([chunk async for chunk in chunks])
+
+def test_read_upload_identifies_image_header():
+    data = _image_bytes("JPEG")
+    header = ImageHeader()
+
+    assert asyncio.run(_collect(read_upload(FakeUpload(data), header=header))) == data
+    assert header.format == "JPEG"
+    assert header.size == (16, 8)
+    assert header.extension == "jpg"
+
+def test_read_upload_rejects_oversized_files():
+    data = _image_bytes()
+
+    with pytest.raises(UploadTooLarge):
+        asyncio.run(_collect(read_upload(FakeUpload(data), max_bytes=len(data) - 1)))
+    # The declared size is checked before anything is read
+    with pytest.raises(UploadTooLarge):
+        asyncio.run(_collect(read_upload(FakeUpload(b"", size=100), max_bytes=10)))
+
+def test_read_upload_rejects_non_images_and_large_dimensions():
+    with pytest.raises(UnsupportedUpload):
+        asyncio.run(_collect(read_upload(FakeUpload(b"not an image"), header=ImageHeader())))
+    with pytest.raises(UnsupportedUpload):
+        asyncio.run(_collect(read_upload(FakeUpload(_image_bytes("GIF")), header=ImageHeader())))
+    with pytest.raises(UnsupportedUpload):
+        asyncio.run(_collect(read_upload(FakeUpload(_image_bytes(size=(64, 8))), header=ImageHeader(max_dimension=32))))
+
+def test_request_size_limit():
+    app = FastAPI()
+    app.add_middleware(RequestSizeLimitMiddleware, max_bytes=16)
+
+    @app.post("/echo")
+    async def echo(request: Request):
+        return {"size": len(await request.body())}
+
+    client = TestClient(app)
+    assert client.post("/echo", content=b"x" * 16).json() == {"size": 16}
+    assert client.post("/echo", content=b"x" * 17).status_code == 413
+    # Chunked bodies without a Content-Length are cut off as they arrive
+    assert client.post("/echo", content=iter([b"x" * 10, b"x" * 10])).status_code == 413
+
+def test_request_size_limit_inside_cors():
+    app = FastAPI()
+    app.add_middleware(RequestSizeLimitMiddleware, max_bytes=16)
+    app.add_middleware(CORSMiddleware, allow_origins=["*"])
+
+    @app.post("/echo")
+    async def echo(request: Request):
+        return {"size": len(await request.body())}
+
+    response = TestClient(app).post("/echo", content=b"x" * 17, headers={"Origin": "http://example.com"})
+    assert response.status_code == 413
+    assert response.headers["access-control-allow-origin"] == "*"
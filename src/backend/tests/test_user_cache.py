@@ -0,0 +1,42 @@
+from user_cache import UserCache
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+def test_hits_until_ttl_expires():
+    clock = FakeClock()
+    cache = UserCache(ttl_seconds=60, clock=clock)
+    cache.put("admin", {"id": 1})
+
+    assert cache.get("admin") == {"id": 1}
+    clock.now = 59
+    assert cache.get("admin") == {"id": 1}
+    clock.now = 60
+    assert cache.get("admin") is None
+    assert cache.stats()["hits"] == 2
+    assert cache.stats()["misses"] == 1
+
+def test_invalidate_and_eviction():
+    cache = UserCache(max_entries=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    cache.get("a")
+    cache.put("c", 3)
+
+    # "b" was least recently used
+    assert cache.get("b") is None
+    cache.invalidate("a")
+    assert cache.get("a") is None
+    assert cache.get("c") == 3
+    assert cache.stats()["invalidations"] == 1
+
+def test_disabled_cache_stores_nothing():
+    cache = UserCache(ttl_seconds=0)
+    cache.put("admin", {"id": 1})
+
+    assert cache.get("admin") is None
+    assert len(cache) == 0
@@ -0,0 +1,122 @@
+import logging
+import os
+import tempfile
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Dict, Optional, Sequence
+
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+
+class ThumbnailStore:
+    """
+    WebP thumbnails of stored images at a few fixed sizes.
+
+    Thumbnails are keyed by the content digest of their source image and
+    sharded by a content store, so identical images share thumbnails and a
+    thumbnail's path can be computed without a database lookup. All sizes
+    are rendered from a single decode of the source on a small thread pool,
+    either eagerly when an image is stored or on first request for images
+    that predate the store.
+    """
+
+    def __init__(
+        self,
+        store: Any,
+        digests: Any,
+        sizes: Sequence[int] = (128, 256, 512),
+        quality: int = 80,
+        max_workers: int = 2
+    ):
+        """
+        Initialize the store.
+
+        Args:
+            store: Content store whose root holds the thumbnails and whose
+                shard directories they are filed under
+            digests: Digest cache keying source images by content
+            sizes: Longest side of each thumbnail size, in pixels
+            quality: WebP quality
+            max_workers: Threads rendering thumbnails
+        """
+        self.store = store
+        self.digests = digests
+        self.sizes = tuple(sorted(sizes))
+        self.quality = quality
+        self._tmp = os.path.join(store.root, ".tmp")
+        os.makedirs(self._tmp, exist_ok=True)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="thumbnails")
+        self._pending: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self.rendered = 0
+
+    @property
+    def root(self) -> str:
+        return self.store.root
+
+    def path_for(self, key: str, size: int) -> str:
+        return os.path.join(self.store.shard_dir(key), f"{key}-{size}.webp")
+
+    def find(self, source_path: str, size: int) -> Optional[str]:
+        """Return the path of an already rendered thumbnail, if any."""
+        path = self.path_for(self.digests.get(source_path), size)
+        return path if os.path.exists(path) else None
+
+    def submit(self, source_path: str) -> "Future[Dict[int, str]]":
+        """
+        Render all sizes of a source image in the background.
+
+        Concurrent calls for the same image share one render, and images
+        whose thumbnails already exist are not rendered again.
+
+        Returns:
+            Future of the thumbnail paths by size
+        """
+        with self._lock:
+            future = self._pending.get(source_path)
+            if future is None:
+                future = self._executor.submit(self._render, source_path)
+                self._pending[source_path] = future
+                future.add_done_callback(lambda done: self._finished(source_path, done))
+        return future
+
+    def shutdown(self, wait: bool = True):
+        self._executor.shutdown(wait=wait, cancel_futures=True)
+
+    def _finished(self, source_path: str, future: Future):
+        with self._lock:
+            self._pending.pop(source_path, None)
+        if not future.cancelled() and future.exception() is not None:
+            logger.warning(f"Could not render thumbnails of {source_path}: {future.exception()}")
+
+    def _render(self, source_path: str) -> Dict[int, str]:
+        key = self.digests.get(source_path)
+        paths = {size: self.path_for(key, size) for size in self.sizes}
+        missing = [size for size, path in paths.items() if not os.path.exists(path)]
+        if not missing:
+            return paths
+
+        with Image.open(source_path) as source:
+            image = source.convert("RGBA" if source.mode in ("RGBA", "LA", "P") else "RGB")
+        # Largest first, so each size is resampled from the previous one
+        for size in sorted(missing, reverse=True):
+            image.thumbnail((size, size), Image.LANCZOS)
+            self._write(image, paths[size])
+        with self._lock:
+            self.rendered += len(missing)
+        logger.debug(f"Rendered {len(missing)} thumbnails of {source_path}")
+        return paths
+
+    def _write(self, image: Image.Image, path: str):
+        fd, tmp_path = tempfile.mkstemp(dir=self._tmp)
+        try:
+            with os.fdopen(fd, "wb") as tmp:
+                image.save(tmp, format="WEBP", quality=self.quality, method=4)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
@@ -0,0 +1,167 @@
+import io
+from typing import AsyncIterator, Dict, Optional, Tuple
+
+from PIL import Image
+from starlette.exceptions import HTTPException
+from starlette.responses import PlainTextResponse
+
+CHUNK_SIZE = 1024 * 1024
+
+# Accepted image formats and the extension they are stored under
+IMAGE_FORMATS = {"PNG": "png", "JPEG": "jpg", "WEBP": "webp"}
+
+
+class UploadRejected(ValueError):
+    """An uploaded file failed validation."""
+
+
+class UploadTooLarge(UploadRejected):
+    """An uploaded file exceeds the size limit."""
+
+
+class UnsupportedUpload(UploadRejected):
+    """An uploaded file is not an accepted image."""
+
+
+class ImageHeader:
+    """
+    Identifies an image's format and dimensions from the start of a stream.
+
+    Chunks are fed as they arrive; only the bytes needed to parse the header
+    are kept, and the pixel data is never decoded. Invalid uploads are
+    rejected as soon as the header has been read, before the rest of the
+    file is written anywhere.
+    """
+
+    def __init__(
+        self,
+        formats: Dict[str, str] = IMAGE_FORMATS,
+        max_dimension: Optional[int] = None,
+        max_header_bytes: int = CHUNK_SIZE
+    ):
+        """
+        Initialize the header parser.
+
+        Args:
+            formats: Accepted PIL format names mapped to file extensions
+            max_dimension: Largest accepted width or height in pixels
+            max_header_bytes: Bytes to buffer while looking for the header
+        """
+        self.formats = formats
+        self.max_dimension = max_dimension
+        self.max_header_bytes = max_header_bytes
+        self.format: Optional[str] = None
+        self.size: Optional[Tuple[int, int]] = None
+        self._head = bytearray()
+
+    @property
+    def extension(self) -> str:
+        if self.format is None:
+            raise UnsupportedUpload("Image header has not been read")
+        return self.formats[self.format]
+
+    def feed(self, chunk: bytes):
+        if self.format is not None:
+            return
+        self._head.extend(chunk)
+        if self._identify():
+            return
+        if len(self._head) >= self.max_header_bytes:
+            raise UnsupportedUpload("File is not a supported image")
+
+    def close(self):
+        """Finish the stream; raises if no valid image header was found."""
+        if self.format is None and not self._identify():
+            raise UnsupportedUpload("File is not a supported image")
+
+    def _identify(self) -> bool:
+        try:
+            with Image.open(io.BytesIO(bytes(self._head))) as image:
+                format, size = image.format, image.size
+        except Exception:
+            # Not an image, or the header is not complete yet
+            return False
+        if format not in self.formats:
+            raise UnsupportedUpload(f"Unsupported image format {format}; expected one of {', '.join(self.formats)}")
+        if self.max_dimension and max(size) > self.max_dimension:
+            raise UnsupportedUpload(f"Image is {size[0]}x{size[1]}; the largest accepted side is {self.max_dimension} pixels")
+        self.format, self.size = format, size
+        self._head = bytearray()
+        return True
+
+
+async def read_upload(
+    upload,
+    max_bytes: Optional[int] = None,
+    header: Optional[ImageHeader] = None
+) -> AsyncIterator[bytes]:
+    """
+    Stream an uploaded file in chunks, enforcing the size limit and feeding
+    the image header parser as the data goes by.
+
+    Args:
+        upload: Starlette UploadFile or any object with an async read(size)
+        max_bytes: Largest accepted file size
+        header: Header parser validating the file's format and dimensions
+
+    Yields:
+        Chunks of the file
+    """
+    if max_bytes is not None and getattr(upload, "size", None) is not None and upload.size > max_bytes:
+        raise UploadTooLarge(f"File exceeds the {max_bytes} byte upload limit")
+    received = 0
+    while True:
+        chunk = await upload.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        received += len(chunk)
+        if max_bytes is not None and received > max_bytes:
+            raise UploadTooLarge(f"File exceeds the {max_bytes} byte upload limit")
+        if header is not None:
+            header.feed(chunk)
+        yield chunk
+    if header is not None:
+        header.close()
+
+
+class RequestSizeLimitMiddleware:
+    """
+    Rejects request bodies larger than a limit with 413.
+
+    A declared Content-Length over the limit is refused before any of the
+    body is read. Bodies without one (chunked uploads) are counted as they
+    are received and cut off once they pass the limit, so multipart parsing
+    never spools more than the limit to disk.
+    """
+
+    def __init__(self, app, max_bytes: int):
+        self.app = app
+        self.max_bytes = max_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.max_bytes:
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope["headers"])
+        content_length = headers.get(b"content-length")
+        if content_length is not None and content_length.isdigit() and int(content_length) > self.max_bytes:
+            response = PlainTextResponse(self._detail(), status_code=413)
+            await response(scope, receive, send)
+            return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    raise HTTPException(status_code=413, detail=self._detail())
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+    def _detail(self) -> str:
+        return f"Request body exceeds the {self.max_bytes} byte limit"
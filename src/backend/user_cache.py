@@ -0,0 +1,81 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Tuple
+
+
+class UserCache:
+    """
+    Bounded LRU cache of authenticated users keyed by token subject.
+
+    Saves the user lookup on every authenticated request. Entries expire
+    after a TTL, which bounds how long another process can serve a stale
+    user; within this process, changes to a user invalidate their entry
+    immediately. Cached values should be immutable snapshots (e.g. pydantic
+    models), never ORM instances bound to a session.
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl_seconds: float = 60.0, clock: Callable[[], float] = time.monotonic):
+        """
+        Initialize the cache.
+
+        Args:
+            max_entries: Number of users kept
+            ttl_seconds: How long an entry is served before it is looked up again
+            clock: Time source, replaceable in tests
+        """
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.clock = clock
+        self._entries: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, subject: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(subject)
+            if entry is not None and entry[0] <= self.clock():
+                del self._entries[subject]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(subject)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, subject: str, user: Any):
+        if self.max_entries <= 0 or self.ttl_seconds <= 0:
+            return
+        with self._lock:
+            self._entries[subject] = (self.clock() + self.ttl_seconds, user)
+            self._entries.move_to_end(subject)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, subject: str):
+        """Drop a user, e.g. after they are deactivated or their role changes."""
+        with self._lock:
+            if self._entries.pop(subject, None) is not None:
+                self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self.invalidations += len(self._entries)
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "invalidations": self.invalidations,
+            }
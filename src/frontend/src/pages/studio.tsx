@@ -1,8 +1,8 @@
-import React, { useState } from 'react';
+import React, { useEffect, useRef, useState } from 'react';
 import Head from 'next/head';
 import { useRouter } from 'next/router';
 import { useQuery } from 'react-query';
-import { modelsAPI, layersAPI, generationAPI } from '@/utils/api';
+import { modelsAPI, layersAPI, generationAPI, jobsAPI, waitForJob } from '@/utils/api';
 import { useClientTheme } from '@/contexts/ClientThemeContext';
 
 export default function Studio() {
@@ -16,6 +16,17 @@ export default function Studio() {
   const [prompt, setPrompt] = useState('');
   const [previewCollapsed, setPreviewCollapsed] = useState(false);
   const [generatedImage, setGeneratedImage] = useState<string | null>(null);
+  const activeJobId = useRef<string | null>(null);
+  
+  // Stop rendering an abandoned generation so it does not hold a worker
+  const cancelActiveJob = () => {
+    if (activeJobId.current) {
+      jobsAPI.cancel(activeJobId.current).catch(() => {});
+      activeJobId.current = null;
+    }
+  };
+  
+  useEffect(() => cancelActiveJob, []);
   
   // Fetch model data
   const { data: model } = useQuery(
@@ -48,6 +59,7 @@ export default function Studio() {
   );
   
   const handleGenerate = async () => {
+    cancelActiveJob();
     try {
       const response = await generationAPI.generate({
         model_id: Number(modelId),
@@ -57,7 +69,15 @@ export default function Studio() {
         prompt,
       });
       
-      setGeneratedImage(response.data.image_path);
+      const jobId = response.data.job_id;
+      activeJobId.current = jobId;
+      const result = await waitForJob(jobId);
+      if (activeJobId.current === jobId) {
+        activeJobId.current = null;
+      }
+      if (result) {
+        setGeneratedImage(result.data.image_path);
+      }
     } catch (error) {
       console.error('Error generating image:', error);
     }
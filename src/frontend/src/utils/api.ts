@@ -79,6 +79,27 @@ export const generationAPI = {
   }),
 };
 
+export const jobsAPI = {
+  getStatus: (jobId: string) => api.get(`/jobs/${jobId}`),
+  getResult: (jobId: string) => api.get(`/jobs/${jobId}/result`),
+  cancel: (jobId: string) => api.post(`/jobs/${jobId}/cancel`),
+};
+
+// Poll a generation job until it finishes and return its result,
+// or null if the job was cancelled
+export const waitForJob = async (jobId: string, intervalMs = 1000) => {
+  for (;;) {
+    const { data: job } = await jobsAPI.getStatus(jobId);
+    if (job.status === 'cancelled') {
+      return null;
+    }
+    if (job.status === 'succeeded' || job.status === 'failed') {
+      return jobsAPI.getResult(jobId);
+    }
+    await new Promise((resolve) => setTimeout(resolve, intervalMs));
+  }
+};
+
 export const historyAPI = {
   getAll: (modelId?: number) => api.get('/histories/', { params: { model_id: modelId } }),
   getById: (id: number) => api.get(`/histories/${id}`),